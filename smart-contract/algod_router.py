@@ -0,0 +1,246 @@
+"""
+Route algod calls across several endpoints
+
+AlgodRouter can be passed anywhere an algod.AlgodClient is expected (helper.py, deploy.py, ...).
+Endpoints are health-checked by last-round lag and latency, reads (the AlgodClient methods in
+read_methods) are spread round-robin across the healthy ones, and submissions plus their
+confirmation polling stay on a single endpoint, falling back to the other endpoints if it goes
+down. compile also uses that endpoint, and any other method is sent to it once, without retrying.
+"""
+
+import collections
+import itertools
+import threading
+import time
+
+from algosdk.error import AlgodHTTPError
+from algosdk.v2client import algod
+
+# AlgodClient methods that only read, and so may be spread across endpoints and retried elsewhere
+read_methods = (
+    "account_info", "account_asset_info", "account_assets_info", "account_application_info",
+    "account_applications_info", "asset_info", "application_info", "application_boxes", "application_box_by_name",
+    "block_info", "get_block_hash", "get_block_txids", "get_ledger_state_delta",
+    "get_ledger_state_delta_for_transaction_group", "get_transaction_group_ledger_state_deltas_for_round",
+    "ledger_supply", "pending_transactions", "pending_transactions_by_address", "suggested_params", "versions",
+    "health", "ready", "genesis", "get_sync_round", "get_timestamp_offset", "transaction_proof",
+    "lightblockheader_proof", "stateproofs", "disassemble",
+)
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """
+    Return whether an error means the endpoint itself is unusable
+    rather than the request being invalid (a rejected transaction, an unknown app, ...)
+    """
+    if not isinstance(error, AlgodHTTPError):
+        return True
+    return error.code is None or error.code == 429 or error.code >= 500
+
+
+class Endpoint:
+    """Health record of one algod client"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.healthy = True
+        self.last_round = 0
+        self.latency = 0.0
+
+    def __repr__(self):
+        return f"Endpoint({self.name}, healthy={self.healthy}, last_round={self.last_round}, latency={self.latency:.3f})"
+
+
+class AlgodRouter:
+    """
+    Drop-in replacement for algod.AlgodClient over several algod endpoints
+    An endpoint is healthy when it answers status() and is at most max_round_lag rounds
+    behind the most advanced endpoint. Health is rechecked every health_check_interval seconds
+    and immediately whenever an endpoint fails.
+    """
+
+    def __init__(self, clients, max_round_lag=2, health_check_interval=10.0, max_pinned=10000, max_pin_seconds=30.0):
+        if not clients:
+            raise ValueError("at least one algod client is required")
+        self.endpoints = [Endpoint(client, str(i)) for i, client in enumerate(clients)]
+        self.max_round_lag = max_round_lag
+        self.health_check_interval = health_check_interval
+        self.last_health_check = None
+        self.write_endpoint = None
+        # tx_id -> endpoint the transaction was submitted to, only that node's pool knows about it
+        self.pinned = collections.OrderedDict()
+        self.max_pinned = max_pinned
+        # tx_id -> submission time of the transactions not yet seen confirmed, oldest first; status()
+        # follows the write endpoint while one is younger than max_pin_seconds
+        self.unconfirmed = collections.OrderedDict()
+        self.max_pin_seconds = max_pin_seconds
+        self.lock = threading.RLock()
+        self.read_counter = itertools.count()
+
+    @classmethod
+    def from_addresses(cls, algod_addresses, algod_token="", algod_headers=None, **kwargs):
+        """Create a router over algod clients for each of the given addresses"""
+        clients = [algod.AlgodClient(algod_token, address, algod_headers) for address in algod_addresses]
+        router = cls(clients, **kwargs)
+        for endpoint, address in zip(router.endpoints, algod_addresses):
+            endpoint.name = address
+        return router
+
+    def check_health(self):
+        """Probe every endpoint with status() and update lag, latency and the healthy set"""
+        # the probes run outside the lock so a slow endpoint does not hold up other threads
+        probes = []
+        for endpoint in self.endpoints:
+            start = time.perf_counter()
+            try:
+                last_round = endpoint.client.status()["last-round"]
+                probes.append((endpoint, last_round, time.perf_counter() - start))
+            except Exception:
+                probes.append((endpoint, None, None))
+        with self.lock:
+            for endpoint, last_round, latency in probes:
+                endpoint.healthy = last_round is not None
+                if endpoint.healthy:
+                    endpoint.last_round, endpoint.latency = last_round, latency
+            reachable = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if reachable:
+                max_round = max(endpoint.last_round for endpoint in reachable)
+                for endpoint in reachable:
+                    endpoint.healthy = max_round - endpoint.last_round <= self.max_round_lag
+            self.last_health_check = time.monotonic()
+            if self.write_endpoint is not None and not self.write_endpoint.healthy:
+                self.write_endpoint = None
+
+    def _healthy(self):
+        with self.lock:
+            return sorted((e for e in self.endpoints if e.healthy), key=lambda endpoint: endpoint.latency)
+
+    def healthy_endpoints(self):
+        """Return the healthy endpoints ordered by latency, rechecking health when it is stale"""
+        with self.lock:
+            last_health_check = self.last_health_check
+        if last_health_check is None or time.monotonic() - last_health_check > self.health_check_interval:
+            self.check_health()
+        healthy = self._healthy()
+        if not healthy:
+            # a fresh check may find endpoints that have recovered since the last one
+            self.check_health()
+            healthy = self._healthy()
+        if not healthy:
+            raise ConnectionError("no healthy algod endpoint")
+        return healthy
+
+    def _mark_unhealthy(self, endpoint):
+        with self.lock:
+            endpoint.healthy = False
+
+    def _write(self):
+        with self.lock:
+            if self.write_endpoint is not None and self.write_endpoint.healthy:
+                return self.write_endpoint
+        candidate = self.healthy_endpoints()[0]
+        with self.lock:
+            if self.write_endpoint is None or not self.write_endpoint.healthy:
+                self.write_endpoint = candidate
+            return self.write_endpoint
+
+    def _call_write(self, method, *args, **kwargs):
+        # calls that should see what was submitted, moving to a new write endpoint if the current one fails
+        endpoint = self._write()
+        try:
+            return getattr(endpoint.client, method)(*args, **kwargs)
+        except Exception as e:
+            if not is_endpoint_failure(e):
+                raise
+            self._mark_unhealthy(endpoint)
+        return getattr(self._write().client, method)(*args, **kwargs)
+
+    def _read(self, method, *args, **kwargs):
+        # reads are idempotent, so a failing endpoint is marked unhealthy and the call retried elsewhere
+        for attempt in range(len(self.endpoints)):
+            healthy = self.healthy_endpoints()
+            endpoint = healthy[next(self.read_counter) % len(healthy)]
+            try:
+                return getattr(endpoint.client, method)(*args, **kwargs)
+            except Exception as e:
+                if not is_endpoint_failure(e) or attempt == len(self.endpoints) - 1:
+                    raise
+                self._mark_unhealthy(endpoint)
+
+    def _call_write_once(self, method, *args, **kwargs):
+        # calls that may change the node's state are not retried elsewhere, a failed endpoint is only marked
+        endpoint = self._write()
+        try:
+            return endpoint, getattr(endpoint.client, method)(*args, **kwargs)
+        except Exception as e:
+            if is_endpoint_failure(e):
+                self._mark_unhealthy(endpoint)
+            raise
+
+    def _submit(self, method, *args, **kwargs):
+        endpoint, tx_id = self._call_write_once(method, *args, **kwargs)
+        with self.lock:
+            self.pinned[tx_id] = endpoint
+            self.unconfirmed[tx_id] = time.monotonic()
+            if len(self.pinned) > self.max_pinned:
+                old_tx_id, _ = self.pinned.popitem(last=False)
+                self.unconfirmed.pop(old_tx_id, None)
+        return tx_id
+
+    def send_transactions(self, txns, **kwargs):
+        return self._submit("send_transactions", txns, **kwargs)
+
+    def send_transaction(self, txn, **kwargs):
+        return self._submit("send_transaction", txn, **kwargs)
+
+    def send_raw_transaction(self, txn, **kwargs):
+        return self._submit("send_raw_transaction", txn, **kwargs)
+
+    def pending_transaction_info(self, transaction_id, **kwargs):
+        with self.lock:
+            endpoint = self.pinned.get(transaction_id)
+        if endpoint is not None:
+            try:
+                info = endpoint.client.pending_transaction_info(transaction_id, **kwargs)
+            except Exception as e:
+                if not is_endpoint_failure(e):
+                    raise
+                # the pool that held the transaction is gone, other nodes can still report it once confirmed
+                self._mark_unhealthy(endpoint)
+                with self.lock:
+                    self.pinned.pop(transaction_id, None)
+                    self.unconfirmed.pop(transaction_id, None)
+                endpoint = None
+        if endpoint is None:
+            info = self._read("pending_transaction_info", transaction_id, **kwargs)
+        if info.get("confirmed-round") or info.get("pool-error"):
+            with self.lock:
+                self.unconfirmed.pop(transaction_id, None)
+        return info
+
+    def status(self, **kwargs):
+        # while recent submissions await confirmation, status comes from the node they were sent to;
+        # a submission that is never polled to confirmation stops pinning after max_pin_seconds
+        with self.lock:
+            expired = time.monotonic() - self.max_pin_seconds
+            while self.unconfirmed and next(iter(self.unconfirmed.values())) < expired:
+                self.unconfirmed.popitem(last=False)
+            awaiting_confirmation = bool(self.unconfirmed)
+        if awaiting_confirmation:
+            return self._call_write("status", **kwargs)
+        return self._read("status", **kwargs)
+
+    def status_after_block(self, block_num=None, round_num=None, **kwargs):
+        return self._call_write("status_after_block", block_num=block_num, round_num=round_num, **kwargs)
+
+    def compile(self, source, **kwargs):
+        # compiling changes nothing, so it may move to another write endpoint when the current one fails
+        return self._call_write("compile", source, **kwargs)
+
+    def __getattr__(self, method):
+        # the known reads are spread, anything else might write and goes to the write endpoint
+        if method.startswith("_"):
+            raise AttributeError(method)
+        if method in read_methods:
+            return lambda *args, **kwargs: self._read(method, *args, **kwargs)
+        return lambda *args, **kwargs: self._call_write_once(method, *args, **kwargs)[1]
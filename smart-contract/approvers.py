@@ -0,0 +1,120 @@
+"""
+Delegated voter approval
+
+The creator of an election can register up to election_params.max_approvers approver accounts
+(add_approver/remove_approver), each of which may then approve or reject voters like the creator.
+send_approvals splits a list of approvals into atomic groups and submits them from every approver
+key at once, one thread per approver, so approval throughput grows with the number of signers.
+A group is applied all or nothing, so with isolate_failures the calls of a rejected group are
+resent one at a time and only the calls the node still rejects are left out.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk import account, constants, transaction
+from algosdk.encoding import decode_address
+from algosdk.error import AlgodHTTPError
+
+from election_model import approver_prefix
+from helper import read_global_state, sign_transaction, wait_for_confirmation
+from sharded_election import shard_app_id
+
+
+def read_approvers(client, app_id) -> list:
+    """
+    Return the addresses registered as approvers of an election app
+    """
+    return sorted(key[len(approver_prefix):] for key in read_global_state(client, app_id)
+                  if key.startswith(approver_prefix))
+
+
+def _call_each_app(client, creator_private_key, index, app_args):
+    # a sharded election registers its approvers with every shard
+    sender = account.address_from_private_key(creator_private_key)
+    for app_id in [index] if isinstance(index, int) else index:
+        params = client.suggested_params()
+        txn = transaction.ApplicationNoOpTxn(sender, params, app_id, app_args)
+        signed_txn = sign_transaction(txn, creator_private_key)
+        tx_id = signed_txn.transaction.get_txid()
+        client.send_transactions([signed_txn])
+        wait_for_confirmation(client, tx_id)
+
+
+def add_approver(client, creator_private_key, index, approver_address):
+    """
+    Register approver_address as an approver, index may be the list of shard app ids of a sharded election
+    """
+    _call_each_app(client, creator_private_key, index, [b"add_approver", decode_address(approver_address)])
+
+
+def remove_approver(client, creator_private_key, index, approver_address):
+    """
+    Unregister an approver, index may be the list of shard app ids of a sharded election
+    """
+    _call_each_app(client, creator_private_key, index, [b"remove_approver", decode_address(approver_address)])
+
+
+def send_approval_group(client, index, private_key, approvals):
+    """
+    Send update_user_status calls for (address, status) pairs as one atomic group signed by
+    private_key, the creator's or an approver's, and wait for its confirmation
+    """
+    sender = account.address_from_private_key(private_key)
+    params = client.suggested_params()
+    txns = [transaction.ApplicationNoOpTxn(sender, params, shard_app_id(index, address),
+                                           [b"update_user_status", decode_address(address), status.encode("utf-8")],
+                                           accounts=[sender, address])
+            for address, status in approvals]
+    if len(txns) > 1:
+        transaction.assign_group_id(txns)
+    signed_txns = [sign_transaction(txn, private_key) for txn in txns]
+    client.send_transactions(signed_txns)
+    wait_for_confirmation(client, signed_txns[-1].transaction.get_txid())
+
+
+def _send_isolating_failures(client, index, private_key, group) -> list:
+    # resend the calls of a rejected group one by one, returning the (address, status, reason) still rejected
+    try:
+        send_approval_group(client, index, private_key, group)
+        return []
+    except AlgodHTTPError as e:
+        if len(group) == 1:
+            return [(*group[0], str(e))]
+    rejected = []
+    for approval in group:
+        try:
+            send_approval_group(client, index, private_key, [approval])
+        except AlgodHTTPError as e:
+            rejected.append((*approval, str(e)))
+    return rejected
+
+
+def send_approvals(client, index, private_keys, approvals, group_size=constants.tx_group_limit,
+                   isolate_failures=False) -> list:
+    """
+    Send update_user_status calls for (address, status) pairs from every key of private_keys concurrently
+    The approvals are cut into groups of group_size and dealt out to the keys in turn; each key
+    sends its groups one after another. Raise the first error once every key has finished.
+    With isolate_failures, a group the node rejects is resent one call at a time; return the
+    (address, status, reason) of the calls that were still rejected. Other errors, such as an
+    unreachable node, are raised as before
+    """
+    groups = [approvals[i:i + group_size] for i in range(0, len(approvals), group_size)]
+
+    def send_share(share):
+        private_key, own_groups = share
+        rejected = []
+        for group in own_groups:
+            if isolate_failures:
+                rejected += _send_isolating_failures(client, index, private_key, group)
+            else:
+                send_approval_group(client, index, private_key, group)
+        return rejected
+
+    if len(private_keys) == 1:
+        return send_share((private_keys[0], groups))
+
+    shares = [(private_key, groups[i::len(private_keys)]) for i, private_key in enumerate(private_keys)]
+    with ThreadPoolExecutor(max_workers=len(private_keys)) as executor:
+        futures = [executor.submit(send_share, share) for share in shares if share[1]]
+    return [entry for future in futures for entry in future.result()]
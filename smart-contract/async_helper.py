@@ -0,0 +1,350 @@
+"""
+asyncio counterparts of the helper functions and transaction helpers
+
+Mirrors helper.py (wait_for_confirmation, wait_for_round, read_local_state, read_global_state) and the
+transaction helpers of deploy.py/simple_tests.py, so many voter operations can be in flight on one thread.
+Every function takes an async algod client: AsyncAlgodClient talks to a real node over HTTP,
+local_algod.AsyncLocalAlgod wraps the local stand-in for offline use. Cancelling a task cancels its pending reads.
+"""
+
+import asyncio
+import base64
+import json
+from urllib.parse import urlsplit
+
+from algosdk import account, encoding, transaction
+from algosdk.encoding import decode_address
+from algosdk.error import AlgodHTTPError
+from pyteal import compileTeal, Mode
+
+from election_params import compact_local_bytes, compact_local_ints, global_bytes, global_ints, local_bytes, \
+    local_ints
+from election_smart_contract import approval_program, clear_state_program
+from helper import parse_global_state, parse_local_state, sign_transaction
+from sharded_election import shard_app_id
+
+# the state schemas deploy.py declares, built here so this module does not load deploy's accounts
+global_schema = transaction.StateSchema(global_ints, global_bytes)
+local_schema = transaction.StateSchema(local_ints, local_bytes)
+compact_local_schema = transaction.StateSchema(compact_local_ints, compact_local_bytes)
+
+
+async def _read_response(reader):
+    # (status, headers, body) of one HTTP/1.1 response, with a Content-Length or chunked body
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("algod closed the connection")
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while await reader.readline() not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        # the body runs until the server closes the connection
+        body = await reader.read()
+        headers["connection"] = "close"
+    return status, headers, body
+
+
+class AsyncAlgodClient:
+    """
+    Minimal asyncio algod v2 REST client covering the calls used by the helpers
+    It speaks HTTP/1.1 over asyncio streams and keeps up to max_idle connections alive for reuse.
+    Use it as an async context manager, or call close() when done
+    """
+
+    def __init__(self, algod_token, algod_address, headers=None, max_idle=10):
+        url = urlsplit(algod_address)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
+        self.ssl = url.scheme == "https"
+        self.base_path = url.path.rstrip("/")
+        self.headers = {"X-Algo-API-Token": algod_token} if algod_token else {}
+        self.headers.update(headers or {})
+        self.max_idle = max_idle
+        # (reader, writer) of the open connections no request is using
+        self.idle = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for _, writer in idle:
+            writer.close()
+        for _, writer in idle:
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def _request_bytes(self, method, path, data, content_type):
+        lines = [f"{method} {self.base_path}{path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 f"Content-Length: {len(data or b'')}"]
+        lines += [f"{name}: {value}" for name, value in self.headers.items()]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + (data or b"")
+
+    async def _request(self, method, path, data=None, content_type=None):
+        request = self._request_bytes(method, path, data, content_type)
+        while True:
+            reused = bool(self.idle)
+            reader, writer = self.idle.pop() if reused else await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl or None)
+            try:
+                writer.write(request)
+                await writer.drain()
+                status, headers, body = await _read_response(reader)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # the server may have dropped an idle connection, which is retried on a new one
+                if not reused:
+                    raise
+            except BaseException:
+                # a cancelled or failed request leaves the connection mid-response, it cannot be reused
+                writer.close()
+                raise
+        if headers.get("connection", "").lower() == "close" or len(self.idle) >= self.max_idle:
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+        body = json.loads(body) if body else {}
+        if status >= 400:
+            raise AlgodHTTPError(body.get("message", str(body)) if isinstance(body, dict) else str(body), code=status)
+        return body
+
+    async def status(self):
+        return await self._request("GET", "/v2/status")
+
+    async def status_after_block(self, block_num):
+        return await self._request("GET", f"/v2/status/wait-for-block-after/{block_num}")
+
+    async def suggested_params(self):
+        params = await self._request("GET", "/v2/transactions/params")
+        return transaction.SuggestedParams(
+            params["fee"],
+            params["last-round"],
+            params["last-round"] + 1000,
+            params["genesis-hash"],
+            params["genesis-id"],
+            consensus_version=params["consensus-version"],
+            min_fee=params["min-fee"],
+        )
+
+    async def compile(self, source):
+        return await self._request("POST", "/v2/teal/compile", data=source.encode("utf-8"), content_type="text/plain")
+
+    async def disassemble(self, program):
+        return await self._request("POST", "/v2/teal/disassemble", data=program, content_type="application/x-binary")
+
+    async def send_transactions(self, txns):
+        raw = b"".join(base64.b64decode(encoding.msgpack_encode(txn)) for txn in txns)
+        response = await self._request("POST", "/v2/transactions", data=raw, content_type="application/x-binary")
+        return response["txId"]
+
+    async def pending_transaction_info(self, transaction_id):
+        return await self._request("GET", f"/v2/transactions/pending/{transaction_id}")
+
+    async def account_info(self, address):
+        return await self._request("GET", f"/v2/accounts/{address}")
+
+    async def application_info(self, application_id):
+        return await self._request("GET", f"/v2/applications/{application_id}")
+
+
+async def compile_program(client, source_code: str) -> bytes:
+    """
+    Compile the program source code and return the resulting bytecode
+    """
+    compile_response = await client.compile(source_code)
+    return base64.b64decode(compile_response["result"])
+
+
+async def wait_for_confirmation(client, tx_id: str):
+    """
+    Wait for confirmation of a given transaction ID
+    """
+    last_round = (await client.status()).get("last-round")
+    tx_info = await client.pending_transaction_info(tx_id)
+    while not (tx_info.get("confirmed-round") and tx_info.get("confirmed-round") > 0):
+        last_round += 1
+        await client.status_after_block(last_round)
+        tx_info = await client.pending_transaction_info(tx_id)
+    return tx_info
+
+
+async def wait_for_round(client, round: int):
+    last_round = (await client.status()).get("last-round")
+    while last_round < round:
+        last_round += 1
+        await client.status_after_block(last_round)
+
+
+async def read_local_state(client, addr, app_id):
+    """
+    Read user local state assuming all keys and values are string
+    """
+    return parse_local_state(await client.account_info(addr), app_id)
+
+
+async def read_global_state(client, app_id):
+    """
+    Read global state assuming all keys and values are string
+    """
+    return parse_global_state(await client.application_info(app_id))
+
+
+async def _gather_limited(read, items, concurrency):
+    # await read(item) for every item with at most concurrency reads in flight, results in order
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(item):
+        async with semaphore:
+            return await read(item)
+
+    return await asyncio.gather(*(limited(item) for item in items))
+
+
+async def read_local_states(client, addresses, app_id, concurrency=10):
+    """
+    Read the local state of many users concurrently, at most concurrency reads at a time
+    Return a dict mapping each address to its local state
+    """
+    states = await _gather_limited(lambda addr: read_local_state(client, addr, app_id), addresses, concurrency)
+    return dict(zip(addresses, states))
+
+
+async def read_global_states(client, app_ids, concurrency=10):
+    """
+    Read the global state of many apps concurrently, at most concurrency reads at a time
+    Return a dict mapping each app id to its global state
+    """
+    states = await _gather_limited(lambda app_id: read_global_state(client, app_id), app_ids, concurrency)
+    return dict(zip(app_ids, states))
+
+
+async def _sign_send_and_confirm(client, txn, private_key):
+    signed_txn = sign_transaction(txn, private_key)
+    tx_id = signed_txn.transaction.get_txid()
+    await client.send_transactions([signed_txn])
+    return await wait_for_confirmation(client, tx_id)
+
+
+async def create_app(client, private_key, approval_program, clear_program, global_schema, local_schema, app_args):
+    """
+    Create a new application and return its ID, see deploy.create_app
+    """
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    txn = transaction.ApplicationCreateTxn(sender, params, transaction.OnComplete.NoOpOC.real, approval_program,
+                                           clear_program, global_schema, local_schema, app_args)
+    tx_info = await _sign_send_and_confirm(client, txn, private_key)
+    return tx_info["application-index"]
+
+
+async def create_vote_app(client, creator_private_key, election_end, num_vote_options, vote_options,
+                          compact_status=False, shard_index=None, num_shards=None, optimize=False):
+    """
+    Create/Deploy the voting app and return its ID, see deploy.create_vote_app
+    """
+    approval_program_teal = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+    clear_state_program_teal = compileTeal(clear_state_program(compact_status), mode=Mode.Application, version=5)
+    approval_program_compiled = await compile_program(client, approval_program_teal)
+    clear_state_program_compiled = await compile_program(client, clear_state_program_teal)
+    if optimize:
+        from teal_optimizer import optimize_programs, select_assembled
+
+        optimized_teals = optimize_programs(approval_program_teal, clear_state_program_teal)
+        assembled = []
+        for compiled, optimized_teal in zip((approval_program_compiled, clear_state_program_compiled),
+                                            optimized_teals):
+            optimized_compiled = await compile_program(client, optimized_teal)
+            assembled.append((compiled, optimized_compiled, (await client.disassemble(optimized_compiled))["result"]))
+        approval_program_compiled, clear_state_program_compiled = select_assembled(
+            approval_program_teal, clear_state_program_teal, assembled)
+    application_args = [election_end, num_vote_options, vote_options]
+    if num_shards is not None:
+        application_args += [shard_index, num_shards]
+    return await create_app(
+        client,
+        creator_private_key,
+        approval_program_compiled,
+        clear_state_program_compiled,
+        global_schema,
+        compact_local_schema if compact_status else local_schema,
+        application_args,
+    )
+
+
+async def opt_in_app(client, private_key, index):
+    """ OPT IN TO APPLICATION, index may be the list of shard app ids of a sharded election """
+    sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
+    params = await client.suggested_params()
+    return await _sign_send_and_confirm(client, transaction.ApplicationOptInTxn(sender, params, index), private_key)
+
+
+async def call_app_approve_voter(client, index, creator_private_key, user_address, yes_or_no_bytes):
+    """ CREATOR TO APPROVE VOTER, index may be the list of shard app ids of a sharded election """
+    index = shard_app_id(index, user_address)
+    app_args = [b"update_user_status", decode_address(user_address), yes_or_no_bytes]
+    sender = account.address_from_private_key(creator_private_key)
+    params = await client.suggested_params()
+    txn = transaction.ApplicationNoOpTxn(sender, params, index, app_args, accounts=[sender, user_address])
+    return await _sign_send_and_confirm(client, txn, creator_private_key)
+
+
+async def call_app(client, private_key, index, app_args):
+    """ CALL APPLICATION, index may be the list of shard app ids of a sharded election """
+    sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
+    params = await client.suggested_params()
+    return await _sign_send_and_confirm(client, transaction.ApplicationNoOpTxn(sender, params, index, app_args),
+                                        private_key)
+
+
+async def close_out_app(client, private_key, index):
+    """ CLOSE OUT FROM APPLICATION, index may be the list of shard app ids of a sharded election """
+    sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
+    params = await client.suggested_params()
+    return await _sign_send_and_confirm(client, transaction.ApplicationCloseOutTxn(sender, params, index),
+                                        private_key)
+
+
+async def clear_state_app(client, private_key, index):
+    """ CLEAR STATE OF APPLICATION, index may be the list of shard app ids of a sharded election """
+    sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
+    params = await client.suggested_params()
+    return await _sign_send_and_confirm(client, transaction.ApplicationClearStateTxn(sender, params, index),
+                                        private_key)
+
+
+async def delete_app(client, private_key, index):
+    """ DELETE APPLICATION """
+    sender = account.address_from_private_key(private_key)
+    params = await client.suggested_params()
+    return await _sign_send_and_confirm(client, transaction.ApplicationDeleteTxn(sender, params, index),
+                                        private_key)
@@ -0,0 +1,87 @@
+"""
+Benchmark local election simulations with in-memory and SQLite-backed ledger state
+
+For each election size this runs the full voting flow (opt in, approval, vote) through a LocalLedger
+in a fresh process and reports the time taken and the process's peak resident memory.
+Pass voter counts as arguments to override the default sizes, e.g. python bench_ledger_store.py 1000000
+"""
+
+import hashlib
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from algosdk.encoding import decode_address, encode_address
+
+from helper import int_to_bytes
+from ledger_store import SqliteLedgerStore
+from local_algod import LocalLedger
+
+election_sizes = [10000, 100000]
+txns_per_round = 1000
+num_vote_options = 4
+
+
+def voter_calls(app_id, creator, num_voters):
+    # generated lazily so the benchmark itself holds no per-voter data
+    def voter(i):
+        return encode_address(hashlib.sha256(f"voter-{i}".encode()).digest())
+
+    for i in range(num_voters):
+        yield voter(i), app_id, "optin", []
+    for i in range(num_voters):
+        yield creator, app_id, "noop", [b"update_user_status", decode_address(voter(i)), b"yes"]
+    for i in range(num_voters):
+        yield voter(i), app_id, "noop", [b"vote", int_to_bytes(i % num_vote_options)]
+
+
+def simulate(num_voters, store_path, results):
+    store = SqliteLedgerStore(store_path) if store_path else None
+    ledger = LocalLedger(store=store, keep_history=False)
+    creator = encode_address(hashlib.sha256(b"creator").digest())
+
+    start = time.perf_counter()
+    create_args = [int_to_bytes(10 ** 9), int_to_bytes(num_vote_options), b"A,B,C,D"]
+    app_id = ledger.apply("create", creator, 0, "noop", create_args)
+    app_id = ledger.tx_info[app_id]["application-index"]
+    ledger.produce_block()
+    for i, (sender, index, on_complete, app_args) in enumerate(voter_calls(app_id, creator, num_voters)):
+        ledger.apply(f"txn-{i}", sender, index, on_complete, app_args)
+        if i % txns_per_round == txns_per_round - 1:
+            ledger.produce_block()
+    ledger.produce_block()
+    elapsed = time.perf_counter() - start
+
+    votes = sum(ledger.apps[app_id]["global"][f"VotesFor{i}"] for i in range(num_vote_options))
+    assert votes == num_voters
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+    if store is not None:
+        store.close()
+
+
+def run(num_voters, store_path):
+    # a fresh process per run, so each peak memory figure is its own
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=simulate, args=(num_voters, store_path, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or election_sizes
+    print(f"{'voters':>9} {'memory (s)':>11} {'memory (MB)':>12} {'sqlite (s)':>11} {'sqlite (MB)':>12}")
+    for num_voters in sizes:
+        memory_time, memory_peak = run(num_voters, None)
+        with tempfile.TemporaryDirectory() as store_dir:
+            sqlite_time, sqlite_peak = run(num_voters, os.path.join(store_dir, "ledger.sqlite"))
+        print(f"{num_voters:>9} {memory_time:>11.1f} {memory_peak:>12.1f} {sqlite_time:>11.1f} {sqlite_peak:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
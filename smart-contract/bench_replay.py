@@ -0,0 +1,47 @@
+"""
+Benchmark historical state queries against election size
+
+For each election size this replays a synthetic election from the local transaction source
+and compares query time for random rounds with and without on-disk checkpoints.
+"""
+
+import random
+import tempfile
+import time
+
+from ledger_replay import LedgerReplay, LocalTransactionSource, generate_election_transactions
+
+election_sizes = [1000, 10000, 50000]
+checkpoint_interval = 100
+num_queries = 20
+
+
+def time_queries(replay, rounds):
+    start = time.perf_counter()
+    for round in rounds:
+        replay.state_at(round)
+    return (time.perf_counter() - start) / len(rounds)
+
+
+def main():
+    print(f"{'voters':>8} {'rounds':>8} {'full replay (ms)':>18} {'checkpointed (ms)':>18}")
+    for num_voters in election_sizes:
+        app_id = num_voters
+        source = LocalTransactionSource(generate_election_transactions(app_id, num_voters))
+        last_round = source.rounds[-1]
+        rounds = [random.randint(1, last_round) for _ in range(num_queries)]
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            # an interval past the last round means every query replays from the start
+            full = LedgerReplay(source, app_id, checkpoint_dir + "/full", checkpoint_interval=last_round + 1)
+            full_time = time_queries(full, rounds)
+
+            checkpointed = LedgerReplay(source, app_id, checkpoint_dir + "/cp", checkpoint_interval)
+            checkpointed.build_checkpoints(last_round)
+            checkpointed_time = time_queries(checkpointed, rounds)
+
+        print(f"{num_voters:>8} {last_round:>8} {full_time * 1000:>18.2f} {checkpointed_time * 1000:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
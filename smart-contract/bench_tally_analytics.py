@@ -0,0 +1,96 @@
+"""
+Benchmark tally reporting over many synthetic elections served by a local algod stand-in
+
+For each number of elections this compares the per-election loop (read_global_state, split
+VoteOptions, pull VotesFor{i} out of the dict, compute the statistics in Python) with
+tally_analytics: concurrent reads of only the tally entries and vectorized statistics.
+Every algod call takes latency seconds, as a round trip to a node would.
+Pass election counts as arguments to override the default sizes, e.g. python bench_tally_analytics.py 100000
+"""
+
+import hashlib
+import random
+import sys
+import time
+
+from algosdk.encoding import encode_address
+
+from helper import int_to_bytes, read_global_state
+from local_algod import LocalAlgod, LocalLedger
+from tally_analytics import load_tallies, summarize
+
+election_sizes = [100, 1000, 10000]
+latency = 0.001
+max_workers = 32
+
+
+def synthetic_elections(num_elections, seed=0):
+    # elections with 2 to 8 options and random tallies, written straight into the ledger's state
+    rng = random.Random(seed)
+    ledger = LocalLedger(keep_history=False)
+    creator = encode_address(hashlib.sha256(b"creator").digest())
+    app_ids = []
+    for i in range(num_elections):
+        num_vote_options = rng.randrange(2, 9)
+        options = ",".join(f"Option{j}" for j in range(num_vote_options)).encode()
+        tx_id = ledger.apply(f"create-{i}", creator, 0, "noop", [int_to_bytes(10 ** 9), int_to_bytes(num_vote_options),
+                                                               options])
+        app_id = ledger.tx_info[tx_id]["application-index"]
+        for j in range(num_vote_options):
+            ledger.apps[app_id]["global"][f"VotesFor{j}"] = rng.randrange(10000)
+        app_ids.append(app_id)
+    ledger.produce_block()
+    return ledger, app_ids
+
+
+def report_loop(client, app_ids):
+    # the per-election reporting loop tally_analytics replaces
+    report = {}
+    for app_id in app_ids:
+        state = read_global_state(client, app_id)
+        options = state["VoteOptions"].split(",")
+        votes = [state[f"VotesFor{i}"] for i in range(state["NumVoteOptions"])]
+        total = sum(votes)
+        ranked = sorted(votes, reverse=True)
+        winner = votes.index(ranked[0])
+        margin = ranked[0] - (ranked[1] if len(ranked) > 1 else 0)
+        report[app_id] = {
+            "total": total,
+            "shares": [count / total if total else 0.0 for count in votes],
+            "winner": options[winner],
+            "margin": margin,
+        }
+    return report
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or election_sizes
+    print(f"{'elections':>9} {'loop (s)':>9} {'fetch (s)':>10} {'compute (ms)':>13} {'loop compute (ms)':>18}")
+    for num_elections in sizes:
+        ledger, app_ids = synthetic_elections(num_elections)
+        client = LocalAlgod(ledger, latency=latency)
+
+        start = time.perf_counter()
+        report = report_loop(client, app_ids)
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tallies = load_tallies(client, app_ids, max_workers=max_workers)
+        fetch_time = time.perf_counter() - start
+        start = time.perf_counter()
+        summary = summarize(tallies)
+        compute_time = time.perf_counter() - start
+        assert summary["totals"].tolist() == [report[app_id]["total"] for app_id in app_ids]
+        assert summary["margins"].tolist() == [report[app_id]["margin"] for app_id in app_ids]
+
+        # the statistics alone, without the reads, for the loop
+        client.latency = 0.0
+        start = time.perf_counter()
+        report_loop(client, app_ids)
+        loop_compute_time = time.perf_counter() - start
+        print(f"{num_elections:>9} {loop_time:>9.2f} {fetch_time:>10.2f} {compute_time * 1000:>13.1f} "
+              f"{loop_compute_time * 1000:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,17 @@ import subprocess
 from algosdk import transaction
 from algosdk import account, mnemonic
 from algosdk.v2client import algod
-from examples.application.asset import approval_program, clear_state_program
+from election_smart_contract import approval_program, clear_state_program, coordinator_program, \
+    coordinator_clear_state_program
 from pyteal import *
 
 from secrets import account_mnemonics
 from election_params import local_ints, local_bytes, global_ints, \
-    global_bytes, relative_election_end, num_vote_options, vote_options
-from helper import compile_program, wait_for_confirmation, int_to_bytes, read_global_state, read_local_state
+    global_bytes, relative_election_end, num_vote_options, vote_options, compact_local_ints, compact_local_bytes, \
+    num_shards
+from helper import compile_program, wait_for_confirmation, int_to_bytes, read_global_state, read_local_state, \
+    sign_transaction
+from teal_optimizer import optimize_programs, select_assembled
 from secrets import account_mnemonics, algod_token, algod_address, algod_headers
 from election_params import vote_options, num_vote_options
 
@@ -21,6 +25,8 @@ account_addresses = [account.address_from_private_key(sk) for sk in account_priv
 # Declare application state storage for local and global schema
 global_schema = transaction.StateSchema(global_ints, global_bytes)
 local_schema = transaction.StateSchema(local_ints, local_bytes)
+# local schema of the compact voter status layout
+compact_local_schema = transaction.StateSchema(compact_local_ints, compact_local_bytes)
 
 
 def create_app(client, private_key, approval_program, clear_program, global_schema, local_schema, app_args):
@@ -38,7 +44,7 @@ def create_app(client, private_key, approval_program, clear_program, global_sche
     # TODO: create unsigned transaction
     txn = transaction.ApplicationCreateTxn(sender, params, on_complete, approval_program, clear_program, global_schema, local_schema, app_args)
     # TODO: sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
     # TODO: send transaction
     client.send_transactions([signed_txn])
@@ -52,34 +58,51 @@ def create_app(client, private_key, approval_program, clear_program, global_sche
     return app_id
 
 
-def create_vote_app(client, creator_private_key, election_end, num_vote_options, vote_options):
+def create_vote_app(client, creator_private_key, election_end, num_vote_options, vote_options, compact_status=False,
+                    shard_index=None, num_shards=None, optimize=False):
     """
     Create/Deploy the voting app
     This function uses create_app and return the newly created application ID
+    With compact_status, voters are stored with the single-uint status layout
+    With shard_index and num_shards, the app is one tally shard of a sharded election
+    With optimize, the programs are deployed as teal_optimizer.optimize_programs rewrites them, checked
+    again as the node assembled them (see teal_optimizer.select_assembled); ValueError is raised before
+    anything is sent if the optimized programs fail the differential check
     """
     # TODO:
     # get PyTeal approval program
-    approval_program_ast = approval_program()
+    approval_program_ast = approval_program(compact_status)
     # compile program to TEAL assembly
     approval_program_teal = compileTeal(
         approval_program_ast, mode=Mode.Application, version=5
     )
-    # compile program to binary
-    approval_program_compiled = compile_program(client, approval_program_teal)
     # Do the same for PyTeal clear state program
     # get PyTeal clear state program
-    clear_state_program_ast = clear_state_program()
+    clear_state_program_ast = clear_state_program(compact_status)
     # compile program to TEAL assembly
     clear_state_program_teal = compileTeal(
         clear_state_program_ast, mode=Mode.Application, version=5
     )
-    # compile program to binary
+    # compile programs to binary
+    approval_program_compiled = compile_program(client, approval_program_teal)
     clear_state_program_compiled = compile_program(
         client, clear_state_program_teal
     )
+    if optimize:
+        optimized_teals = optimize_programs(approval_program_teal, clear_state_program_teal)
+        assembled = []
+        for compiled, optimized_teal in zip((approval_program_compiled, clear_state_program_compiled),
+                                            optimized_teals):
+            optimized_compiled = compile_program(client, optimized_teal)
+            assembled.append((compiled, optimized_compiled, client.disassemble(optimized_compiled)["result"]))
+        approval_program_compiled, clear_state_program_compiled = select_assembled(
+            approval_program_teal, clear_state_program_teal, assembled
+        )
 
     # create list of bytes for application arguments
     application_args = [election_end, num_vote_options, vote_options]
+    if num_shards is not None:
+        application_args += [shard_index, num_shards]
     # TODO: Create new application
     app_id = create_app(
         client,
@@ -87,13 +110,60 @@ def create_vote_app(client, creator_private_key, election_end, num_vote_options,
         approval_program_compiled,
         clear_state_program_compiled,
         global_schema,
-        local_schema,
+        compact_local_schema if compact_status else local_schema,
         application_args,
     )
 
     return app_id
 
 
+def set_coordinator_shard(client, private_key, coordinator_id, shard_index, shard_app_id):
+    """
+    Record the app id of a tally shard in the coordinator of a sharded election
+    """
+    sender = account.address_from_private_key(private_key)
+    params = client.suggested_params()
+    app_args = [b"set_shard", shard_index, shard_app_id]
+    txn = transaction.ApplicationNoOpTxn(sender, params, coordinator_id, app_args)
+    signed_txn = sign_transaction(txn, private_key)
+    tx_id = signed_txn.transaction.get_txid()
+    client.send_transactions([signed_txn])
+    wait_for_confirmation(client, tx_id)
+
+
+def create_sharded_election(client, creator_private_key, election_end, num_vote_options, vote_options, num_shards,
+                            compact_status=False, optimize=False):
+    """
+    Create/Deploy a sharded election: num_shards tally shard apps plus a coordinator app storing their ids
+    Voters are assigned to a shard by address hash (see election_model.shard_index). Every shard tallies
+    every option, so num_vote_options is limited by one app's global schema as for a single election.
+    optimize applies to the shard apps, see create_vote_app
+    Return the coordinator application ID and the list of shard application IDs
+    """
+    shard_app_ids = [
+        create_vote_app(client, creator_private_key, election_end, num_vote_options, vote_options, compact_status,
+                        shard_index=i, num_shards=num_shards, optimize=optimize)
+        for i in range(num_shards)
+    ]
+
+    coordinator_program_teal = compileTeal(coordinator_program(), mode=Mode.Application, version=5)
+    coordinator_clear_program_teal = compileTeal(coordinator_clear_state_program(), mode=Mode.Application, version=5)
+    coordinator_id = create_app(
+        client,
+        creator_private_key,
+        compile_program(client, coordinator_program_teal),
+        compile_program(client, coordinator_clear_program_teal),
+        # ElectionEnd, NumVoteOptions, NumShards and one app id per shard; VoteOptions
+        transaction.StateSchema(3 + num_shards, 1),
+        transaction.StateSchema(0, 0),
+        [election_end, num_vote_options, vote_options, num_shards],
+    )
+
+    for i, shard_app_id in enumerate(shard_app_ids):
+        set_coordinator_shard(client, creator_private_key, coordinator_id, i, shard_app_id)
+
+    return coordinator_id, shard_app_ids
+
 
 def main():
     # TODO: Initialize algod client and define absolute election end time fom the status of the last round.
@@ -102,11 +172,21 @@ def main():
     algod_client = algod.AlgodClient(algod_token, algod_address, algod_headers)
 
     # Get the last round information
-    last_round = algod_client.status()["lastRound"]
+    last_round = algod_client.status()["last-round"]
 
     # Define the absolute election end time
     election_end = last_round + relative_election_end
 
+    if num_shards > 1:
+        # Deploy the shards and the coordinator, and print the coordinator's global state
+        app_id, shard_app_ids = create_sharded_election(
+            algod_client, account_private_keys[0], election_end, num_vote_options, vote_options, num_shards
+        )
+        print("Coordinator App ID:", app_id)
+        print("Shard App IDs:", shard_app_ids)
+        print("Global state:", read_global_state(algod_client, app_id))
+        return
+
     # Deploy the app
     app_id = create_vote_app(algod_client, account_private_keys[0], election_end, num_vote_options, vote_options)
     print("App ID:", app_id)
@@ -0,0 +1,323 @@
+"""
+Python model of the election contract's state transitions
+
+Mirrors the rules of approval_program/clear_state_program in election_smart_contract.py
+on plain dicts shaped like the output of helper.format_state, so tooling can reason
+about app state without a network round trip.
+
+global_state is a dict such as {"ElectionEnd": 100, "NumVoteOptions": 2, "VoteOptions": "A,B", "VotesFor0": 0, ...}
+local_states maps an address to that account's local state dict, e.g. {"can_vote": "yes", "voted": 1}.
+Binary values, such as the TallyHash written by the finalize call or a status that is not UTF-8, are
+bytes. A registered approver is the global key approver_key(address), the "Approver" prefix followed
+by the address in base32.
+Apps deployed with the compact voter status layout (approval_program(compact_status=True)) are modelled
+with compact_status=True; their local states take the same form, but a status update must decide
+"yes" or "no", the only statuses the layout can hold.
+"""
+
+import hashlib
+
+from algosdk.encoding import decode_address, encode_address
+
+from election_params import compact_local_bytes, compact_local_ints, max_approvers, max_vote_options
+
+approver_prefix = "Approver"
+
+# on-completion names as reported by the indexer, keyed by their algosdk OnComplete value
+ON_COMPLETE_NAMES = {
+    0: "noop",
+    1: "optin",
+    2: "closeout",
+    3: "clear",
+    4: "update",
+    5: "delete",
+}
+ON_COMPLETE_CODES = {name: code for code, name in ON_COMPLETE_NAMES.items()}
+
+
+class CallRejected(Exception):
+    """Raised when the approval program would reject an application call"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+def create_election(election_end: int, num_vote_options: int, vote_options: str,
+                    shard_index: int = None, num_shards: int = None) -> dict:
+    """
+    Return the global state written by the creation branch of approval_program
+    """
+    global_state = {
+        "ElectionEnd": election_end,
+        "NumVoteOptions": num_vote_options,
+        "VoteOptions": vote_options,
+    }
+    if num_shards is not None:
+        global_state["ShardIndex"] = shard_index
+        global_state["NumShards"] = num_shards
+    for i in range(num_vote_options):
+        global_state[f"VotesFor{i}"] = 0
+    return global_state
+
+
+def check_create(app_args):
+    """
+    Evaluate the creation args of an election app against the creation branch of approval_program
+    Return None if the app would be created, otherwise a short rejection reason
+    """
+    if int.from_bytes(app_args[1], "big") > max_vote_options:
+        return f"more than {max_vote_options} vote options"
+    return None
+
+
+def create_election_from_args(app_args) -> dict:
+    """
+    Return the global state written by the creation branch of approval_program for the given creation args
+    """
+    args = [int.from_bytes(arg, "big") for arg in app_args[3:5]]
+    return create_election(
+        int.from_bytes(app_args[0], "big"),
+        int.from_bytes(app_args[1], "big"),
+        app_args[2].decode("utf-8"),
+        *args,
+    )
+
+
+def shard_index(address: str, num_shards: int) -> int:
+    """
+    Return the tally shard an address belongs to in a sharded election
+    The first 8 bytes of the SHA-256 of the address's public key, modulo the number of shards,
+    as checked by approval_program on opt-in
+    """
+    digest = hashlib.sha256(decode_address(address)).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def approver_key(address: str) -> str:
+    """
+    Return the global state key that registers an address as an approver
+    On chain the key is b"Approver" followed by the 32-byte public key
+    """
+    return approver_prefix + address
+
+
+def is_compact_status_schema(num_uints: int, num_byte_slices: int) -> bool:
+    """
+    Return whether an election app's local state schema is that of the compact voter status layout
+    """
+    return (num_uints, num_byte_slices) == (compact_local_ints, compact_local_bytes)
+
+
+def _btoi(arg: bytes):
+    # btoi fails on inputs longer than 8 bytes
+    if len(arg) > 8:
+        return None
+    return int.from_bytes(arg, "big")
+
+
+def _text_or_bytes(arg: bytes):
+    # the byte layout stores any status the creator sends, which need not be UTF-8
+    try:
+        return arg.decode("utf-8")
+    except UnicodeDecodeError:
+        return arg
+
+
+def _check_vote(global_state, local_states, sender, round, app_args):
+    local_state = local_states.get(sender, {})
+    if round >= global_state["ElectionEnd"]:
+        return "election has ended"
+    if local_state.get("can_vote") != "yes":
+        return "sender is not approved to vote"
+    if "voted" in local_state:
+        return "sender has already voted"
+    if len(app_args) < 2:
+        return "missing vote choice"
+    choice = _btoi(app_args[1])
+    if choice is None:
+        return "vote choice is not a uint64"
+    if choice >= global_state["NumVoteOptions"]:
+        return "vote choice out of range"
+    return None
+
+
+def _check_update_user_status(global_state, local_states, creator, sender, round, app_args, compact_status):
+    if len(app_args) < 3:
+        return "missing user address or status"
+    if len(app_args[1]) != 32:
+        return "user address is not 32 bytes"
+    user_state = local_states.get(encode_address(app_args[1]), {})
+    if sender != creator and approver_key(sender) not in global_state:
+        return "sender is not the creator or an approver"
+    if round >= global_state["ElectionEnd"]:
+        return "election has ended"
+    if user_state.get("can_vote") != "maybe":
+        return "user status was already updated"
+    if compact_status and app_args[2] not in (b"yes", b"no"):
+        return "status is not yes or no"
+    return None
+
+
+def election_result(global_state) -> dict:
+    """
+    Return the result the finalize call snapshots: {"total_votes", "winner", "tally_hash"}
+    The winner is the lowest index among the options with the most votes, the tally hash is the
+    SHA-256 of the VotesFor{i} tallies as concatenated 8-byte big-endian uints
+    """
+    tallies = [global_state.get(f"VotesFor{i}", 0) for i in range(global_state["NumVoteOptions"])]
+    winner = 0
+    for i, votes in enumerate(tallies):
+        if votes > tallies[winner]:
+            winner = i
+    return {
+        "total_votes": sum(tallies),
+        "winner": winner,
+        "tally_hash": hashlib.sha256(b"".join(votes.to_bytes(8, "big") for votes in tallies)).digest(),
+    }
+
+
+def _check_approver_call(global_state, creator, sender, app_args):
+    if len(app_args) < 2:
+        return "missing approver address"
+    if sender != creator:
+        return "sender is not the creator"
+    if app_args[0] == b"remove_approver":
+        if len(app_args[1]) != 32 or approver_key(encode_address(app_args[1])) not in global_state:
+            return "address is not an approver"
+        return None
+    if len(app_args[1]) != 32:
+        return "approver address is not 32 bytes"
+    if approver_key(encode_address(app_args[1])) in global_state:
+        return "address is already an approver"
+    if global_state.get("NumApprovers", 0) >= max_approvers:
+        return "too many approvers"
+    return None
+
+
+def _check_finalize(global_state, round):
+    if round < global_state["ElectionEnd"]:
+        return "election has not ended"
+    if "TotalVotes" in global_state:
+        return "election is already finalized"
+    return None
+
+
+def check_call(global_state, local_states, creator, sender, round, on_complete, app_args, compact_status=False):
+    """
+    Evaluate an application call against the contract rules without changing state
+    Return None if the call would be approved, otherwise a short rejection reason
+    """
+    if on_complete in ("delete", "update"):
+        return None if sender == creator else "sender is not the creator"
+    if on_complete == "clear":
+        # the clear state program cannot reject, but there is no local state to clear without an opt-in
+        return None if sender in local_states else "sender is not opted in"
+    if on_complete == "closeout":
+        return None if sender in local_states else "sender is not opted in"
+    if on_complete == "optin":
+        if sender in local_states:
+            return "sender is already opted in"
+        if round >= global_state["ElectionEnd"]:
+            return "election has ended"
+        if global_state.get("NumShards") and \
+                shard_index(sender, global_state["NumShards"]) != global_state["ShardIndex"]:
+            return "sender belongs to another shard"
+        return None
+    if not app_args:
+        return "missing application arguments"
+    if app_args[0] == b"vote":
+        return _check_vote(global_state, local_states, sender, round, app_args)
+    if app_args[0] == b"update_user_status":
+        return _check_update_user_status(global_state, local_states, creator, sender, round, app_args,
+                                         compact_status)
+    if app_args[0] == b"finalize":
+        return _check_finalize(global_state, round)
+    if app_args[0] in (b"add_approver", b"remove_approver"):
+        return _check_approver_call(global_state, creator, sender, app_args)
+    return "unknown application call"
+
+
+def _remove_vote(global_state, local_states, sender, round):
+    # shared by the closeout branch and the clear state program
+    local_state = local_states.get(sender, {})
+    if round < global_state["ElectionEnd"] and "voted" in local_state:
+        key = f"VotesFor{local_state['voted']}"
+        global_state[key] = global_state.get(key, 0) - 1
+
+
+def apply_call(global_state, local_states, creator, sender, round, on_complete, app_args, compact_status=False):
+    """
+    Apply an application call to global_state and local_states in place
+    Raise CallRejected if the approval program would reject it
+    """
+    reason = check_call(global_state, local_states, creator, sender, round, on_complete, app_args, compact_status)
+    if reason is not None:
+        raise CallRejected(reason)
+    apply_confirmed_call(global_state, local_states, creator, sender, round, on_complete, app_args)
+
+
+def apply_confirmed_call(global_state, local_states, creator, sender, round, on_complete, app_args):
+    """
+    Apply the effects of a call the network already approved, without checking it
+    local_states may lack the accounts involved, their state is then inferred from the call
+    """
+    # local states are always replaced rather than mutated so mapping-backed stores see the write
+    if on_complete in ("closeout", "clear"):
+        _remove_vote(global_state, local_states, sender, round)
+        local_states.pop(sender, None)
+    elif on_complete == "optin":
+        local_states[sender] = {"can_vote": "maybe"}
+    elif on_complete == "noop" and app_args[0] == b"vote":
+        choice = _btoi(app_args[1])
+        # only an approved voter can have voted
+        local_states[sender] = dict(local_states.get(sender, {"can_vote": "yes"}), voted=choice)
+        global_state[f"VotesFor{choice}"] = global_state.get(f"VotesFor{choice}", 0) + 1
+    elif on_complete == "noop" and app_args[0] == b"update_user_status":
+        user_address = encode_address(app_args[1])
+        can_vote = _text_or_bytes(app_args[2])
+        local_states[user_address] = dict(local_states.get(user_address, {}), can_vote=can_vote)
+    elif on_complete == "noop" and app_args[0] == b"finalize":
+        result = election_result(global_state)
+        global_state["TotalVotes"] = result["total_votes"]
+        global_state["Winner"] = result["winner"]
+        global_state["TallyHash"] = result["tally_hash"]
+    elif on_complete == "noop" and app_args[0] == b"add_approver":
+        global_state[approver_key(encode_address(app_args[1]))] = 1
+        global_state["NumApprovers"] = global_state.get("NumApprovers", 0) + 1
+    elif on_complete == "noop" and app_args[0] == b"remove_approver":
+        del global_state[approver_key(encode_address(app_args[1]))]
+        global_state["NumApprovers"] -= 1
+
+
+def create_coordinator(app_args) -> dict:
+    """
+    Return the global state written by the creation branch of coordinator_program
+    """
+    return {
+        "ElectionEnd": int.from_bytes(app_args[0], "big"),
+        "NumVoteOptions": int.from_bytes(app_args[1], "big"),
+        "VoteOptions": app_args[2].decode("utf-8"),
+        "NumShards": int.from_bytes(app_args[3], "big"),
+    }
+
+
+def apply_coordinator_call(global_state, creator, sender, on_complete, app_args):
+    """
+    Apply a call to a sharded election's coordinator_program in place
+    Raise CallRejected if the program would reject it
+    """
+    if on_complete in ("delete", "update"):
+        if sender != creator:
+            raise CallRejected("sender is not the creator")
+        return
+    if on_complete != "noop" or not app_args or app_args[0] != b"set_shard" or len(app_args) < 3:
+        raise CallRejected("unknown application call")
+    if sender != creator:
+        raise CallRejected("sender is not the creator")
+    index = _btoi(app_args[1])
+    if index is None or index >= global_state["NumShards"]:
+        raise CallRejected("shard index out of range")
+    if f"Shard{index}" in global_state:
+        raise CallRejected("shard is already set")
+    global_state[f"Shard{index}"] = _btoi(app_args[2])
@@ -4,9 +4,17 @@
 local_ints = 1  # user's voted variable
 local_bytes = 1  # user's can_vote variable
 global_ints = (
-    24  # 3 for setup + x for choices. Use a larger number for more choices.
+    33  # 3 for setup + 2 for sharding + 2 for finalization + 1 + max_approvers for approvers + x for choices.
+    # Use a larger number for more choices.
 )
-global_bytes = 1  # VoteOptions variable
+global_bytes = 2  # VoteOptions and the finalized TallyHash variables
+
+# Accounts the creator may register to approve voters alongside it (see the approver registry)
+max_approvers = 8
+
+# Most vote options an election may have: finalize reads every tally in one app call, which stays within
+# the 700 opcode budget up to 10 options (measured with teal_eval, about 60 opcodes per option)
+max_vote_options = 10
 
 # Define an election end period relative to current client status
 relative_election_end = 300000
@@ -14,3 +22,16 @@ num_vote_options = 4
 
 # Define vote options in a string separated by commas without spaces e.g., "BTC,ETH,USDT,ALGO"
 vote_options = "A,B,C,D"
+
+# Number of tally shard apps for large elections; 1 deploys a single, unsharded election app.
+# A sharded election also deploys a coordinator app, which stores 4 setup values and 1 app id per shard.
+# Shards split the voters, not the options: each shard holds all VotesFor tallies within global_ints.
+num_shards = 1
+
+# Compact voter status layout (approval_program(compact_status=True)): a single uint "status" per voter
+# bits 0-1 hold eligibility, bits 2 and up hold the vote choice + 1 (0 while the voter has not voted)
+compact_local_ints = 1  # user's status variable
+compact_local_bytes = 0
+status_maybe = 1
+status_yes = 2
+status_no = 3
@@ -1,8 +1,41 @@
 from pyteal import *
 from pyteal_helper import itoa
+from election_params import max_approvers, max_vote_options, status_maybe, status_yes
+
+
+def compact_remove_vote():
+    """
+    Compact layout counterpart of the closeout/clear state logic: removes the sender's vote from the
+    correct vote tally if the election has not ended, reading the voter record with a single localGetEx.
+    The local state is removed along with the account's opt-in, so it is not rewritten.
+    """
+    get_status_of_sender = App.localGetEx(Int(0), App.id(), Bytes("status"))
+    # vote choice + 1, 0 if the sender has not voted
+    vote_bits = ShiftRight(get_status_of_sender.value(), Int(2))
+    tally_key = ScratchVar(TealType.bytes)
+    return Seq([
+        get_status_of_sender,
+        If(
+            Global.round() < App.globalGet(Bytes("ElectionEnd"))
+        ).Then(
+            If(
+                vote_bits
+            ).Then(
+                Seq([
+                    tally_key.store(Concat(Bytes("VotesFor"), itoa(vote_bits - Int(1)))),
+                    App.globalPut(tally_key.load(), App.globalGet(tally_key.load()) - Int(1)),
+                ])
+            )
+        ),
+    ])
 
-def approval_program():
-    """APPROVAL PROGRAM handles the main logic of the application"""
+
+def approval_program(compact_status=False):
+    """
+    APPROVAL PROGRAM handles the main logic of the application
+    With compact_status, each voter's eligibility and vote are packed into the single uint local
+    "status" (layout in election_params) instead of the can_vote bytes and the voted uint
+    """
 
     i = ScratchVar(TealType.uint64)  # i-variable for for-loop
 
@@ -16,7 +49,14 @@ def approval_program():
             # Set all initial vote tallies to 0 for all vote options, keys are the vote options
             App.globalPut(Bytes("ElectionEnd"), Btoi(Txn.application_args[0])),
             App.globalPut(Bytes("NumVoteOptions"), Btoi(Txn.application_args[1])),
+            # finalize could not tally more options within one call's opcode budget
+            Assert(App.globalGet(Bytes("NumVoteOptions")) <= Int(max_vote_options)),
             App.globalPut(Bytes("VoteOptions"), Txn.application_args[2]),
+            # a tally shard of a sharded election also gets its shard index and the number of shards
+            If(Txn.application_args.length() == Int(5)).Then(Seq([
+                App.globalPut(Bytes("ShardIndex"), Btoi(Txn.application_args[3])),
+                App.globalPut(Bytes("NumShards"), Btoi(Txn.application_args[4])),
+            ])),
             # Set all initial vote tallies to 0 for all vote options, keys are the vote options
             For(
                 # vars storing votes for each option
@@ -40,6 +80,43 @@ def approval_program():
     # call to determine whether the current transaction sender is the creator
     is_creator = Txn.sender() == Global.creator_address()
 
+    # APPROVER REGISTRY: the creator may delegate voter approval to up to max_approvers accounts,
+    # each stored as a global "Approver" + address entry so that checking a sender is a single lookup
+    get_sender_approver = App.globalGetEx(App.id(), Concat(Bytes("Approver"), Txn.sender()))
+    is_creator_or_approver = Or(is_creator, get_sender_approver.hasValue())
+
+    approver = Txn.application_args[1]
+    get_approver = App.globalGetEx(App.id(), Concat(Bytes("Approver"), approver))
+    on_add_approver = Seq([
+        get_approver,
+        Assert(is_creator),
+        Assert(Len(approver) == Int(32)),
+        # an approver is only added once
+        Assert(Not(get_approver.hasValue())),
+        Assert(App.globalGet(Bytes("NumApprovers")) < Int(max_approvers)),
+        App.globalPut(Concat(Bytes("Approver"), approver), Int(1)),
+        App.globalPut(Bytes("NumApprovers"), App.globalGet(Bytes("NumApprovers")) + Int(1)),
+        Return(Int(1)),
+    ])
+
+    on_remove_approver = Seq([
+        get_approver,
+        Assert(is_creator),
+        Assert(get_approver.hasValue()),
+        App.globalDel(Concat(Bytes("Approver"), approver)),
+        App.globalPut(Bytes("NumApprovers"), App.globalGet(Bytes("NumApprovers")) - Int(1)),
+        Return(Int(1)),
+    ])
+
+    # in a sharded election, voters may only register with the shard their address hashes to
+    # (NumShards is 0 in an unsharded election, which must not reach the modulo)
+    is_sender_shard = If(
+        App.globalGet(Bytes("NumShards")) == Int(0),
+        Int(1),
+        Btoi(Extract(Sha256(Txn.sender()), Int(0), Int(8))) % App.globalGet(Bytes("NumShards"))
+        == App.globalGet(Bytes("ShardIndex")),
+    )
+
     # value of whether or not the sender can vote ("yes", "no", or "maybe")
     get_sender_can_vote = App.localGetEx(Int(0), App.id(), Bytes("can_vote"))
     get_can_vote = App.localGetEx(Txn.application_args[1], App.id(), Bytes("can_vote"))
@@ -88,6 +165,8 @@ def approval_program():
         [
             # assert that the user is registering before the election end
             Assert(Global.round() < App.globalGet(Bytes("ElectionEnd"))),
+            # AND with the right shard
+            Assert(is_sender_shard),
             # in the user's account's local storage, set the can_vote var to "maybe"
             App.localPut(Int(0), Bytes("can_vote"), Bytes("maybe")),
             Return(Int(1)),
@@ -97,8 +176,9 @@ def approval_program():
     on_update_user_status = Seq(
         # TODO: UPDATE USER LOGIC
         get_can_vote,
-        # assert only the creator can approve/disapprove
-        Assert(is_creator),
+        get_sender_approver,
+        # assert only the creator or an approver can approve/disapprove
+        Assert(is_creator_or_approver),
         # AND can only be approved before election ends
         Assert(Global.round() < App.globalGet(Bytes("ElectionEnd"))),
         # AND creator cannot update more than once
@@ -144,6 +224,99 @@ def approval_program():
         ]
     )
 
+    # COMPACT VOTER STATUS LAYOUT
+
+    get_sender_status = App.localGetEx(Int(0), App.id(), Bytes("status"))
+    get_status = App.localGetEx(Txn.application_args[1], App.id(), Bytes("status"))
+
+    on_closeout_compact = Seq([
+        compact_remove_vote(),
+        Return(Int(1))
+    ])
+
+    on_register_compact = Seq([
+        Assert(Global.round() < App.globalGet(Bytes("ElectionEnd"))),
+        Assert(is_sender_shard),
+        App.localPut(Int(0), Bytes("status"), Int(status_maybe)),
+        Return(Int(1)),
+    ])
+
+    decision = Txn.application_args[2]
+    on_update_user_status_compact = Seq([
+        get_status,
+        get_sender_approver,
+        Assert(is_creator_or_approver),
+        Assert(Global.round() < App.globalGet(Bytes("ElectionEnd"))),
+        Assert(get_status.value() == Int(status_maybe)),
+        # the status can only hold yes or no, so any other decision is rejected rather than stored
+        Assert(Or(decision == Bytes("yes"), decision == Bytes("no"))),
+        # status_no directly follows status_yes
+        App.localPut(Txn.application_args[1], Bytes("status"), Int(status_yes) + (decision == Bytes("no"))),
+        Return(Int(1))
+    ])
+
+    tally_key = ScratchVar(TealType.bytes)
+    on_vote_compact = Seq([
+        get_sender_status,
+        Assert(Global.round() < App.globalGet(Bytes("ElectionEnd"))),
+        # eligibility bits must be "yes"
+        Assert(BitwiseAnd(get_sender_status.value(), Int(3)) == Int(status_yes)),
+        # a non-zero vote field means the user already voted
+        If(ShiftRight(get_sender_status.value(), Int(2)))
+        .Then(Return(Int(0)))
+        .Else(Seq([
+            Assert(choice < App.globalGet(Bytes("NumVoteOptions"))),
+            App.localPut(Int(0), Bytes("status"), Int(status_yes) + ShiftLeft(choice + Int(1), Int(2))),
+            tally_key.store(Concat(Bytes("VotesFor"), itoa(choice))),
+            App.globalPut(tally_key.load(), App.globalGet(tally_key.load()) + Int(1)),
+            Return(Int(1)),
+        ])),
+    ])
+
+    # FINALIZATION: once the election has ended, anyone may snapshot the result into global state
+    # (the total vote count, the winning option index, lowest on a tie, and the SHA-256 of the
+    # tallies as concatenated 8-byte big-endian uints) so readers need not decode every tally
+
+    get_total_votes = App.globalGetEx(App.id(), Bytes("TotalVotes"))
+    votes = ScratchVar(TealType.uint64)
+    total_votes = ScratchVar(TealType.uint64)
+    winner = ScratchVar(TealType.uint64)
+    winner_votes = ScratchVar(TealType.uint64)
+    tallies = ScratchVar(TealType.bytes)
+    on_finalize = Seq([
+        get_total_votes,
+        Assert(Global.round() >= App.globalGet(Bytes("ElectionEnd"))),
+        # can only be finalized once
+        Assert(Not(get_total_votes.hasValue())),
+        total_votes.store(Int(0)),
+        winner.store(Int(0)),
+        winner_votes.store(Int(0)),
+        tallies.store(Bytes("")),
+        For(
+            i.store(Int(0)),
+            i.load() < App.globalGet(Bytes("NumVoteOptions")),
+            i.store(i.load() + Int(1))
+        ).Do(Seq([
+            votes.store(App.globalGet(Concat(Bytes("VotesFor"), itoa(i.load())))),
+            If(votes.load() > winner_votes.load()).Then(Seq([
+                winner.store(i.load()),
+                winner_votes.store(votes.load()),
+            ])),
+            total_votes.store(total_votes.load() + votes.load()),
+            tallies.store(Concat(tallies.load(), Itob(votes.load()))),
+        ])),
+        App.globalPut(Bytes("TotalVotes"), total_votes.load()),
+        App.globalPut(Bytes("Winner"), winner.load()),
+        App.globalPut(Bytes("TallyHash"), Sha256(tallies.load())),
+        Return(Int(1)),
+    ])
+
+    if compact_status:
+        on_closeout = on_closeout_compact
+        on_register = on_register_compact
+        on_update_user_status = on_update_user_status_compact
+        on_vote = on_vote_compact
+
     program = Cond(
 
         # MAIN CONDITIONAL
@@ -156,18 +329,24 @@ def approval_program():
 
         # TODO: Complete the cases that will trigger the update_user_status and on_vote sequences
         [Txn.application_args[0] == Bytes("vote"), on_vote],
-        [Txn.application_args[0] == Bytes("update_user_status"), on_update_user_status]
+        [Txn.application_args[0] == Bytes("update_user_status"), on_update_user_status],
+        [Txn.application_args[0] == Bytes("finalize"), on_finalize],
+        [Txn.application_args[0] == Bytes("add_approver"), on_add_approver],
+        [Txn.application_args[0] == Bytes("remove_approver"), on_remove_approver],
 
     )
 
     return program
 
 
-def clear_state_program():
+def clear_state_program(compact_status=False):
     """ Handles the logic of when an account clears its participation in a smart contract. """
 
     # TODO: CLEAR STATE PROGRAM
 
+    if compact_status:
+        return Seq([compact_remove_vote(), Return(Int(1))])
+
     get_vote_of_sender = App.localGetEx(Int(0), App.id(), Bytes("voted"))
 
     program = Seq(
@@ -206,6 +385,49 @@ def clear_state_program():
     return program
 
 
+def coordinator_program():
+    """
+    COORDINATOR PROGRAM of a sharded election: holds the election parameters and the app ids of its
+    tally shards ("Shard0", "Shard1", ...). Voters never call it, they opt in to and vote with their shard.
+    """
+
+    is_creator = Txn.sender() == Global.creator_address()
+    shard_index = Btoi(Txn.application_args[1])
+    get_shard = App.globalGetEx(App.id(), Concat(Bytes("Shard"), itoa(shard_index)))
+
+    on_creation = Seq([
+        App.globalPut(Bytes("ElectionEnd"), Btoi(Txn.application_args[0])),
+        App.globalPut(Bytes("NumVoteOptions"), Btoi(Txn.application_args[1])),
+        App.globalPut(Bytes("VoteOptions"), Txn.application_args[2]),
+        App.globalPut(Bytes("NumShards"), Btoi(Txn.application_args[3])),
+        Return(Int(1)),
+    ])
+
+    # record the app id of a tally shard, once per shard index
+    on_set_shard = Seq([
+        get_shard,
+        Assert(is_creator),
+        Assert(shard_index < App.globalGet(Bytes("NumShards"))),
+        Assert(Not(get_shard.hasValue())),
+        App.globalPut(Concat(Bytes("Shard"), itoa(shard_index)), Btoi(Txn.application_args[2])),
+        Return(Int(1)),
+    ])
+
+    program = Cond(
+        [Txn.application_id() == Int(0), on_creation],
+        [Txn.on_completion() == OnComplete.DeleteApplication, Return(is_creator)],
+        [Txn.on_completion() == OnComplete.UpdateApplication, Return(is_creator)],
+        [Txn.application_args[0] == Bytes("set_shard"), on_set_shard],
+    )
+
+    return program
+
+
+def coordinator_clear_state_program():
+    """ Nobody opts in to the coordinator, so clearing has nothing to undo """
+    return Return(Int(1))
+
+
 if __name__ == "__main__":
     with open("vote_approval.teal", "w") as f:
         compiled = compileTeal(approval_program(), mode=Mode.Application, version=5)
@@ -0,0 +1,359 @@
+"""
+Streaming export of election tallies and voter rolls
+
+Voter rolls are read page by page and written as they arrive, so memory stays bounded by a few
+pages however many voters opted in. Pages are fetched ahead in the background while the previous
+page is written. Rolls and tallies can be written as CSV and in a compact columnar binary format:
+
+    header  b"ECOL" version:uint8 num_columns:uint16, then per column
+            name_len:uint8 name type:uint8 (+ num_labels:uint8 and len:uint8 label pairs for enums)
+    chunk   num_rows:uint32, then each column's values back to back, little-endian
+    end     a chunk with num_rows 0
+
+Column types are fixed-width integers, enums stored as a uint8 label index, raw 32-byte addresses
+and strings stored as uint32 lengths followed by the utf-8 bytes.
+Run this file to export an app's tallies and roll from the network.
+"""
+
+import argparse
+import csv
+import itertools
+import queue
+import struct
+import sys
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from algosdk.encoding import decode_address, encode_address
+
+from helper import format_state, read_global_state
+
+magic = b"ECOL"
+format_version = 1
+
+# column type -> (type code, array typecode or None for the variable/raw types)
+column_types = {
+    "uint8": (1, "B"),
+    "int16": (2, "h"),
+    "uint32": (3, "I"),
+    "uint64": (4, "Q"),
+    "enum": (5, "B"),
+    "address": (6, None),
+    "string": (7, None),
+}
+_type_names = {code: name for name, (code, _) in column_types.items()}
+
+# the voter roll: can_vote label 0 and voted -1 mean the entry is not set. The default layout stores
+# whatever status the creator sent, any value without a label of its own is written as "other" with
+# the value itself in can_vote_other, which is empty for every other row
+can_vote_labels = ("", "maybe", "yes", "no", "other")
+roll_columns = [("address", "address"), ("can_vote", "enum", can_vote_labels), ("voted", "int16"),
+                ("can_vote_other", "string")]
+_can_vote_codes = {label: code for code, label in enumerate(can_vote_labels[:-1])}
+_other_code = len(can_vote_labels) - 1
+tally_columns = [("index", "uint8"), ("option", "string"), ("votes", "uint64")]
+
+
+def _prefetch(iterable, depth):
+    # iterate in a background thread, keeping at most depth items ready ahead of the consumer
+    items = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        # give up once the consumer has stopped reading
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # stop the producer if the consumer gives up early
+        stop.set()
+
+
+def _app_local_state(account, app_id):
+    for local_state in account.get("apps-local-state", []):
+        if local_state["id"] == app_id:
+            return format_state(local_state.get("key-value", []))
+    return None
+
+
+class IndexerVoterSource:
+    """
+    Voter roll read from an algosdk IndexerClient's account search, page_size accounts per request
+    The next page is requested while the current one is being written
+    """
+
+    def __init__(self, indexer_client, app_id, page_size=1000, prefetch=2):
+        self.indexer_client = indexer_client
+        self.app_id = app_id
+        self.page_size = page_size
+        self.prefetch = prefetch
+
+    def _fetch_pages(self):
+        next_page = None
+        while True:
+            response = self.indexer_client.accounts(application_id=self.app_id, limit=self.page_size,
+                                                    next_page=next_page)
+            page = []
+            for account in response.get("accounts", []):
+                local_state = _app_local_state(account, self.app_id)
+                if local_state is not None:
+                    page.append((account["address"], local_state))
+            if page:
+                yield page
+            next_page = response.get("next-token")
+            if not next_page or not response.get("accounts"):
+                return
+
+    def pages(self):
+        """Yield lists of (address, local state) pairs"""
+        return _prefetch(self._fetch_pages(), self.prefetch)
+
+
+class AccountVoterSource:
+    """
+    Voter roll of a known list of addresses read from algod account by account
+    Up to max_workers reads run concurrently and at most prefetch pages are in flight;
+    addresses that are not opted in are skipped
+    """
+
+    def __init__(self, client, app_id, addresses, page_size=1000, max_workers=8, prefetch=2):
+        self.client = client
+        self.app_id = app_id
+        self.addresses = addresses
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.prefetch = prefetch
+
+    def _read(self, address):
+        return _app_local_state(self.client.account_info(address), self.app_id)
+
+    def pages(self):
+        """Yield lists of (address, local state) pairs"""
+        addresses = iter(self.addresses)
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                while len(in_flight) < self.prefetch:
+                    chunk = list(itertools.islice(addresses, self.page_size))
+                    if not chunk:
+                        break
+                    in_flight.append((chunk, [executor.submit(self._read, address) for address in chunk]))
+                if not in_flight:
+                    return
+                chunk, futures = in_flight.popleft()
+                page = [(address, future.result()) for address, future in zip(chunk, futures)]
+                yield [(address, state) for address, state in page if state is not None]
+
+
+class ColumnarWriter:
+    """Writer of the columnar binary format, one chunk per write_chunk call"""
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = columns
+        f.write(magic + struct.pack("<BH", format_version, len(columns)))
+        for name, type_name, *labels in columns:
+            encoded_name = name.encode("utf-8")
+            f.write(struct.pack("<B", len(encoded_name)) + encoded_name)
+            f.write(struct.pack("<B", column_types[type_name][0]))
+            if type_name == "enum":
+                f.write(struct.pack("<B", len(labels[0])))
+                for label in labels[0]:
+                    encoded_label = label.encode("utf-8")
+                    f.write(struct.pack("<B", len(encoded_label)) + encoded_label)
+
+    def write_chunk(self, values):
+        """Write one chunk, values holds one list per column, enums given as label indexes"""
+        num_rows = len(values[0]) if values else 0
+        if not num_rows:
+            return
+        self.f.write(struct.pack("<I", num_rows))
+        for (_, type_name, *_), column in zip(self.columns, values):
+            typecode = column_types[type_name][1]
+            if type_name == "address":
+                self.f.write(b"".join(column))
+            elif type_name == "string":
+                encoded = [value.encode("utf-8") for value in column]
+                self.f.write(_to_bytes(array("I", map(len, encoded))) + b"".join(encoded))
+            else:
+                self.f.write(_to_bytes(array(typecode, column)))
+
+    def close(self):
+        self.f.write(struct.pack("<I", 0))
+
+
+def _to_bytes(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated columnar file")
+    return data
+
+
+def read_columnar(path):
+    """
+    Read a columnar file chunk by chunk
+    Yield dicts mapping each column name to its list of values, enums decoded to their labels
+    and addresses to their string form
+    """
+    with open(path, "rb") as f:
+        if _read_exact(f, 4) != magic:
+            raise ValueError(f"{path} is not a columnar export")
+        version, num_columns = struct.unpack("<BH", _read_exact(f, 3))
+        if version != format_version:
+            raise ValueError(f"unsupported columnar format version {version}")
+        columns = []
+        for _ in range(num_columns):
+            name = _read_exact(f, _read_exact(f, 1)[0]).decode("utf-8")
+            type_name = _type_names[_read_exact(f, 1)[0]]
+            labels = None
+            if type_name == "enum":
+                labels = [_read_exact(f, _read_exact(f, 1)[0]).decode("utf-8")
+                          for _ in range(_read_exact(f, 1)[0])]
+            columns.append((name, type_name, labels))
+
+        while True:
+            num_rows = struct.unpack("<I", _read_exact(f, 4))[0]
+            if not num_rows:
+                return
+            chunk = {}
+            for name, type_name, labels in columns:
+                if type_name == "address":
+                    data = _read_exact(f, 32 * num_rows)
+                    chunk[name] = [encode_address(data[i:i + 32]) for i in range(0, len(data), 32)]
+                    continue
+                values = array(column_types["uint32" if type_name == "string" else type_name][1])
+                values.frombytes(_read_exact(f, values.itemsize * num_rows))
+                if sys.byteorder == "big":
+                    values.byteswap()
+                if type_name == "string":
+                    chunk[name] = [_read_exact(f, length).decode("utf-8") for length in values]
+                elif type_name == "enum":
+                    chunk[name] = [labels[value] for value in values]
+                else:
+                    chunk[name] = values.tolist()
+            yield chunk
+
+
+def export_voter_roll(source, csv_path=None, columnar_path=None) -> int:
+    """
+    Stream the voter roll from source (IndexerVoterSource or AccountVoterSource) to a CSV file
+    with address,can_vote,voted rows and/or a columnar file with roll_columns, one chunk per page
+    Return the number of voters written
+    """
+    csv_file = open(csv_path, "w", newline="") if csv_path else None
+    columnar_file = open(columnar_path, "wb") if columnar_path else None
+    try:
+        if csv_file:
+            csv_writer = csv.writer(csv_file)
+            # CSV keeps every can_vote value as it is, so it needs no can_vote_other column
+            csv_writer.writerow(["address", "can_vote", "voted"])
+        if columnar_file:
+            columnar_writer = ColumnarWriter(columnar_file, roll_columns)
+
+        count = 0
+        for page in source.pages():
+            count += len(page)
+            if csv_file:
+                csv_writer.writerows(
+                    (address, state.get("can_vote", ""), state.get("voted", "")) for address, state in page)
+            if columnar_file:
+                can_votes = [state.get("can_vote", "") for _, state in page]
+                columnar_writer.write_chunk([
+                    [decode_address(address) for address, _ in page],
+                    [_can_vote_codes.get(can_vote, _other_code) for can_vote in can_votes],
+                    [state.get("voted", -1) for _, state in page],
+                    ["" if can_vote in _can_vote_codes else can_vote for can_vote in can_votes],
+                ])
+        if columnar_file:
+            columnar_writer.close()
+        return count
+    finally:
+        if csv_file:
+            csv_file.close()
+        if columnar_file:
+            columnar_file.close()
+
+
+def tally_rows(global_state) -> list:
+    """
+    Return (index, option name, votes) for every vote option, the names parsed from VoteOptions
+    """
+    names = global_state["VoteOptions"].split(",")
+    return [(i, names[i] if i < len(names) else "", global_state.get(f"VotesFor{i}", 0))
+            for i in range(global_state["NumVoteOptions"])]
+
+
+def export_tallies(global_state, csv_path=None, columnar_path=None):
+    """
+    Write the tallies of an election's global state as index,option,votes rows
+    global_state may come from helper.read_global_state or sharded_election.read_sharded_global_state
+    """
+    rows = tally_rows(global_state)
+    if csv_path:
+        with open(csv_path, "w", newline="") as f:
+            csv_writer = csv.writer(f)
+            csv_writer.writerow([name for name, *_ in tally_columns])
+            csv_writer.writerows(rows)
+    if columnar_path:
+        with open(columnar_path, "wb") as f:
+            columnar_writer = ColumnarWriter(f, tally_columns)
+            columnar_writer.write_chunk([list(column) for column in zip(*rows)])
+            columnar_writer.close()
+
+
+def main():
+    from algosdk.v2client import algod, indexer
+    from secrets import algod_token, algod_address, algod_headers
+
+    parser = argparse.ArgumentParser(description="Export an election's tallies and voter roll")
+    parser.add_argument("app_id", type=int)
+    parser.add_argument("--out", default="election", help="output path prefix")
+    parser.add_argument("--indexer-address", default="https://testnet-algorand.api.purestake.io/idx2")
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    algod_client = algod.AlgodClient(algod_token, algod_address, algod_headers)
+    indexer_client = indexer.IndexerClient(algod_token, args.indexer_address, algod_headers)
+
+    export_tallies(read_global_state(algod_client, args.app_id),
+                   csv_path=f"{args.out}_tallies.csv", columnar_path=f"{args.out}_tallies.ecol")
+    source = IndexerVoterSource(indexer_client, args.app_id, page_size=args.page_size)
+    count = export_voter_roll(source, csv_path=f"{args.out}_roll.csv", columnar_path=f"{args.out}_roll.ecol")
+    print(f"Exported {count} voters of app {args.app_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,9 +3,22 @@ Helper functions useful to compile, create, read state of, ... apps
 """
 
 import base64
+import time
 
 from algosdk.v2client import algod
 
+# set by instrumentation.enable() to its metrics' observe(operation, seconds), None while disabled
+observe = None
+
+# byte string values that are not text
+binary_keys = ("TallyHash",)
+
+# base64 keys of the values written by the finalize call
+_finalized_keys = {
+    base64.b64encode(key.encode("utf-8")).decode("ascii"): key
+    for key in ("TotalVotes", "Winner", "TallyHash", "VoteOptions")
+}
+
 
 def compile_program(client: algod, source_code: str) -> bytes:
     """
@@ -15,6 +28,21 @@ def compile_program(client: algod, source_code: str) -> bytes:
     return base64.b64decode(compile_response["result"])
 
 
+def sign_transaction(txn, private_key):
+    """
+    Sign a transaction with private_key, timed while instrumentation is enabled
+    """
+    # read the hook once, so it cannot be set between starting and recording the timer
+    timed = observe
+    if timed is None:
+        return txn.sign(private_key)
+    start = time.perf_counter()
+    try:
+        return txn.sign(private_key)
+    finally:
+        timed("sign", time.perf_counter() - start)
+
+
 def wait_for_confirmation(client: algod, tx_id: str):
     """
     Wait for confirmation of a given transaction ID
@@ -53,28 +81,41 @@ def int_to_bytes(i: int):
 def format_state(state):
     """
     Format state assuming all keys and values are string
+    A compact voter "status" uint is decoded into can_vote and voted, the values of binary_keys are kept as bytes
     """
+    # imported here, so importing helper loads no more than algosdk
+    from state_format import decode_voter_status, format_key
+
+    timed = observe
+    if timed is not None:
+        start = time.perf_counter()
     formatted = {}
     for item in state:
         key = item["key"]
         value = item["value"]
-        formatted_key = base64.b64decode(key).decode("utf-8")
+        formatted_key = format_key(base64.b64decode(key))
         if value["type"] == 1:
             # byte string
-            formatted_value = base64.b64decode(value["bytes"]).decode("utf-8")
+            formatted_value = base64.b64decode(value["bytes"])
+            if formatted_key not in binary_keys:
+                formatted_value = formatted_value.decode("utf-8")
             formatted[formatted_key] = formatted_value
+        elif formatted_key == "status":
+            # compact voter status
+            formatted.update(decode_voter_status(value["uint"]))
         else:
             # integer
             formatted[formatted_key] = value["uint"]
+    if timed is not None:
+        timed("format_state", time.perf_counter() - start)
     return formatted
 
 
-def read_local_state(client, addr, app_id):
+def parse_local_state(account_info: dict, app_id) -> dict:
     """
-    Read user local state assuming all keys and values are string
+    Return the formatted local state in app_id of an account_info response, {} if not opted in
     """
-    results = client.account_info(addr)
-    for local_state in results["apps-local-state"]:
+    for local_state in account_info["apps-local-state"]:
         if local_state["id"] == app_id:
             if "key-value" not in local_state:
                 return {}
@@ -82,11 +123,59 @@ def read_local_state(client, addr, app_id):
     return {}
 
 
+def parse_global_state(application_info: dict) -> dict:
+    """
+    Return the formatted global state of an application_info response
+    """
+    if "global-state" in application_info["params"]:
+        return format_state(application_info["params"]["global-state"])
+    return {}
+
+
+def read_local_state(client, addr, app_id):
+    """
+    Read user local state assuming all keys and values are string
+    Both voter layouts are returned as can_vote/voted entries
+    """
+    return parse_local_state(client.account_info(addr), app_id)
+
+
 def read_global_state(client, app_id):
     """
     Read global state assuming all keys and values are string
     """
+    return parse_global_state(client.application_info(app_id))
+
+
+def read_election_result(client, app_id):
+    """
+    Read an election's result: {"finalized", "total_votes", "winner", "winner_option", "tally_hash"}
+    A finalized election's snapshot is read without decoding the tallies, before finalization the result
+    is computed from the full global state
+    """
     app = client.application_info(app_id)
-    if "global-state" in app["params"]:
-        return format_state(app["params"]["global-state"])
-    return {}
+    state = app["params"].get("global-state", [])
+    snapshot = {}
+    for item in state:
+        key = _finalized_keys.get(item["key"])
+        if key is not None:
+            value = item["value"]
+            snapshot[key] = base64.b64decode(value["bytes"]) if value["type"] == 1 else value["uint"]
+    if "TotalVotes" in snapshot:
+        result = {
+            "finalized": True,
+            "total_votes": snapshot["TotalVotes"],
+            "winner": snapshot["Winner"],
+            "tally_hash": snapshot["TallyHash"],
+        }
+        options = snapshot["VoteOptions"].decode("utf-8")
+    else:
+        from election_model import election_result
+
+        global_state = format_state(state)
+        result = dict(election_result(global_state), finalized=False)
+        options = global_state["VoteOptions"]
+    # the winner's name is the winner-th comma separated option
+    names = options.split(",")
+    result["winner_option"] = names[result["winner"]] if result["winner"] < len(names) else None
+    return result
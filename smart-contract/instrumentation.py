@@ -0,0 +1,243 @@
+"""
+Opt-in latency and throughput instrumentation for chain interactions
+
+Call enable() to start recording, then wrap clients, sync or async (async_helper), with instrument(client).
+While enabled this records per-operation latency histograms (every algod call, transaction signing in
+helper.sign_transaction, state decoding in helper.format_state, and the confirmation of each group sent
+through a wrapped client, from its send to the poll that finds it confirmed) and counters of transactions
+sent, confirmed and failed and rounds waited.
+Opcode cost per app call is not recorded: algod's confirmed transaction info does not report it, and
+deriving it would take an extra dryrun or simulate call for every transaction.
+Export with write_prometheus() or write_json(). While disabled every hook is a single flag check.
+"""
+
+import bisect
+import collections
+import inspect
+import json
+import math
+import os
+import threading
+import time
+
+import helper
+
+enabled = False
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class Histogram:
+    """Fixed-bucket histogram, exported with cumulative bucket counts as Prometheus does"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        total = 0
+        cumulative = []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+
+class Metrics:
+    """Thread-safe registry of operation latency histograms and counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latencies = {}
+            self.counters = {"sent": 0, "confirmed": 0, "failed": 0, "rounds_waited": 0}
+
+    def observe(self, operation, seconds):
+        with self.lock:
+            if operation not in self.latencies:
+                self.latencies[operation] = Histogram(latency_buckets)
+            self.latencies[operation].observe(seconds)
+
+    def inc(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def snapshot(self) -> dict:
+        """Return all recorded data as a JSON-serializable dict"""
+        def histogram(h):
+            return {
+                "buckets": {str(le): count for le, count in zip(h.buckets, h.cumulative_counts())},
+                "sum": h.sum,
+                "count": h.count,
+            }
+
+        with self.lock:
+            return {
+                "latency_seconds": {operation: histogram(h) for operation, h in sorted(self.latencies.items())},
+                "counters": dict(self.counters),
+            }
+
+    def to_prometheus(self) -> str:
+        """Return all recorded data in the Prometheus text exposition format"""
+        def le(bound):
+            return "+Inf" if bound == math.inf else repr(bound)
+
+        lines = ["# TYPE election_operation_seconds histogram"]
+        with self.lock:
+            for operation, h in sorted(self.latencies.items()):
+                for bound, count in zip(h.buckets, h.cumulative_counts()):
+                    lines.append(f'election_operation_seconds_bucket{{operation="{operation}",le="{le(bound)}"}} {count}')
+                lines.append(f'election_operation_seconds_sum{{operation="{operation}"}} {h.sum}')
+                lines.append(f'election_operation_seconds_count{{operation="{operation}"}} {h.count}')
+            for counter, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE election_{counter}_total counter")
+                lines.append(f"election_{counter}_total {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def enable():
+    """Start recording"""
+    global enabled
+    enabled = True
+    helper.observe = metrics.observe
+
+
+def disable():
+    """Stop recording"""
+    global enabled
+    enabled = False
+    helper.observe = None
+
+
+class InstrumentedClient:
+    """
+    Wraps an algod client (AlgodClient, AlgodRouter, LocalAlgod, AsyncAlgodClient, ...) to time each of its calls
+    Submissions also count transactions sent and failed. The transactions sent are kept, at most max_pending
+    of them, until a pending_transaction_info poll finds one of their group confirmed, which records the
+    confirmation latency and the rounds waited since the last round the node reported before the send.
+    """
+
+    def __init__(self, client, max_pending=10000):
+        self.client = client
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.last_round = None
+        # tx_id -> (group tx ids, send start time, last round seen before the send)
+        self.pending = collections.OrderedDict()
+
+    def _sent(self, method, args, kwargs, start):
+        if method == "send_transactions":
+            txns = args[0] if args else kwargs["txns"]
+        elif method == "send_transaction":
+            txns = [args[0] if args else kwargs["txn"]]
+        else:
+            # raw bytes carry no transaction ids to follow
+            metrics.inc("sent")
+            return
+        metrics.inc("sent", len(txns))
+        tx_ids = [signed_txn.transaction.get_txid() for signed_txn in txns]
+        with self.lock:
+            entry = (tx_ids, start, self.last_round)
+            for tx_id in tx_ids:
+                self.pending[tx_id] = entry
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def _confirmed(self, tx_id, confirmed_round):
+        with self.lock:
+            entry = self.pending.get(tx_id)
+            if entry is None:
+                return
+            for group_tx_id in entry[0]:
+                self.pending.pop(group_tx_id, None)
+        tx_ids, start, sent_round = entry
+        metrics.observe("confirmation", time.perf_counter() - start)
+        metrics.inc("confirmed", len(tx_ids))
+        if sent_round is not None:
+            metrics.inc("rounds_waited", max(confirmed_round - sent_round, 0))
+
+    def _record(self, method, args, kwargs, start, result):
+        # count what a successful call sent, confirmed or says about the node's round
+        if method.startswith("send_"):
+            self._sent(method, args, kwargs, start)
+        elif method == "pending_transaction_info":
+            if result.get("confirmed-round"):
+                self._confirmed(args[0] if args else kwargs["transaction_id"], result["confirmed-round"])
+        else:
+            # status replies carry the last round, suggested params start at it
+            last_round = result.get("last-round") if isinstance(result, dict) else getattr(result, "first", None)
+            if isinstance(last_round, int):
+                with self.lock:
+                    self.last_round = max(self.last_round or 0, last_round)
+
+    def __getattr__(self, method):
+        call = getattr(self.client, method)
+        if not callable(call):
+            return call
+
+        if inspect.iscoroutinefunction(call):
+            async def timed_call(*args, **kwargs):
+                if not enabled:
+                    return await call(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = await call(*args, **kwargs)
+                except Exception:
+                    if method.startswith("send_"):
+                        metrics.inc("failed")
+                    raise
+                finally:
+                    metrics.observe(method, time.perf_counter() - start)
+                self._record(method, args, kwargs, start, result)
+                return result
+        else:
+            def timed_call(*args, **kwargs):
+                if not enabled:
+                    return call(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = call(*args, **kwargs)
+                except Exception:
+                    if method.startswith("send_"):
+                        metrics.inc("failed")
+                    raise
+                finally:
+                    metrics.observe(method, time.perf_counter() - start)
+                self._record(method, args, kwargs, start, result)
+                return result
+
+        # cache the wrapper so later lookups skip __getattr__
+        setattr(self, method, timed_call)
+        return timed_call
+
+
+def instrument(client):
+    """Return client wrapped so its calls are recorded while instrumentation is enabled"""
+    return InstrumentedClient(client)
+
+
+def write_prometheus(path):
+    """Write the recorded data as a Prometheus text file, e.g. for the node exporter's textfile collector"""
+    with open(path + ".tmp", "w") as f:
+        f.write(metrics.to_prometheus())
+    # the collector must never read a half-written file
+    os.replace(path + ".tmp", path)
+
+
+def write_json(path):
+    """Write a JSON snapshot of the recorded data"""
+    with open(path, "w") as f:
+        json.dump(metrics.snapshot(), f, indent=2)
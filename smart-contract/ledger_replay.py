@@ -0,0 +1,247 @@
+"""
+Replay recorded application calls to reconstruct an election's state at any past round
+
+Transactions are read from a source in indexer format and applied to election_model.
+Periodic checkpoints are written to disk so a query for round R only replays the
+transactions confirmed after the nearest checkpoint at or below R.
+"""
+
+import base64
+import bisect
+import hashlib
+import json
+import os
+
+from algosdk.encoding import decode_address, encode_address
+
+from election_model import apply_confirmed_call, create_election_from_args, is_compact_status_schema
+from helper import int_to_bytes
+from state_format import from_json_value, to_json_value
+
+
+class LocalTransactionSource:
+    """
+    In-memory stand-in for the indexer's transaction search
+    Holds application call records in indexer format, ordered by confirmed round
+    """
+
+    def __init__(self, transactions=(), round=None):
+        self.transactions = sorted(transactions, key=lambda txn: txn["confirmed-round"])
+        self.rounds = [txn["confirmed-round"] for txn in self.transactions]
+        # the last round whose transactions are all recorded, by default the last round given
+        self.round = round if round is not None else (self.rounds[-1] if self.rounds else 0)
+
+    def append(self, txn):
+        """Record a confirmed transaction, which must not be older than the last one recorded"""
+        if self.rounds and txn["confirmed-round"] < self.rounds[-1]:
+            raise ValueError("transactions must be appended in round order")
+        self.transactions.append(txn)
+        self.rounds.append(txn["confirmed-round"])
+
+    def advance(self, round):
+        """Mark every transaction up to round as recorded"""
+        self.round = max(self.round, round)
+
+    def last_round(self) -> int:
+        """Return the last round whose transactions are all recorded"""
+        return self.round
+
+    def search(self, app_id, min_round=0, max_round=None):
+        """Yield the app's transactions confirmed in rounds min_round..max_round inclusive"""
+        start = bisect.bisect_left(self.rounds, min_round)
+        end = len(self.rounds) if max_round is None else bisect.bisect_right(self.rounds, max_round)
+        for i in range(start, end):
+            if _txn_app_id(self.transactions[i]) == app_id:
+                yield self.transactions[i]
+
+
+class IndexerTransactionSource:
+    """Transaction source backed by an algosdk IndexerClient"""
+
+    def __init__(self, indexer_client, page_size=1000):
+        self.indexer_client = indexer_client
+        self.page_size = page_size
+
+    def last_round(self) -> int:
+        """Return the last round the indexer has ingested"""
+        return self.indexer_client.health()["round"]
+
+    def search(self, app_id, min_round=0, max_round=None):
+        next_page = None
+        while True:
+            response = self.indexer_client.search_transactions(
+                application_id=app_id,
+                min_round=min_round,
+                max_round=max_round,
+                limit=self.page_size,
+                next_page=next_page,
+            )
+            yield from response["transactions"]
+            next_page = response.get("next-token")
+            if not next_page or not response["transactions"]:
+                return
+
+
+def _txn_app_id(txn):
+    return txn.get("created-application-index") or txn["application-transaction"]["application-id"]
+
+
+class LedgerReplay:
+    """
+    Reconstruct the global and local state of one election app at any historical round
+    A checkpoint is stored every checkpoint_interval rounds under checkpoint_dir/<app_id>/
+    """
+
+    def __init__(self, source, app_id, checkpoint_dir, checkpoint_interval=1000):
+        self.source = source
+        self.app_id = app_id
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_dir = os.path.join(checkpoint_dir, str(app_id))
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def checkpoint_rounds(self):
+        """Return the rounds that have a checkpoint on disk, in ascending order"""
+        rounds = []
+        for name in os.listdir(self.checkpoint_dir):
+            if name.endswith(".json"):
+                rounds.append(int(name[:-len(".json")]))
+        return sorted(rounds)
+
+    def _checkpoint_path(self, round):
+        return os.path.join(self.checkpoint_dir, f"{round}.json")
+
+    def _load_checkpoint(self, round):
+        with open(self._checkpoint_path(round)) as f:
+            snapshot = json.load(f)
+        return {
+            "round": snapshot["round"],
+            "creator": snapshot["creator"],
+            "compact_status": snapshot.get("compact_status", False),
+            "global": {key: from_json_value(value) for key, value in snapshot["global"].items()},
+            "local": {
+                addr: {key: from_json_value(value) for key, value in local_state.items()}
+                for addr, local_state in snapshot["local"].items()
+            },
+        }
+
+    def _save_checkpoint(self, state):
+        snapshot = {
+            "round": state["round"],
+            "creator": state["creator"],
+            "compact_status": state["compact_status"],
+            "global": {key: to_json_value(value) for key, value in state["global"].items()},
+            "local": {
+                addr: {key: to_json_value(value) for key, value in local_state.items()}
+                for addr, local_state in state["local"].items()
+            },
+        }
+        # write to a temporary file first so a crash never leaves a truncated checkpoint behind
+        path = self._checkpoint_path(state["round"])
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+
+    def _apply(self, state, txn):
+        appl = txn["application-transaction"]
+        app_args = [base64.b64decode(arg) for arg in appl.get("application-args", [])]
+        if txn.get("created-application-index"):
+            state["creator"] = txn["sender"]
+            schema = appl.get("local-state-schema", {})
+            state["compact_status"] = is_compact_status_schema(schema.get("num-uint", 0),
+                                                               schema.get("num-byte-slice", 0))
+            state["global"] = create_election_from_args(app_args)
+            return
+        # the chain already approved the call, so it is applied without the model's checks
+        apply_confirmed_call(
+            state["global"],
+            state["local"],
+            state["creator"],
+            txn["sender"],
+            txn["confirmed-round"],
+            appl["on-completion"],
+            app_args,
+        )
+
+    def state_at(self, round):
+        """
+        Return the app state after all transactions confirmed in or before round
+        as a dict with "round", "creator", "compact_status", "global" and "local" entries
+        """
+        checkpoints = [r for r in self.checkpoint_rounds() if r <= round]
+        if checkpoints:
+            state = self._load_checkpoint(checkpoints[-1])
+        else:
+            state = {"round": 0, "creator": None, "compact_status": False, "global": {}, "local": {}}
+        start_round = state["round"] + 1
+
+        # boundaries at or below both round and the source's last complete round hold final state,
+        # so checkpoints crossed on the way are saved; later rounds may still gain transactions
+        complete_round = min(round, self.source.last_round())
+        next_checkpoint = (state["round"] // self.checkpoint_interval + 1) * self.checkpoint_interval
+        for txn in self.source.search(self.app_id, min_round=start_round, max_round=round):
+            while next_checkpoint < txn["confirmed-round"] and next_checkpoint <= complete_round:
+                state["round"] = next_checkpoint
+                self._save_checkpoint(state)
+                next_checkpoint += self.checkpoint_interval
+            self._apply(state, txn)
+        while next_checkpoint <= complete_round:
+            state["round"] = next_checkpoint
+            self._save_checkpoint(state)
+            next_checkpoint += self.checkpoint_interval
+        state["round"] = round
+        return state
+
+    def build_checkpoints(self, up_to_round):
+        """Replay up to up_to_round, writing every checkpoint along the way"""
+        self.state_at(up_to_round)
+
+
+def _appl_txn(round, sender, app_id, on_complete, app_args=()):
+    return {
+        "confirmed-round": round,
+        "sender": sender,
+        "tx-type": "appl",
+        "application-transaction": {
+            "application-id": app_id,
+            "on-completion": on_complete,
+            "application-args": [base64.b64encode(arg).decode("ascii") for arg in app_args],
+        },
+    }
+
+
+def generate_election_transactions(app_id, num_voters, num_vote_options=4, vote_options="A,B,C,D",
+                                   election_end=None, txns_per_round=50):
+    """
+    Return a synthetic but valid transaction history for one election, for the local source and benchmarks
+    Every voter opts in, gets approved or rejected by the creator and, if approved, votes.
+    Every tenth voter that voted closes out again before the election ends.
+    """
+    addresses = [encode_address(hashlib.sha256(f"{app_id}-{i}".encode()).digest()) for i in range(num_voters + 1)]
+    creator, voters = addresses[0], addresses[1:]
+
+    calls = []
+    for voter in voters:
+        calls.append((voter, "optin", []))
+    for i, voter in enumerate(voters):
+        status = b"no" if i % 7 == 6 else b"yes"
+        calls.append((creator, "noop", [b"update_user_status", decode_address(voter), status]))
+    for i, voter in enumerate(voters):
+        if i % 7 != 6:
+            calls.append((voter, "noop", [b"vote", int_to_bytes(i % num_vote_options)]))
+    for i, voter in enumerate(voters):
+        if i % 7 != 6 and i % 10 == 9:
+            calls.append((voter, "closeout", []))
+
+    last_round = 1 + len(calls) // txns_per_round + 1
+    if election_end is None:
+        election_end = last_round + 1000
+
+    create_txn = _appl_txn(1, creator, 0, "noop", [
+        int_to_bytes(election_end), int_to_bytes(num_vote_options), vote_options.encode("utf-8"),
+    ])
+    create_txn["created-application-index"] = app_id
+    transactions = [create_txn]
+    for i, (sender, on_complete, app_args) in enumerate(calls):
+        transactions.append(_appl_txn(2 + i // txns_per_round, sender, app_id, on_complete, app_args))
+    return transactions
+
@@ -0,0 +1,300 @@
+"""
+Disk-backed app state for local_algod.LocalLedger
+
+With a SqliteLedgerStore, LocalLedger keeps each app's global and local state in SQLite instead of
+Python dicts, so simulations with millions of voters run in bounded memory. A voter's local state is
+one row: the address and the can_vote/voted pair packed into a single integer with the compact
+status layout of election_params; anything that does not fit that layout is kept as JSON alongside.
+Writes are buffered and written in one transaction per produced block, or sooner once max_pending
+writes are buffered, though never while LocalLedger.apply_group holds the store for a group that
+may still be rolled back. Reopening a store file restores the ledger's apps and round.
+"""
+
+import contextlib
+import json
+import sqlite3
+from collections.abc import MutableMapping
+
+from election_params import status_maybe, status_yes, status_no
+from state_format import from_json_value, to_json_value
+
+_status_codes = {"maybe": status_maybe, "yes": status_yes, "no": status_no}
+_status_names = {code: name for name, code in _status_codes.items()}
+
+# a voted choice is stored + 1 above the two eligibility bits of the status integer
+_max_voted = 2 ** 61 - 2
+
+_schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS apps (
+    app_id INTEGER PRIMARY KEY, creator TEXT NOT NULL, coordinator INTEGER NOT NULL, compact_status INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS global_state (
+    app_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (app_id, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS local_state (
+    app_id INTEGER NOT NULL, address TEXT NOT NULL, status INTEGER NOT NULL, extra TEXT,
+    PRIMARY KEY (app_id, address)
+) WITHOUT ROWID;
+"""
+
+
+def encode_local_state(state: dict):
+    """Pack a local state dict into (status, extra): the status integer and JSON of any other entries"""
+    rest = dict(state)
+    status = 0
+    can_vote = rest.pop("can_vote", None)
+    if can_vote in _status_codes:
+        status |= _status_codes[can_vote]
+    elif can_vote is not None:
+        rest["can_vote"] = can_vote
+    voted = rest.pop("voted", None)
+    if isinstance(voted, int) and 0 <= voted <= _max_voted:
+        status |= (voted + 1) << 2
+    elif voted is not None:
+        rest["voted"] = voted
+    extra = json.dumps({key: to_json_value(value) for key, value in rest.items()}) if rest else None
+    return status, extra
+
+
+def decode_local_state(status: int, extra) -> dict:
+    """Unpack a (status, extra) row into the local state dict"""
+    state = {}
+    if status & 3:
+        state["can_vote"] = _status_names[status & 3]
+    if status >> 2:
+        state["voted"] = (status >> 2) - 1
+    if extra:
+        state.update({key: from_json_value(value) for key, value in json.loads(extra).items()})
+    return state
+
+
+class SqliteGlobalState(MutableMapping):
+    """
+    An app's global state, held in memory and written to the store on flush
+    Global state has at most 64 entries, so it is cached whole
+    """
+
+    def __init__(self, store, app_id, values):
+        self.store = store
+        self.app_id = app_id
+        self.values = values
+        self.dirty = set()
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        self.dirty.add(key)
+
+    def __delitem__(self, key):
+        del self.values[key]
+        self.dirty.add(key)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def pending_writes(self):
+        """Return and clear the buffered (key, JSON value or None to delete) writes"""
+        writes = [(key, json.dumps(to_json_value(self.values[key])) if key in self.values else None)
+                  for key in self.dirty]
+        self.dirty = set()
+        return writes
+
+
+class SqliteLocalStates(MutableMapping):
+    """
+    Mapping of address to local state for one app, stored one row per account
+    Reads see buffered writes; values are fresh dicts, so a changed state must be assigned back
+    """
+
+    def __init__(self, store, app_id):
+        self.store = store
+        self.app_id = app_id
+        # address -> state dict, or None once deleted
+        self.pending = {}
+
+    def __getitem__(self, address):
+        if address in self.pending:
+            state = self.pending[address]
+            if state is None:
+                raise KeyError(address)
+            return dict(state)
+        row = self.store.connection.execute(
+            "SELECT status, extra FROM local_state WHERE app_id = ? AND address = ?",
+            (self.app_id, address),
+        ).fetchone()
+        if row is None:
+            raise KeyError(address)
+        return decode_local_state(*row)
+
+    def __contains__(self, address):
+        try:
+            self[address]
+        except KeyError:
+            return False
+        return True
+
+    def __setitem__(self, address, state):
+        self.pending[address] = dict(state)
+        self.store.buffered()
+
+    def __delitem__(self, address):
+        if address not in self:
+            raise KeyError(address)
+        self.pending[address] = None
+        self.store.buffered()
+
+    def __len__(self):
+        self.store.flush()
+        return self.store.connection.execute(
+            "SELECT COUNT(*) FROM local_state WHERE app_id = ?", (self.app_id,)
+        ).fetchone()[0]
+
+    def __iter__(self):
+        for address, _ in self.items():
+            yield address
+
+    def page(self, after=None, limit=1000):
+        """Return up to limit (address, state) pairs in address order, starting after the given address"""
+        self.store.flush()
+        after = after or ""
+        rows = self.store.connection.execute(
+            "SELECT address, status, extra FROM local_state WHERE app_id = ? AND address > ? "
+            "ORDER BY address LIMIT ?",
+            (self.app_id, after, limit),
+        ).fetchall()
+        return [(address, decode_local_state(status, extra)) for address, status, extra in rows]
+
+    def items(self):
+        """Yield every (address, state) pair in address order, a page at a time"""
+        after = None
+        while True:
+            page = self.page(after)
+            yield from page
+            if len(page) < 1000:
+                return
+            after = page[-1][0]
+
+    def pending_writes(self):
+        """Return and clear the buffered (address, state or None to delete) writes"""
+        writes = self.pending
+        self.pending = {}
+        return writes
+
+
+class SqliteLedgerStore:
+    """
+    SQLite store of the apps of a LocalLedger, pass it as LocalLedger(store=...)
+    path is a database file, which may hold the state of an earlier run to resume from
+    """
+
+    def __init__(self, path, max_pending=10000):
+        # readers such as export_roll's prefetching sources query the store from their own threads
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # reopened stores are resumed, so a crash must not corrupt the file; with a write-ahead log the
+        # per-block transaction appends to the log, and syncing only at checkpoints may lose the last
+        # blocks on power loss, which rerunning the simulation recovers
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_schema)
+        self.max_pending = max_pending
+        self.num_pending = 0
+        self.holds = 0
+        self.apps = {}
+        # app_id -> apps row of the apps created since the last flush
+        self.created = {}
+
+    def meta(self):
+        """Return the saved (round, next_app_id), or None for a new store"""
+        rows = dict(self.connection.execute("SELECT key, value FROM meta"))
+        if "round" not in rows:
+            return None
+        return rows["round"], rows["next_app_id"]
+
+    def load_apps(self) -> dict:
+        """Return the saved apps in LocalLedger.apps form"""
+        apps = {}
+        for app_id, creator, coordinator, compact_status in self.connection.execute(
+                "SELECT app_id, creator, coordinator, compact_status FROM apps"):
+            values = {key: from_json_value(json.loads(value)) for key, value in self.connection.execute(
+                "SELECT key, value FROM global_state WHERE app_id = ?", (app_id,))}
+            apps[app_id] = self._app(app_id, creator, bool(coordinator), bool(compact_status), values)
+        return apps
+
+    def _app(self, app_id, creator, coordinator, compact_status, values):
+        global_state = SqliteGlobalState(self, app_id, values)
+        local_states = SqliteLocalStates(self, app_id)
+        self.apps[app_id] = (global_state, local_states)
+        return {"creator": creator, "coordinator": coordinator, "compact_status": compact_status,
+                "global": global_state, "local": local_states}
+
+    def create_app(self, app_id, creator, coordinator, global_state, compact_status=False) -> dict:
+        """Return a new app in LocalLedger.apps form with the given initial global state"""
+        self.created[app_id] = (app_id, creator, int(coordinator), int(compact_status))
+        app = self._app(app_id, creator, coordinator, compact_status, {})
+        app["global"].update(global_state)
+        return app
+
+    def delete_app(self, app_id):
+        self.apps.pop(app_id, None)
+        if self.created.pop(app_id, None) is not None:
+            # never written
+            return
+        with self.connection:
+            for table in ("apps", "global_state", "local_state"):
+                self.connection.execute(f"DELETE FROM {table} WHERE app_id = ?", (app_id,))
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        Hold off flushing buffered writes, e.g. while applying an atomic group that may still be rolled
+        back; max_pending is checked again once the last hold is released
+        """
+        self.holds += 1
+        try:
+            yield
+        finally:
+            self.holds -= 1
+            if not self.holds and self.num_pending >= self.max_pending:
+                self.flush()
+
+    def buffered(self):
+        """Count a buffered local state write, flushing once max_pending are buffered and nothing holds the store"""
+        self.num_pending += 1
+        if self.num_pending >= self.max_pending and not self.holds:
+            self.flush()
+
+    def flush(self, round=None, next_app_id=None):
+        """Write every buffered change in one transaction, along with the ledger's round if given"""
+        with self.connection:
+            self.connection.executemany("INSERT INTO apps VALUES (?, ?, ?, ?)", self.created.values())
+            self.created = {}
+            for app_id, (global_state, local_states) in self.apps.items():
+                for key, value in global_state.pending_writes():
+                    if value is None:
+                        self.connection.execute("DELETE FROM global_state WHERE app_id = ? AND key = ?",
+                                                (app_id, key))
+                    else:
+                        self.connection.execute("INSERT OR REPLACE INTO global_state VALUES (?, ?, ?)",
+                                                (app_id, key, value))
+                writes = local_states.pending_writes()
+                deletes = [(app_id, address) for address, state in writes.items() if state is None]
+                self.connection.executemany("DELETE FROM local_state WHERE app_id = ? AND address = ?", deletes)
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO local_state VALUES (?, ?, ?, ?)",
+                    ((app_id, address, *encode_local_state(state))
+                     for address, state in writes.items() if state is not None),
+                )
+            if round is not None:
+                self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                            [("round", round), ("next_app_id", next_app_id)])
+        self.num_pending = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
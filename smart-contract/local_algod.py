@@ -0,0 +1,491 @@
+"""
+Local stand-in for an algod node, so tooling can be exercised offline
+
+LocalAlgod implements the subset of algod.AlgodClient used by helper.py, deploy.py and
+simple_tests.py. Application calls are evaluated with election_model instead of running
+TEAL, and every confirmed call is recorded in indexer format for ledger_replay. Apps created
+with four arguments are taken to be sharded election coordinators, any other app an election,
+which uses the compact voter status layout when created with its local state schema.
+The transactions of one send_transactions call are applied as an atomic group, all or nothing.
+Several LocalAlgod instances can share one LocalLedger to stand in for multiple endpoints.
+LocalIndexer serves the indexer's paged account search from the same ledger, and AsyncLocalAlgod
+wraps a LocalAlgod for the asyncio helpers of async_helper.py.
+"""
+
+import asyncio
+import base64
+import contextlib
+import hashlib
+import itertools
+import threading
+import time
+from collections import deque
+from collections.abc import MutableMapping
+
+from algosdk.error import AlgodHTTPError
+from algosdk.transaction import SuggestedParams
+
+from election_model import ON_COMPLETE_NAMES, ON_COMPLETE_CODES, CallRejected, apply_call, apply_coordinator_call, \
+    check_create, create_coordinator, create_election_from_args, is_compact_status_schema
+from election_params import compact_local_bytes, compact_local_ints, local_bytes, local_ints
+from ledger_replay import LocalTransactionSource
+from state_format import encode_key, encode_voter_status
+
+genesis_id = "local-v1"
+genesis_hash = base64.b64encode(hashlib.sha256(genesis_id.encode()).digest()).decode("ascii")
+
+
+def encode_state(state: dict) -> list:
+    """
+    Encode a state dict into algod's key-value list, the inverse of helper.format_state
+    """
+    encoded = []
+    for key, value in state.items():
+        if isinstance(key, str):
+            key = encode_key(key)
+        if isinstance(value, int):
+            encoded_value = {"type": 2, "bytes": "", "uint": value}
+        else:
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            encoded_value = {"type": 1, "bytes": base64.b64encode(value).decode("ascii"), "uint": 0}
+        encoded.append({"key": base64.b64encode(key).decode("ascii"), "value": encoded_value})
+    return encoded
+
+
+def encode_delta(before: dict, after: dict) -> list:
+    """
+    Encode the change from state before to state after as an algod state delta
+    Action 1 sets a byte value, 2 sets a uint and 3 deletes the key
+    """
+    delta = []
+    changed = {key: value for key, value in after.items() if key not in before or before[key] != value}
+    for item in encode_state(changed):
+        value = item["value"]
+        if value["type"] == 2:
+            delta.append({"key": item["key"], "value": {"action": 2, "uint": value["uint"]}})
+        else:
+            delta.append({"key": item["key"], "value": {"action": 1, "bytes": value["bytes"]}})
+    for key in before.keys() - after.keys():
+        encoded_key = encode_key(key) if isinstance(key, str) else key
+        delta.append({"key": base64.b64encode(encoded_key).decode("ascii"), "value": {"action": 3}})
+    return delta
+
+
+def _stored_local_state(app, state: dict) -> dict:
+    # the local state as the app's program stores it, a single status uint in the compact layout
+    if app.get("compact_status"):
+        return {"status": encode_voter_status(state)}
+    return state
+
+
+def _local_schema(app) -> dict:
+    if app["coordinator"]:
+        num_uints, num_byte_slices = 0, 0
+    elif app.get("compact_status"):
+        num_uints, num_byte_slices = compact_local_ints, compact_local_bytes
+    else:
+        num_uints, num_byte_slices = local_ints, local_bytes
+    return {"num-uint": num_uints, "num-byte-slice": num_byte_slices}
+
+
+class _RecordingStates(MutableMapping):
+    """Pass-through view of an app's local states that remembers the previous state of every account written"""
+
+    def __init__(self, states):
+        self.states = states
+        self.before = {}
+
+    def __getitem__(self, address):
+        return self.states[address]
+
+    def __setitem__(self, address, state):
+        self.before.setdefault(address, self.states.get(address))
+        self.states[address] = state
+
+    def __delitem__(self, address):
+        self.before.setdefault(address, self.states.get(address))
+        del self.states[address]
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def __len__(self):
+        return len(self.states)
+
+
+class LocalLedger:
+    """
+    In-memory ledger shared by one or more LocalAlgod stand-ins
+    With a store (ledger_store.SqliteLedgerStore) app state lives on disk and is written once per block.
+    Without keep_history, confirmed calls are not recorded for ledger_replay and transaction info
+    is forgotten tx_info_rounds rounds after confirmation, keeping memory bounded.
+    """
+
+    tx_info_rounds = 10
+
+    def __init__(self, round=1, store=None, keep_history=True):
+        self.round = round
+        self.next_app_id = 1
+        self.store = store
+        self.keep_history = keep_history
+        # LocalAlgod clients on several threads share the ledger
+        self.lock = threading.RLock()
+        # app_id -> {"creator": address, "coordinator": bool, "compact_status": bool, "global": dict,
+        #            "local": {address: dict}}
+        self.apps = {}
+        self.tx_info = {}
+        self.pending = []
+        self.history = LocalTransactionSource()
+        # (confirmed round, tx ids) of the blocks whose transaction info is still kept
+        self.confirmed = deque()
+        if store is not None and store.meta() is not None:
+            self.round, self.next_app_id = store.meta()
+            self.apps = store.load_apps()
+
+    def produce_block(self):
+        """Advance one round, confirming every pending transaction"""
+        with self.lock:
+            self.round += 1
+            for tx_id in self.pending:
+                info = self.tx_info[tx_id]
+                info["confirmed-round"] = self.round
+                if self.keep_history:
+                    self.history.append(dict(info["record"], **{"confirmed-round": self.round}))
+            self.history.advance(self.round)
+            if not self.keep_history:
+                self.confirmed.append((self.round, self.pending))
+                while self.confirmed and self.confirmed[0][0] <= self.round - self.tx_info_rounds:
+                    for tx_id in self.confirmed.popleft()[1]:
+                        del self.tx_info[tx_id]
+            self.pending = []
+            if self.store is not None:
+                self.store.flush(self.round, self.next_app_id)
+
+    def submit(self, signed_txn):
+        """Evaluate an application call against the state it will be confirmed on and apply it"""
+        return self.submit_group([signed_txn])[0]
+
+    def submit_group(self, signed_txns):
+        """Evaluate and apply the application calls of an atomic group, see apply_group"""
+        calls = []
+        for signed_txn in signed_txns:
+            txn = signed_txn.transaction
+            local_schema = (txn.local_schema.num_uints, txn.local_schema.num_byte_slices) if txn.local_schema else None
+            calls.append((txn.get_txid(), txn.sender, txn.index, ON_COMPLETE_NAMES[int(txn.on_complete)],
+                          list(txn.app_args or []), list(txn.accounts or []), local_schema))
+        return self.apply_group(calls)
+
+    def apply(self, tx_id, sender, app_id, on_complete, app_args=(), accounts=(), local_schema=None):
+        """
+        Evaluate and apply an application call given by its fields, app_id 0 creating an app
+        local_schema is the created app's (num_uints, num_byte_slices)
+        Raise AlgodHTTPError if the call is rejected, otherwise return tx_id
+        """
+        return self.apply_group([(tx_id, sender, app_id, on_complete, app_args, accounts, local_schema)])[0]
+
+    def apply_group(self, calls):
+        """
+        Evaluate and apply the calls of an atomic group, each given as a tuple of apply's arguments
+        The group is applied all or nothing: if a call is rejected, the changes of the calls before it
+        are rolled back and AlgodHTTPError is raised. Otherwise return the tx ids
+        """
+        # the store must not flush a group that may still be rolled back
+        with self.lock, self.store.hold() if self.store is not None else contextlib.nullcontext():
+            undo = []
+            deleted = []
+            num_pending = len(self.pending)
+            try:
+                tx_ids = [self._apply(undo, deleted, *call) for call in calls]
+            except Exception:
+                for action in reversed(undo):
+                    action()
+                for tx_id in self.pending[num_pending:]:
+                    del self.tx_info[tx_id]
+                del self.pending[num_pending:]
+                raise
+            # a deleted app can no longer be restored once its group is applied
+            if self.store is not None:
+                for app_id in deleted:
+                    self.store.delete_app(app_id)
+            return tx_ids
+
+    def _uncreate(self, app_id):
+        del self.apps[app_id]
+        self.next_app_id = app_id
+        if self.store is not None:
+            self.store.delete_app(app_id)
+
+    @staticmethod
+    def _restore(app, global_before, local_states):
+        for key in [key for key in app["global"] if key not in global_before]:
+            del app["global"][key]
+        for key, value in global_before.items():
+            if key not in app["global"] or app["global"][key] != value:
+                app["global"][key] = value
+        for address, before in local_states.before.items():
+            if before is not None:
+                app["local"][address] = before
+            elif address in app["local"]:
+                del app["local"][address]
+
+    def _apply(self, undo, deleted, tx_id, sender, app_id, on_complete, app_args=(), accounts=(), local_schema=None):
+        # apply one call of a group, appending to undo the actions that roll it back
+        app_args = list(app_args)
+        # the transaction is evaluated as part of the next block
+        round = self.round + 1
+        record = {
+            "id": tx_id,
+            "sender": sender,
+            "tx-type": "appl",
+            "application-transaction": {
+                "application-id": app_id,
+                "on-completion": on_complete,
+                "application-args": [base64.b64encode(arg).decode("ascii") for arg in app_args],
+                "accounts": list(accounts),
+            },
+        }
+        info = {"pool-error": "", "txn": {"txn": {"apid": app_id, "snd": sender}}}
+        if on_complete != "noop":
+            info["txn"]["txn"]["apan"] = ON_COMPLETE_CODES[on_complete]
+        if self.keep_history:
+            info["record"] = record
+
+        if app_id == 0:
+            coordinator = len(app_args) == 4
+            reason = None if coordinator else check_create(app_args)
+            if reason is not None:
+                raise AlgodHTTPError(f"transaction rejected by ApprovalProgram: {reason}", code=400)
+            app_id = self.next_app_id
+            self.next_app_id += 1
+            compact_status = local_schema is not None and is_compact_status_schema(*local_schema)
+            global_state = create_coordinator(app_args) if coordinator else create_election_from_args(app_args)
+            if self.store is not None:
+                self.apps[app_id] = self.store.create_app(app_id, sender, coordinator, global_state,
+                                                          compact_status)
+            else:
+                self.apps[app_id] = {"creator": sender, "coordinator": coordinator,
+                                     "compact_status": compact_status, "global": global_state, "local": {}}
+            undo.append(lambda: self._uncreate(app_id))
+            if local_schema is not None:
+                record["application-transaction"]["local-state-schema"] = {
+                    "num-uint": local_schema[0], "num-byte-slice": local_schema[1]}
+            info["application-index"] = app_id
+            info["global-state-delta"] = encode_delta({}, global_state)
+            info["txn"]["txn"]["apid"] = app_id
+            record["created-application-index"] = app_id
+        else:
+            app = self.apps.get(app_id)
+            if app is None:
+                raise AlgodHTTPError(f"application {app_id} does not exist", code=400)
+            global_before = dict(app["global"])
+            local_states = _RecordingStates(app["local"])
+            undo.append(lambda: self._restore(app, global_before, local_states))
+            try:
+                if app["coordinator"]:
+                    apply_coordinator_call(app["global"], app["creator"], sender, on_complete, app_args)
+                else:
+                    apply_call(app["global"], local_states, app["creator"], sender, round, on_complete, app_args,
+                               app.get("compact_status", False))
+            except CallRejected as e:
+                raise AlgodHTTPError(f"transaction rejected by ApprovalProgram: {e.reason}", code=400)
+            # as algod does, the deltas leave out the local states removed by a closeout or clear
+            global_delta = encode_delta(global_before, app["global"]) if on_complete != "delete" else []
+            local_delta = [{"address": address,
+                            "delta": encode_delta(_stored_local_state(app, before or {}),
+                                                  _stored_local_state(app, app["local"][address]))}
+                           for address, before in local_states.before.items() if address in app["local"]]
+            if global_delta:
+                info["global-state-delta"] = global_delta
+            if any(entry["delta"] for entry in local_delta):
+                info["local-state-delta"] = [entry for entry in local_delta if entry["delta"]]
+            if on_complete == "delete":
+                del self.apps[app_id]
+                undo.append(lambda: self.apps.__setitem__(app_id, app))
+                deleted.append(app_id)
+
+        self.tx_info[tx_id] = info
+        self.pending.append(tx_id)
+        return tx_id
+
+
+class LocalAlgod:
+    """
+    Stand-in for algod.AlgodClient backed by a LocalLedger
+    lag makes the node report a last round behind the ledger, latency adds a delay to every call
+    and setting down to True makes every call fail as an unreachable node would.
+    """
+
+    def __init__(self, ledger=None, lag=0, latency=0.0):
+        self.ledger = ledger or LocalLedger()
+        self.lag = lag
+        self.latency = latency
+        self.down = False
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("local algod stand-in is down")
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _last_round(self):
+        return max(self.ledger.round - self.lag, 0)
+
+    def status(self, **kwargs):
+        self._call()
+        return {"last-round": self._last_round(), "time-since-last-round": 0, "catchup-time": 0}
+
+    def status_after_block(self, block_num=None, round_num=None, **kwargs):
+        self._call()
+        round = block_num if block_num is not None else round_num
+        while self._last_round() <= round:
+            self.ledger.produce_block()
+        return {"last-round": self._last_round(), "time-since-last-round": 0, "catchup-time": 0}
+
+    def suggested_params(self, **kwargs):
+        self._call()
+        last_round = self._last_round()
+        return SuggestedParams(0, last_round, last_round + 1000, genesis_hash, genesis_id, min_fee=1000)
+
+    def compile(self, source, source_map=False, **kwargs):
+        """The stand-in does not assemble TEAL, it returns the source bytes as the program"""
+        self._call()
+        program = source.encode("utf-8")
+        return {"hash": hashlib.sha256(program).hexdigest(), "result": base64.b64encode(program).decode("ascii")}
+
+    def disassemble(self, program_bytes, **kwargs):
+        """The inverse of compile: the program bytes are the source"""
+        self._call()
+        return {"result": program_bytes.decode("utf-8")}
+
+    def send_transactions(self, txns, **kwargs):
+        self._call()
+        return self.ledger.submit_group(txns)[0]
+
+    def send_transaction(self, txn, **kwargs):
+        return self.send_transactions([txn])
+
+    def pending_transaction_info(self, transaction_id, **kwargs):
+        self._call()
+        info = self.ledger.tx_info.get(transaction_id)
+        if info is None:
+            raise AlgodHTTPError("txn does not exist", code=404)
+        return {key: value for key, value in info.items() if key != "record"}
+
+    def account_info(self, address, **kwargs):
+        self._call()
+        apps_local_state = []
+        created_apps = []
+        with self.ledger.lock:
+            for app_id, app in self.ledger.apps.items():
+                if address in app["local"]:
+                    local_state = _stored_local_state(app, app["local"][address])
+                    apps_local_state.append({"id": app_id, "key-value": encode_state(local_state)})
+                if app["creator"] == address:
+                    created_apps.append({"id": app_id, "params": {"creator": address}})
+        return {"address": address, "apps-local-state": apps_local_state, "created-apps": created_apps}
+
+    def application_info(self, application_id, **kwargs):
+        self._call()
+        with self.ledger.lock:
+            app = self.ledger.apps.get(application_id)
+            if app is None:
+                raise AlgodHTTPError("application does not exist", code=404)
+            return {
+                "id": application_id,
+                "params": {"creator": app["creator"], "global-state": encode_state(app["global"]),
+                           "local-state-schema": _local_schema(app)},
+            }
+
+
+class LocalIndexer:
+    """
+    Stand-in for the account search of indexer.IndexerClient backed by a LocalLedger
+    Accounts are paged in opt-in order with the offset of the next page as next-token,
+    or in address order when the ledger keeps its state in a store
+    """
+
+    def __init__(self, ledger, latency=0.0):
+        self.ledger = ledger
+        self.latency = latency
+        self.calls = 0
+
+    def accounts(self, application_id=None, limit=None, next_page=None, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        with self.ledger.lock:
+            app = self.ledger.apps.get(application_id)
+            local_states = app["local"] if app is not None else {}
+            if hasattr(local_states, "page"):
+                # disk-backed states page by address, next-token is the last address returned
+                page = local_states.page(next_page, limit or 1000)
+                next_token = page[-1][0] if page else None
+            else:
+                offset = int(next_page) if next_page else 0
+                page = list(itertools.islice(local_states.items(), offset, offset + limit if limit else None))
+                next_token = str(offset + limit) if limit else None
+            response = {
+                "current-round": self.ledger.round,
+                "accounts": [
+                    {"address": address,
+                     "apps-local-state": [{"id": application_id,
+                                           "key-value": encode_state(_stored_local_state(app, state))}]}
+                    for address, state in page
+                ],
+            }
+        if limit and len(page) == limit:
+            response["next-token"] = next_token
+        return response
+
+
+class AsyncLocalAlgod:
+    """
+    Async stand-in wrapping a LocalAlgod, for offline use and tests
+    Every call yields to the event loop for latency seconds, like a network round trip would.
+    max_in_flight is the most calls that were awaiting their response at once
+    """
+
+    def __init__(self, local_algod=None, latency=0.0):
+        self.local_algod = local_algod or LocalAlgod()
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _call(self, method, *args):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return getattr(self.local_algod, method)(*args)
+
+    async def status(self):
+        return await self._call("status")
+
+    async def status_after_block(self, block_num):
+        return await self._call("status_after_block", block_num)
+
+    async def suggested_params(self):
+        return await self._call("suggested_params")
+
+    async def compile(self, source):
+        return await self._call("compile", source)
+
+    async def disassemble(self, program):
+        return await self._call("disassemble", program)
+
+    async def send_transactions(self, txns):
+        return await self._call("send_transactions", txns)
+
+    async def pending_transaction_info(self, transaction_id):
+        return await self._call("pending_transaction_info", transaction_id)
+
+    async def account_info(self, address):
+        return await self._call("account_info", address)
+
+    async def application_info(self, application_id):
+        return await self._call("application_info", application_id)
@@ -0,0 +1,134 @@
+"""
+Serve a local_algod.LocalAlgod over algod's v2 REST API
+
+LocalAlgodServer answers the HTTP requests of the algod endpoints the tooling uses, so real HTTP
+clients (algosdk's AlgodClient, async_helper.AsyncAlgodClient) can be exercised offline. It serves
+on a background thread and keeps connections alive between requests as algod does.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import msgpack
+from algosdk import transaction
+from algosdk.error import AlgodHTTPError
+
+from local_algod import LocalAlgod
+
+
+def _suggested_params(local_algod):
+    params = local_algod.suggested_params()
+    return {
+        "consensus-version": "local",
+        "fee": params.fee,
+        "genesis-hash": params.gh,
+        "genesis-id": params.gen,
+        "last-round": params.first,
+        "min-fee": params.min_fee,
+    }
+
+
+def _send_transactions(local_algod, body):
+    # the body is the concatenated msgpack encodings of the signed transactions
+    unpacker = msgpack.Unpacker(raw=False, strict_map_key=False)
+    unpacker.feed(body)
+    return {"txId": local_algod.send_transactions([transaction.SignedTransaction.undictify(txn) for txn in unpacker])}
+
+
+_get_routes = {
+    "status": lambda local_algod: local_algod.status(),
+    "transactions/params": _suggested_params,
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        local_algod = self.server.local_algod
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not path.startswith("/v2/"):
+            return self._respond(404, {"message": "not found"})
+        route = path[len("/v2/"):]
+        parts = route.split("/")
+        try:
+            if method == "GET" and route in _get_routes:
+                result = _get_routes[route](local_algod)
+            elif method == "GET" and parts[:2] == ["status", "wait-for-block-after"] and len(parts) == 3:
+                result = local_algod.status_after_block(int(parts[2]))
+            elif method == "GET" and parts[:2] == ["transactions", "pending"] and len(parts) == 3:
+                result = local_algod.pending_transaction_info(parts[2])
+            elif method == "GET" and parts[0] == "accounts" and len(parts) == 2:
+                result = local_algod.account_info(parts[1])
+            elif method == "GET" and parts[0] == "applications" and len(parts) == 2:
+                result = local_algod.application_info(int(parts[1]))
+            elif method == "POST" and route == "teal/compile":
+                result = local_algod.compile(body.decode("utf-8"))
+            elif method == "POST" and route == "teal/disassemble":
+                result = local_algod.disassemble(body)
+            elif method == "POST" and route == "transactions":
+                result = _send_transactions(local_algod, body)
+            else:
+                return self._respond(404, {"message": f"unknown endpoint {method} {path}"})
+        except AlgodHTTPError as e:
+            return self._respond(e.code or 500, {"message": str(e)})
+        except ConnectionError as e:
+            return self._respond(503, {"message": str(e)})
+        except ValueError as e:
+            return self._respond(400, {"message": str(e)})
+        self._respond(200, result)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class LocalAlgodServer:
+    """
+    HTTP server in front of a LocalAlgod on 127.0.0.1, listening on a free port unless one is given
+    Use it as a context manager, or call start() and stop(); address is the URL to give clients
+    """
+
+    def __init__(self, local_algod=None, port=0):
+        self.local_algod = local_algod or LocalAlgod()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.local_algod = self.local_algod
+        self.thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,1337 @@
+# Offline tests for the tooling around the election contract, run against local stand-ins instead of the network
+
+import asyncio
+import base64
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from pyteal import compileTeal, Mode
+
+from algosdk import account, transaction
+from algosdk.encoding import decode_address, encode_address
+from algosdk.error import AlgodHTTPError
+
+import async_helper
+from approvers import add_approver, read_approvers, remove_approver, send_approvals
+import instrumentation
+from algod_router import AlgodRouter
+from election_smart_contract import approval_program, clear_state_program
+from deploy import create_sharded_election, create_vote_app
+from export_roll import AccountVoterSource, IndexerVoterSource, export_tallies, export_voter_roll, \
+    read_columnar
+from election_model import CallRejected, apply_call, create_election, election_result, shard_index
+from election_params import max_approvers, max_vote_options
+from helper import format_state, read_election_result, read_global_state, read_local_state, \
+    sign_transaction, wait_for_confirmation, wait_for_round
+from ledger_store import SqliteLedgerStore, decode_local_state, encode_local_state
+from ledger_replay import LedgerReplay, LocalTransactionSource, generate_election_transactions
+from local_algod import AsyncLocalAlgod, LocalAlgod, LocalIndexer, LocalLedger, encode_state
+from local_algod_server import LocalAlgodServer
+from preflight import Preflight
+from roster_ingest import ingest_roster, read_roll_statuses, validate_addresses
+from sharded_election import read_shard_app_ids, read_sharded_global_state, read_sharded_local_state
+from tally_analytics import load_tallies, summarize
+from teal_eval import AppCall, evaluate
+from teal_optimizer import branch_changes, check_optimized, compare_programs, optimize, optimize_programs, \
+    program_size, regressions, remove_dead_branches
+from state_cache import StateCache
+from state_format import encode_key
+from simple_tests import call_app, call_app_approve_voter, close_out_app, delete_app, opt_in_app
+
+
+def _format_raw(state):
+    # format a teal_eval state, keyed by raw bytes, as helper.format_state formats an algod one
+    return format_state(encode_state(state))
+
+
+class TestLedgerReplay(unittest.TestCase):
+    """ TESTS FOR HISTORICAL STATE REPLAY """
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.TemporaryDirectory()
+        self.source = LocalTransactionSource(generate_election_transactions(7, 70, txns_per_round=10))
+        self.last_round = self.source.rounds[-1]
+
+    def tearDown(self):
+        self.checkpoint_dir.cleanup()
+
+    def test_01_final_tally(self):
+        """ replaying the whole history yields the expected tallies """
+
+        state = LedgerReplay(self.source, 7, self.checkpoint_dir.name).state_at(self.last_round)
+        # 60 approved voters spread over 4 options, 6 of whom closed out again
+        self.assertEqual(54, sum(state["global"][f"VotesFor{i}"] for i in range(4)))
+        self.assertEqual(64, len(state["local"]))
+
+    def test_02_checkpoints_match_full_replay(self):
+        """ queries served from checkpoints agree with replays from the start """
+
+        checkpointed = LedgerReplay(self.source, 7, self.checkpoint_dir.name, checkpoint_interval=5)
+        checkpointed.build_checkpoints(self.last_round)
+        self.assertEqual(list(range(5, self.last_round + 1, 5)), checkpointed.checkpoint_rounds())
+
+        for round in range(1, self.last_round + 1):
+            full = LedgerReplay(self.source, 7, self.checkpoint_dir.name + "/full", checkpoint_interval=10 ** 9)
+            expected = full.state_at(round)
+            actual = checkpointed.state_at(round)
+            self.assertEqual(expected["global"], actual["global"], f"global state differs at round {round}")
+            self.assertEqual(expected["local"], actual["local"], f"local state differs at round {round}")
+
+    def test_03_no_checkpoint_past_source_tip(self):
+        """ rounds the source has not fully recorded yet are never checkpointed """
+
+        source = LocalTransactionSource(round=0)
+        replay = LedgerReplay(source, 7, self.checkpoint_dir.name, checkpoint_interval=5)
+        tip = 12
+        for txn in self.source.transactions:
+            if txn["confirmed-round"] <= tip:
+                source.append(txn)
+        source.advance(tip)
+        replay.state_at(self.last_round)
+        self.assertEqual([5, 10], replay.checkpoint_rounds())
+
+        for txn in self.source.transactions:
+            if txn["confirmed-round"] > tip:
+                source.append(txn)
+        source.advance(self.last_round)
+        expected = LedgerReplay(self.source, 7, self.checkpoint_dir.name + "/full").state_at(self.last_round)
+        self.assertEqual(expected["local"], replay.state_at(self.last_round)["local"])
+
+    def test_04_clear_needs_opt_in(self):
+        """ clearing the state of an app the sender never opted in to is rejected """
+
+        creator, address = account.generate_account()[1], account.generate_account()[1]
+        with self.assertRaises(CallRejected):
+            apply_call(create_election(100, 2, "A,B"), {}, creator, address, 2, "clear", [])
+
+    def test_05_confirmed_calls_are_not_rechecked(self):
+        """ calls the chain confirmed are applied even where the model would reject them """
+
+        transactions = generate_election_transactions(7, 2)
+        opt_ins = [txn for txn in transactions if txn["application-transaction"]["on-completion"] == "optin"]
+        first, second = [txn["sender"] for txn in opt_ins]
+        # the history starts after the second voter's opt-in and the creator sent a non-UTF-8 status
+        transactions = [txn for txn in transactions if txn is not opt_ins[1]]
+        for txn in transactions:
+            args = txn["application-transaction"]["application-args"]
+            if args[:1] == [base64.b64encode(b"update_user_status").decode()] and \
+                    args[1] == base64.b64encode(decode_address(first)).decode():
+                args[2] = base64.b64encode(b"\xff").decode()
+        source = LocalTransactionSource(transactions)
+        state = LedgerReplay(source, 7, self.checkpoint_dir.name).state_at(source.rounds[-1])
+        self.assertEqual({first: {"can_vote": b"\xff", "voted": 0}, second: {"can_vote": "yes", "voted": 1}},
+                         state["local"])
+
+
+class TestAlgodRouter(unittest.TestCase):
+    """ TESTS FOR ROUTING ACROSS SEVERAL LOCAL ALGOD STAND-INS """
+
+    def setUp(self):
+        self.ledger = LocalLedger(round=100)
+        self.nodes = [LocalAlgod(self.ledger), LocalAlgod(self.ledger), LocalAlgod(self.ledger, lag=10)]
+        self.router = AlgodRouter(self.nodes, max_round_lag=2)
+        self.creator_private_key, self.creator_address = account.generate_account()
+
+    def test_01_lagging_node_is_unhealthy(self):
+        """ the node more than max_round_lag rounds behind is excluded """
+
+        self.router.check_health()
+        self.assertEqual([True, True, False], [endpoint.healthy for endpoint in self.router.endpoints])
+
+    def test_02_reads_are_spread(self):
+        """ reads go round-robin over the healthy nodes only """
+
+        app_id = create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        calls_before = [node.calls for node in self.nodes]
+        for _ in range(10):
+            read_global_state(self.router, app_id)
+        calls = [node.calls - before for node, before in zip(self.nodes, calls_before)]
+        self.assertEqual([5, 5, 0], calls)
+
+    def test_03_submissions_are_pinned(self):
+        """ a submission and its confirmation polling stay on one node """
+
+        app_id = create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        write_node = self.router.write_endpoint.client
+        self.assertEqual(1, len(self.router.pinned))
+        tx_id = next(iter(self.router.pinned))
+        self.assertIs(write_node, self.router.pinned[tx_id].client)
+        self.assertEqual({}, self.router.unconfirmed)
+        self.assertEqual("A,B", read_global_state(self.router, app_id)["VoteOptions"])
+
+    def test_04_failover(self):
+        """ reads and submissions move off a node that goes down """
+
+        app_id = create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        self.router.write_endpoint.client.down = True
+        self.assertEqual(2, read_global_state(self.router, app_id)["NumVoteOptions"])
+        create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        self.assertFalse(self.router.write_endpoint.client.down)
+        self.assertEqual({}, read_local_state(self.router, self.creator_address, app_id))
+
+    def test_05_abandoned_submission_expires(self):
+        """ a submission that is never polled stops pinning status to the write node """
+
+        app_id = create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        params = self.router.suggested_params()
+        txn = transaction.ApplicationOptInTxn(self.creator_address, params, app_id)
+        self.router.send_transactions([txn.sign(self.creator_private_key)])
+        write_node = self.router.write_endpoint.client
+        calls_before = write_node.calls
+        for _ in range(4):
+            self.router.status()
+        self.assertEqual(4, write_node.calls - calls_before)
+
+        self.router.max_pin_seconds = 0
+        calls_before = [node.calls for node in self.nodes]
+        for _ in range(4):
+            self.router.status()
+        self.assertEqual([2, 2, 0], [node.calls - before for node, before in zip(self.nodes, calls_before)])
+        self.assertEqual({}, self.router.unconfirmed)
+
+    def test_06_polling_fails_over(self):
+        """ confirmation polling moves off a pinned node that goes down and marks it unhealthy """
+
+        app_id = create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        params = self.router.suggested_params()
+        txn = transaction.ApplicationOptInTxn(self.creator_address, params, app_id)
+        tx_id = self.router.send_transactions([txn.sign(self.creator_private_key)])
+        write_endpoint = self.router.write_endpoint
+        write_endpoint.client.down = True
+        self.assertTrue(wait_for_confirmation(self.router, tx_id)["confirmed-round"])
+        self.assertFalse(write_endpoint.healthy)
+        self.assertNotIn(tx_id, self.router.pinned)
+
+    def test_07_unknown_methods_go_to_the_write_node(self):
+        """ only the listed reads are spread, compile and unknown methods stay on the write node """
+
+        create_vote_app(self.router, self.creator_private_key, 10000, 2, "A,B")
+        write_node = self.router.write_endpoint.client
+        calls_before = [node.calls for node in self.nodes]
+        for _ in range(4):
+            self.router.compile("#pragma version 5\nint 1")
+        self.assertEqual([4 if node is write_node else 0 for node in self.nodes],
+                         [node.calls - before for node, before in zip(self.nodes, calls_before)])
+        # a method the router does not know, only the write node has it here
+        write_node.simulate_transactions = lambda request: {"simulated": request}
+        self.assertEqual({"simulated": 1}, self.router.simulate_transactions(1))
+
+
+class TestPreflight(unittest.TestCase):
+    """ TESTS FOR REJECTING DOOMED CALLS BEFORE SUBMISSION """
+
+    def setUp(self):
+        self.client = LocalAlgod()
+        self.keys = [account.generate_account() for _ in range(3)]
+        creator_private_key = self.keys[0][0]
+        self.app_id = create_vote_app(self.client, creator_private_key, 10000, 2, "A,B")
+        for private_key, address in self.keys:
+            opt_in_app(self.client, private_key, self.app_id)
+        call_app_approve_voter(self.client, self.app_id, creator_private_key, self.keys[1][1], b"yes")
+        self.preflight = Preflight.from_client(self.client, self.app_id, [address for _, address in self.keys])
+
+    def test_01_reasons(self):
+        """ each doomed call is reported with the rule it breaks """
+
+        creator, voter, unapproved = [address for _, address in self.keys]
+        self.assertIsNone(self.preflight.check(voter, [b"vote", (1).to_bytes(8, "big")]))
+        self.assertEqual("vote choice out of range", self.preflight.check(voter, [b"vote", (2).to_bytes(8, "big")]))
+        self.assertEqual("sender is not approved to vote", self.preflight.check(unapproved, [b"vote", bytes(8)]))
+        self.assertEqual("user status was already updated",
+                         self.preflight.check(creator, [b"update_user_status", decode_address(voter), b"no"]))
+        self.assertEqual("sender is not the creator or an approver",
+                         self.preflight.check(voter, [b"update_user_status", decode_address(unapproved), b"yes"]))
+
+    def test_02_rejected_before_sending(self):
+        """ a second vote is rejected locally, without reaching the node """
+
+        voter_private_key = self.keys[1][0]
+        call_app(self.client, voter_private_key, self.app_id, [b"vote", bytes(8)], preflight=self.preflight)
+        calls_before = self.client.calls
+        with self.assertRaises(CallRejected):
+            call_app(self.client, voter_private_key, self.app_id, [b"vote", bytes(8)], preflight=self.preflight)
+        self.assertEqual(calls_before, self.client.calls)
+
+    def test_03_batch(self):
+        """ calls in a batch see the effect of the calls before them """
+
+        creator, voter, unapproved = [address for _, address in self.keys]
+        vote = [b"vote", bytes(8)]
+        calls = [
+            (voter, "noop", vote),
+            (voter, "noop", vote),
+            (unapproved, "noop", vote),
+            (creator, "noop", [b"update_user_status", decode_address(unapproved), b"yes"]),
+            (unapproved, "noop", vote),
+        ] * 1000
+        reasons = self.preflight.check_batch(calls)
+        self.assertEqual([None, "sender has already voted", "sender is not approved to vote", None, None],
+                         reasons[:5])
+        self.assertEqual(3, reasons.count(None))
+        # the mirror itself is left untouched
+        self.assertNotIn("voted", self.preflight.local_states[voter])
+
+    def test_04_unmirrored_accounts(self):
+        """ accounts missing from the mirror are read on demand, or left unchecked without a client """
+
+        creator, voter, unapproved = [address for _, address in self.keys]
+        preflight = Preflight.from_client(self.client, self.app_id)
+        call_app(self.client, self.keys[1][0], self.app_id, [b"vote", bytes(8)], preflight=preflight)
+        self.assertEqual({"can_vote": "yes", "voted": 0}, preflight.local_states[voter])
+        _, stranger = account.generate_account()
+        self.assertEqual("sender is not opted in", preflight.check(stranger, on_complete="closeout"))
+        self.assertIn(stranger, preflight.absent)
+
+        offline = Preflight(self.app_id, creator, read_global_state(self.client, self.app_id))
+        self.assertIsNone(offline.check(voter, [b"vote", bytes(8)]))
+        self.assertEqual([None, None], offline.check_batch([(voter, "noop", [b"vote", bytes(8)])] * 2))
+
+    def test_05_record_confirmed(self):
+        """ a confirmed call is applied as is and advances the mirrored round """
+
+        creator, voter, unapproved = [address for _, address in self.keys]
+        stale = Preflight.from_client(self.client, self.app_id, [voter, unapproved])
+        call_app_approve_voter(self.client, self.app_id, self.keys[0][0], unapproved, b"yes")
+        call_app(self.client, self.keys[2][0], self.app_id, [b"vote", (1).to_bytes(8, "big")])
+        round = self.client.status()["last-round"]
+        # the mirror still has the voter at maybe, but the node approved the vote
+        stale.record(unapproved, [b"vote", (1).to_bytes(8, "big")], round=round)
+        self.assertEqual(1, stale.local_states[unapproved]["voted"])
+        self.assertEqual(1, stale.global_state["VotesFor1"])
+        self.assertEqual(round, stale.round)
+
+
+class TestCompactStatus(unittest.TestCase):
+    """ TESTS FOR THE COMPACT VOTER STATUS LAYOUT """
+
+    def test_01_decode(self):
+        """ compact status uints decode to the default layout's entries """
+
+        self.assertEqual({"can_vote": "maybe"}, format_state(encode_state({"status": 1})))
+        self.assertEqual({"can_vote": "no"}, format_state(encode_state({"status": 3})))
+        self.assertEqual({"can_vote": "yes", "voted": 0}, format_state(encode_state({"status": 2 + (1 << 2)})))
+        self.assertEqual({"can_vote": "yes", "voted": 3}, format_state(encode_state({"status": 2 + (4 << 2)})))
+
+    def test_02_teal_matches_model(self):
+        """ the vote, closeout, clear and status update paths of both layouts agree with the model """
+
+        creator = account.generate_account()[1]
+        a, b, c, d, e = [account.generate_account()[1] for _ in range(5)]
+
+        def status(user, decision, round=50):
+            return creator, "noop", [b"update_user_status", decode_address(user), decision], [user], round
+
+        def vote(voter, choice, round=50):
+            return voter, "noop", [b"vote", choice.to_bytes(8, "big")], [], round
+
+        calls = [(voter, "optin", [], [], 50) for voter in (a, b, c, d, e)] + [
+            status(a, b"yes"), status(b, b"no"), status(c, b"nope"), status(a, b"no"),
+            vote(a, 1), vote(a, 0), vote(b, 0), vote(c, 0),
+            status(d, b"yes"), vote(d, 3), vote(d, 0),
+            (a, "closeout", [], [], 50), (d, "clear", [], [], 50),
+            status(e, b"yes", round=150), vote(e, 0, round=150), (b, "closeout", [], [], 150),
+        ]
+        for compact_status in (False, True):
+            approval = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+            clear = compileTeal(clear_state_program(compact_status), mode=Mode.Application, version=5)
+            global_state, local_states = create_election(100, 3, "A,B,C"), {}
+            raw_global = {encode_key(key): value.encode() if isinstance(value, str) else value
+                          for key, value in global_state.items()}
+            raw_local = {}
+            for sender, on_complete, app_args, accounts, round in calls:
+                call = AppCall(sender, on_complete, app_args, accounts=accounts, creator=creator, round=round)
+                program = clear if on_complete == "clear" else approval
+                approved, _, raw_global, raw_local = evaluate(program, call, raw_global, raw_local)
+                try:
+                    apply_call(global_state, local_states, creator, sender, round, on_complete, app_args,
+                               compact_status)
+                    model_approved = True
+                except CallRejected:
+                    model_approved = False
+                step = (compact_status, on_complete, app_args, round)
+                if on_complete != "clear":
+                    self.assertEqual(model_approved, bool(approved), step)
+                self.assertEqual(global_state, _format_raw(raw_global), step)
+                self.assertEqual(local_states, {address: _format_raw(state) for address, state in raw_local.items()},
+                                 step)
+            # the compact layout only holds yes or no, so the status update to "nope" was rejected
+            self.assertEqual("maybe" if compact_status else "nope", local_states[c]["can_vote"])
+
+    def test_03_local_algod(self):
+        """ the local stand-in and the preflight mirror follow the layout of a compact app """
+
+        client = LocalAlgod()
+        creator_private_key = account.generate_account()[0]
+        voter_private_key, voter = account.generate_account()
+        app_id = create_vote_app(client, creator_private_key, 10000, 2, "A,B", compact_status=True)
+        opt_in_app(client, voter_private_key, app_id)
+        preflight = Preflight.from_client(client, app_id, [voter])
+        self.assertTrue(preflight.compact_status)
+        with self.assertRaises(CallRejected):
+            call_app_approve_voter(client, app_id, creator_private_key, voter, b"nope", preflight=preflight)
+        with self.assertRaises(AlgodHTTPError):
+            call_app_approve_voter(client, app_id, creator_private_key, voter, b"nope")
+        call_app_approve_voter(client, app_id, creator_private_key, voter, b"no", preflight=preflight)
+        self.assertEqual({"can_vote": "no"}, read_local_state(client, voter, app_id))
+        self.assertEqual({"can_vote": "no"}, preflight.local_states[voter])
+        local_state = client.account_info(voter)["apps-local-state"][0]["key-value"]
+        self.assertEqual([base64.b64encode(b"status").decode("ascii")], [item["key"] for item in local_state])
+
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            replayed = LedgerReplay(client.ledger.history, app_id, checkpoint_dir).state_at(client.ledger.round)
+        self.assertTrue(replayed["compact_status"])
+        self.assertEqual({voter: {"can_vote": "no"}}, replayed["local"])
+
+
+class TestShardedElection(unittest.TestCase):
+    """ TESTS FOR ELECTIONS SPLIT OVER SEVERAL TALLY SHARDS """
+
+    def setUp(self):
+        self.client = LocalAlgod()
+        self.creator_private_key, _ = account.generate_account()
+        self.coordinator_id, self.shard_app_ids = create_sharded_election(
+            self.client, self.creator_private_key, 10000, 3, "A,B,C", num_shards=3
+        )
+        self.voters = [account.generate_account() for _ in range(9)]
+
+    def test_01_voting_across_shards(self):
+        """ voters land in their own shard and the tallies add up across shards """
+
+        self.assertEqual(self.shard_app_ids, read_shard_app_ids(self.client, self.coordinator_id))
+        for i, (private_key, address) in enumerate(self.voters):
+            opt_in_app(self.client, private_key, self.shard_app_ids)
+            call_app_approve_voter(self.client, self.shard_app_ids, self.creator_private_key, address, b"yes")
+            call_app(self.client, private_key, self.shard_app_ids, [b"vote", (i % 3).to_bytes(8, "big")])
+            self.assertEqual(i % 3, read_sharded_local_state(self.client, address, self.shard_app_ids)["voted"])
+
+        global_state = read_sharded_global_state(self.client, self.coordinator_id)
+        self.assertEqual("A,B,C", global_state["VoteOptions"])
+        self.assertEqual([3, 3, 3], [global_state[f"VotesFor{i}"] for i in range(3)])
+
+    def test_02_wrong_shard_rejected(self):
+        """ a voter cannot opt in to a shard they do not belong to """
+
+        private_key, address = self.voters[0]
+        wrong_shard = self.shard_app_ids[(shard_index(address, 3) + 1) % 3]
+        self.assertRaises(Exception, opt_in_app, self.client, private_key, wrong_shard)
+
+
+class TestAsyncHelper(unittest.TestCase):
+    """ TESTS FOR THE ASYNCIO HELPERS AGAINST THE LOCAL STAND-INS """
+
+    def setUp(self):
+        self.client = AsyncLocalAlgod(latency=0.01)
+        self.creator_private_key, _ = account.generate_account()
+        self.voters = [account.generate_account() for _ in range(20)]
+
+    async def run_election(self):
+        app_id = await async_helper.create_vote_app(self.client, self.creator_private_key, 10000, 2, "A,B")
+        await asyncio.gather(*(async_helper.opt_in_app(self.client, private_key, app_id)
+                               for private_key, _ in self.voters))
+        await asyncio.gather(*(async_helper.call_app_approve_voter(self.client, app_id, self.creator_private_key,
+                                                                   address, b"yes")
+                               for _, address in self.voters))
+        await asyncio.gather(*(async_helper.call_app(self.client, private_key, app_id, [b"vote", bytes(8)])
+                               for private_key, _ in self.voters))
+        return app_id
+
+    def test_01_concurrent_voting(self):
+        """ voters opt in, get approved and vote concurrently """
+
+        async def run():
+            app_id = await self.run_election()
+            addresses = [address for _, address in self.voters]
+            self.client.max_in_flight = 0
+            local_states = await async_helper.read_local_states(self.client, addresses, app_id, concurrency=10)
+            # 20 reads, 10 at a time
+            self.assertEqual(10, self.client.max_in_flight)
+            self.assertEqual({"can_vote": "yes", "voted": 0}, local_states[addresses[0]])
+            global_state = await async_helper.read_global_state(self.client, app_id)
+            self.assertEqual(20, global_state["VotesFor0"])
+
+        asyncio.run(run())
+
+    def test_02_cancellation(self):
+        """ cancelling a bulk read cancels the reads still pending """
+
+        async def run():
+            app_id = await self.run_election()
+            addresses = [address for _, address in self.voters] * 50
+            task = asyncio.create_task(async_helper.read_local_states(self.client, addresses, app_id, concurrency=5))
+            await asyncio.sleep(0.05)
+            calls_at_cancel = self.client.local_algod.calls
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            await asyncio.sleep(0.05)
+            self.assertLessEqual(self.client.local_algod.calls, calls_at_cancel + 5)
+
+        asyncio.run(run())
+
+    def test_03_http_client(self):
+        """ the HTTP client runs an election against the local algod server """
+
+        async def run(address):
+            async with async_helper.AsyncAlgodClient("token", address, max_idle=4) as client:
+                app_id = await async_helper.create_vote_app(client, self.creator_private_key, 10000, 2, "A,B",
+                                                            compact_status=True)
+                await asyncio.gather(*(async_helper.opt_in_app(client, private_key, app_id)
+                                       for private_key, _ in self.voters))
+                await asyncio.gather(*(async_helper.call_app_approve_voter(client, app_id, self.creator_private_key,
+                                                                           address, b"yes")
+                                       for _, address in self.voters))
+                await asyncio.gather(*(async_helper.call_app(client, private_key, app_id, [b"vote", bytes(8)])
+                                       for private_key, _ in self.voters))
+                with self.assertRaises(AlgodHTTPError) as raised:
+                    await async_helper.call_app(client, self.voters[0][0], app_id, [b"vote", bytes(8)])
+                self.assertEqual(400, raised.exception.code)
+                program = await async_helper.compile_program(client, "#pragma version 5\nint 1\n")
+                self.assertEqual("#pragma version 5\nint 1\n", (await client.disassemble(program))["result"])
+                addresses = [address for _, address in self.voters]
+                local_states = await async_helper.read_local_states(client, addresses, app_id, concurrency=10)
+                self.assertLessEqual(len(client.idle), 4)
+                return app_id, local_states, await async_helper.read_global_state(client, app_id)
+
+        with LocalAlgodServer() as server:
+            app_id, local_states, global_state = asyncio.run(run(server.address))
+            self.assertEqual({"can_vote": "yes", "voted": 0}, local_states[self.voters[0][1]])
+            self.assertEqual(20, global_state["VotesFor0"])
+            # the ledger is compact, as the schema asked for
+            self.assertTrue(server.local_algod.ledger.apps[app_id]["compact_status"])
+
+
+class TestInstrumentation(unittest.TestCase):
+    """ TESTS FOR LATENCY AND THROUGHPUT INSTRUMENTATION """
+
+    def setUp(self):
+        instrumentation.metrics.reset()
+        instrumentation.enable()
+        self.client = instrumentation.instrument(LocalAlgod())
+        self.creator_private_key, _ = account.generate_account()
+
+    def tearDown(self):
+        instrumentation.disable()
+        instrumentation.metrics.reset()
+
+    def test_01_records_operations(self):
+        """ algod calls, signing, confirmation waits and decoding are recorded """
+
+        app_id = create_vote_app(self.client, self.creator_private_key, 10000, 2, "A,B")
+        opt_in_app(self.client, self.creator_private_key, app_id)
+        self.assertRaises(Exception, call_app, self.client, self.creator_private_key, app_id, [b"vote", bytes(8)])
+        read_global_state(self.client, app_id)
+
+        snapshot = instrumentation.metrics.snapshot()
+        self.assertEqual({"sent": 2, "confirmed": 2, "failed": 1, "rounds_waited": 2}, snapshot["counters"])
+        for operation in ("suggested_params", "sign", "send_transactions", "status_after_block",
+                          "confirmation", "format_state", "application_info"):
+            self.assertIn(operation, snapshot["latency_seconds"])
+        self.assertEqual(3, snapshot["latency_seconds"]["send_transactions"]["count"])
+        prometheus = instrumentation.metrics.to_prometheus()
+        self.assertIn('election_operation_seconds_count{operation="sign"} 3', prometheus)
+        self.assertIn("election_sent_total 2", prometheus)
+
+    def test_02_disabled(self):
+        """ nothing is recorded while disabled """
+
+        instrumentation.disable()
+        create_vote_app(self.client, self.creator_private_key, 10000, 2, "A,B")
+        self.assertEqual({}, instrumentation.metrics.snapshot()["latency_seconds"])
+
+    def test_03_signing_left_alone(self):
+        """ only signing through the helpers is timed, algosdk itself is not patched """
+
+        self.assertEqual("algosdk.transaction", transaction.Transaction.sign.__module__)
+        params = self.client.suggested_params()
+        txn = transaction.ApplicationOptInTxn(account.generate_account()[1], params, 1)
+        txn.sign(self.creator_private_key)
+        self.assertNotIn("sign", instrumentation.metrics.snapshot()["latency_seconds"])
+        sign_transaction(txn, self.creator_private_key)
+        self.assertEqual(1, instrumentation.metrics.snapshot()["latency_seconds"]["sign"]["count"])
+
+    def test_04_async_client(self):
+        """ the async helpers are recorded through the same wrapper """
+
+        client = instrumentation.instrument(AsyncLocalAlgod())
+        voter_private_key, _ = account.generate_account()
+
+        async def run():
+            app_id = await async_helper.create_vote_app(client, self.creator_private_key, 10000, 2, "A,B")
+            await async_helper.opt_in_app(client, voter_private_key, app_id)
+            return await async_helper.read_global_state(client, app_id)
+
+        self.assertEqual("A,B", asyncio.run(run())["VoteOptions"])
+        snapshot = instrumentation.metrics.snapshot()
+        self.assertEqual({"sent": 2, "confirmed": 2, "failed": 0, "rounds_waited": 2}, snapshot["counters"])
+        for operation in ("suggested_params", "sign", "send_transactions", "confirmation"):
+            self.assertEqual(2, snapshot["latency_seconds"][operation]["count"])
+        self.assertEqual(1, snapshot["latency_seconds"]["format_state"]["count"])
+
+
+class TestExportRoll(unittest.TestCase):
+    """ TESTS FOR THE STREAMING TALLY AND VOTER ROLL EXPORT """
+
+    def setUp(self):
+        self.out_dir = tempfile.TemporaryDirectory()
+        self.client = LocalAlgod()
+        creator_private_key, _ = account.generate_account()
+        self.app_id = create_vote_app(self.client, creator_private_key, 10000, 3, "A,B,C")
+        self.addresses = []
+        for i in range(25):
+            private_key, address = account.generate_account()
+            opt_in_app(self.client, private_key, self.app_id)
+            if i % 5:
+                call_app_approve_voter(self.client, self.app_id, creator_private_key, address,
+                                       b"no" if i % 5 == 4 else b"yes")
+                if i % 5 != 4:
+                    call_app(self.client, private_key, self.app_id, [b"vote", (i % 3).to_bytes(8, "big")])
+            self.addresses.append(address)
+
+    def tearDown(self):
+        self.out_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.out_dir.name, name)
+
+    def test_01_roll(self):
+        """ the paged roll matches the local states in both formats """
+
+        source = IndexerVoterSource(LocalIndexer(self.client.ledger), self.app_id, page_size=7)
+        self.assertEqual(25, export_voter_roll(source, self.path("roll.csv"), self.path("roll.ecol")))
+
+        with open(self.path("roll.csv"), newline="") as f:
+            rows = list(csv.DictReader(f))
+        chunks = list(read_columnar(self.path("roll.ecol")))
+        self.assertEqual([7, 7, 7, 4], [len(chunk["address"]) for chunk in chunks])
+        columns = {name: [value for chunk in chunks for value in chunk[name]] for name in chunks[0]}
+        self.assertEqual(self.addresses, [row["address"] for row in rows])
+        self.assertEqual(self.addresses, columns["address"])
+        for i, address in enumerate(self.addresses):
+            state = read_local_state(self.client, address, self.app_id)
+            self.assertEqual(state["can_vote"], rows[i]["can_vote"])
+            self.assertEqual(state["can_vote"], columns["can_vote"][i])
+            self.assertEqual(str(state.get("voted", "")), rows[i]["voted"])
+            self.assertEqual(state.get("voted", -1), columns["voted"][i])
+
+    def test_02_account_source(self):
+        """ reading a known address list skips accounts that are not opted in """
+
+        _, stranger = account.generate_account()
+        source = AccountVoterSource(self.client, self.app_id, self.addresses + [stranger], page_size=10)
+        self.assertEqual(25, export_voter_roll(source, columnar_path=self.path("roll.ecol")))
+        self.assertEqual(self.addresses, [address for chunk in read_columnar(self.path("roll.ecol"))
+                                          for address in chunk["address"]])
+
+    def test_03_tallies(self):
+        """ tallies are joined with the option names """
+
+        export_tallies(read_global_state(self.client, self.app_id), self.path("t.csv"), self.path("t.ecol"))
+        with open(self.path("t.csv"), newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual([["index", "option", "votes"], ["0", "A", "5"], ["1", "B", "5"], ["2", "C", "5"]], rows)
+        self.assertEqual([{"index": [0, 1, 2], "option": ["A", "B", "C"], "votes": [5, 5, 5]}],
+                         list(read_columnar(self.path("t.ecol"))))
+
+    def test_04_unlabelled_status(self):
+        """ a can_vote value without a label is exported as other, keeping the value itself """
+
+        creator_private_key, _ = account.generate_account()
+        app_id = create_vote_app(self.client, creator_private_key, 10000, 2, "A,B")
+        voters = [account.generate_account() for _ in range(3)]
+        for (private_key, address), status in zip(voters, (b"yes", b"approved", None)):
+            opt_in_app(self.client, private_key, app_id)
+            if status:
+                call_app_approve_voter(self.client, app_id, creator_private_key, address, status)
+        source = AccountVoterSource(self.client, app_id, [address for _, address in voters])
+        self.assertEqual(3, export_voter_roll(source, self.path("roll.csv"), self.path("roll.ecol")))
+        chunk, = read_columnar(self.path("roll.ecol"))
+        self.assertEqual(["yes", "other", "maybe"], chunk["can_vote"])
+        self.assertEqual(["", "approved", ""], chunk["can_vote_other"])
+        with open(self.path("roll.csv"), newline="") as f:
+            self.assertEqual(["yes", "approved", "maybe"], [row["can_vote"] for row in csv.DictReader(f)])
+
+
+class TestTealOptimizer(unittest.TestCase):
+    """ TESTS FOR THE TEAL PEEPHOLE OPTIMIZER """
+
+    def test_01_equivalent_and_cheaper(self):
+        """ optimized programs behave like the originals, no branch gets larger or more expensive """
+
+        for compact_status in (False, True):
+            approval = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+            clear = compileTeal(clear_state_program(compact_status), mode=Mode.Application, version=5)
+            optimized_approval, optimized_clear = optimize_programs(approval, clear, steps=800)
+            mismatches, costs = compare_programs(approval, optimized_approval, clear, optimized_clear, steps=800)
+            self.assertEqual([], mismatches)
+            self.assertLess(program_size(optimized_approval), program_size(approval))
+            self.assertLess(program_size(optimized_clear), program_size(clear))
+            changes = branch_changes(approval, optimized_approval, clear, optimized_clear, costs)
+            for branch, (before, after, before_cost, after_cost) in changes.items():
+                self.assertLessEqual(after, before, branch)
+                if before_cost is not None:
+                    self.assertLessEqual(after_cost, before_cost, branch)
+            if not compact_status:
+                self.assertLess(sum(costs["vote"][1]), sum(costs["vote"][0]))
+
+        # optimizing without the per-branch check grows create, whose constants it pushes inline
+        approval = compileTeal(approval_program(False), mode=Mode.Application, version=5)
+        clear = compileTeal(clear_state_program(False), mode=Mode.Application, version=5)
+        optimized_approval = optimize(approval)
+        _, costs = compare_programs(approval, optimized_approval, clear, clear, steps=100)
+        self.assertIn("create", regressions(branch_changes(approval, optimized_approval, clear, clear, costs)))
+
+    def test_02_dead_branches(self):
+        """ constant conditions are folded and duplicate blocks merged """
+
+        teal = "\n".join([
+            "#pragma version 5", "int 1", "bnz l1", "err", "l1:", "txn NumAppArgs", "bnz l2", "b l3",
+            "l2:", "int 1", "return", "l3:", "int 1", "return",
+        ])
+        self.assertEqual("\n".join([
+            "#pragma version 5", "txn NumAppArgs", "bnz l2", "l2:", "int 1", "return", "",
+        ]), remove_dead_branches(teal))
+
+    def test_03_deploy_optimized(self):
+        """ create_vote_app deploys the optimized programs, programs that behave differently are refused """
+
+        client = CompilingAlgod()
+        app_id = create_vote_app(client, account.generate_account()[0], 100, 2, b"A,B", optimize=True)
+        self.assertEqual(2, read_global_state(client, app_id)["NumVoteOptions"])
+        approval = compileTeal(approval_program(False), mode=Mode.Application, version=5)
+        clear = compileTeal(clear_state_program(False), mode=Mode.Application, version=5)
+        # the originals are assembled too, to deploy whichever the assembler makes smaller
+        self.assertEqual([approval, clear, *optimize_programs(approval, clear)], client.sources)
+
+        # an approval program that approves everything is caught by the differential check
+        with self.assertRaises(ValueError):
+            check_optimized(approval, "#pragma version 5\nint 1\nreturn", clear, clear, steps=50)
+
+        # and so is a node whose assembler output does not behave like the optimized source
+        client.disassemble = lambda program_bytes: {"result": "#pragma version 5\nint 1\nreturn"}
+        apps = len(client.ledger.apps)
+        with self.assertRaises(ValueError):
+            create_vote_app(client, account.generate_account()[0], 100, 2, b"A,B", optimize=True)
+        self.assertEqual(apps, len(client.ledger.apps))
+
+
+class CompilingAlgod(LocalAlgod):
+    """ LOCAL ALGOD THAT RECORDS THE SOURCES IT COMPILES """
+
+    def __init__(self):
+        super().__init__()
+        self.sources = []
+
+    def compile(self, source, source_map=False, **kwargs):
+        self.sources.append(source)
+        return super().compile(source, source_map, **kwargs)
+
+
+class TestFinalize(unittest.TestCase):
+    """ TESTS FOR THE ON-CHAIN FINALIZATION SNAPSHOT """
+
+    def setUp(self):
+        self.client = LocalAlgod()
+        self.creator_private_key, _ = account.generate_account()
+        self.election_end = self.client.status()["last-round"] + 40
+        self.app_id = create_vote_app(self.client, self.creator_private_key, self.election_end, 3, "A,B,C")
+        for choice in (2, 1, 2):
+            private_key, address = account.generate_account()
+            opt_in_app(self.client, private_key, self.app_id)
+            call_app_approve_voter(self.client, self.app_id, self.creator_private_key, address, b"yes")
+            call_app(self.client, private_key, self.app_id, [b"vote", choice.to_bytes(8, "big")])
+
+    def test_01_finalize_once_after_end(self):
+        """ finalize is rejected before the end and the second time, readers use the snapshot """
+
+        before = read_election_result(self.client, self.app_id)
+        self.assertEqual({"finalized": False, "total_votes": 3, "winner": 2, "winner_option": "C"},
+                         {key: value for key, value in before.items() if key != "tally_hash"})
+        self.assertRaises(Exception, call_app, self.client, self.creator_private_key, self.app_id, [b"finalize"])
+
+        wait_for_round(self.client, self.election_end)
+        call_app(self.client, self.creator_private_key, self.app_id, [b"finalize"])
+        after = read_election_result(self.client, self.app_id)
+        self.assertEqual(dict(before, finalized=True), after)
+        self.assertEqual(after["tally_hash"], read_global_state(self.client, self.app_id)["TallyHash"])
+        self.assertRaises(Exception, call_app, self.client, self.creator_private_key, self.app_id, [b"finalize"])
+
+    def test_02_teal_matches_model(self):
+        """ the finalize branch of the approval program writes what the model computes """
+
+        global_state = {"ElectionEnd": 10, "NumVoteOptions": 4, "VoteOptions": "A,B,C,D",
+                        "VotesFor0": 5, "VotesFor1": 9, "VotesFor2": 9, "VotesFor3": 1}
+        teal = compileTeal(approval_program(), mode=Mode.Application, version=5)
+        _, address = account.generate_account()
+        raw_state = {key.encode(): value.encode() if isinstance(value, str) else value
+                     for key, value in global_state.items()}
+        approved, _, raw_state, _ = evaluate(teal, AppCall(address, "noop", [b"finalize"], round=10), raw_state, {})
+        self.assertTrue(approved)
+        result = election_result(global_state)
+        self.assertEqual(1, result["winner"])
+        self.assertEqual((result["total_votes"], result["winner"], result["tally_hash"]),
+                         (raw_state[b"TotalVotes"], raw_state[b"Winner"], raw_state[b"TallyHash"]))
+
+    def test_03_vote_option_limit(self):
+        """ finalize fits the opcode budget at max_vote_options, more options are rejected at creation """
+
+        _, address = account.generate_account()
+        for compact_status in (False, True):
+            teal = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+            for num_vote_options in (max_vote_options + 1, max_vote_options):
+                args = [(10).to_bytes(8, "big"), num_vote_options.to_bytes(8, "big"), b"A"]
+                approved, _, raw_state, _ = evaluate(teal, AppCall(address, "create", args, round=1), {}, {})
+                self.assertEqual(num_vote_options == max_vote_options, approved)
+            # every tally a new leader is the costliest finalize
+            raw_state.update({f"VotesFor{i}".encode(): i + 1 for i in range(max_vote_options)})
+            approved, cost, _, _ = evaluate(teal, AppCall(address, "noop", [b"finalize"], round=10), raw_state, {})
+            self.assertTrue(approved)
+            self.assertLessEqual(cost, 700)
+
+        with self.assertRaises(AlgodHTTPError):
+            create_vote_app(self.client, self.creator_private_key, self.election_end, max_vote_options + 1, "A")
+
+
+class TestLedgerStore(unittest.TestCase):
+    """ TESTS FOR THE DISK-BACKED LEDGER STORE """
+
+    def setUp(self):
+        self.store_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.store_dir.name, "ledger.sqlite")
+
+    def tearDown(self):
+        self.store_dir.cleanup()
+
+    def run_election(self, client, creator_private_key, voters):
+        app_id = create_vote_app(client, creator_private_key, 10000, 3, "A,B,C")
+        for i, (private_key, address) in enumerate(voters):
+            opt_in_app(client, private_key, app_id)
+            call_app_approve_voter(client, app_id, creator_private_key, address, b"no" if i % 4 == 3 else b"yes")
+            if i % 4 != 3:
+                call_app(client, private_key, app_id, [b"vote", (i % 3).to_bytes(8, "big")])
+            if i % 5 == 4:
+                close_out_app(client, private_key, app_id)
+        return app_id
+
+    def test_01_same_state_as_memory(self):
+        """ an election on the store ends in the same state as in memory """
+
+        creator_private_key, _ = account.generate_account()
+        voters = [account.generate_account() for _ in range(12)]
+        memory = LocalAlgod()
+        store = SqliteLedgerStore(self.path)
+        stored = LocalAlgod(LocalLedger(store=store, keep_history=False))
+        app_id = self.run_election(memory, creator_private_key, voters)
+        self.assertEqual(app_id, self.run_election(stored, creator_private_key, voters))
+
+        self.assertEqual(read_global_state(memory, app_id), read_global_state(stored, app_id))
+        for _, address in voters:
+            self.assertEqual(read_local_state(memory, address, app_id), read_local_state(stored, address, app_id))
+        self.assertEqual(len(memory.ledger.apps[app_id]["local"]), len(stored.ledger.apps[app_id]["local"]))
+        source = IndexerVoterSource(LocalIndexer(stored.ledger), app_id, page_size=4)
+        self.assertEqual(sorted(memory.ledger.apps[app_id]["local"]),
+                         [address for page in source.pages() for address, _ in page])
+        store.close()
+
+    def test_02_reopen(self):
+        """ reopening the store file restores the apps and the round """
+
+        creator_private_key, _ = account.generate_account()
+        ledger = LocalLedger(store=SqliteLedgerStore(self.path))
+        app_id = self.run_election(LocalAlgod(ledger), creator_private_key, [account.generate_account()])
+        ledger.produce_block()
+        global_state = dict(ledger.apps[app_id]["global"])
+        local_states = dict(ledger.apps[app_id]["local"].items())
+        ledger.store.close()
+
+        reopened = LocalLedger(store=SqliteLedgerStore(self.path))
+        self.assertEqual(ledger.round, reopened.round)
+        self.assertEqual(global_state, dict(reopened.apps[app_id]["global"]))
+        self.assertEqual(local_states, dict(reopened.apps[app_id]["local"].items()))
+        reopened.store.close()
+
+    def test_03_record_layout(self):
+        """ states outside the compact layout survive the round trip """
+
+        for state in ({}, {"can_vote": "maybe"}, {"can_vote": "yes", "voted": 7}, {"can_vote": "yess"},
+                      {"can_vote": "no", "note": b"\xff"}):
+            self.assertEqual(state, decode_local_state(*encode_local_state(state)))
+        self.assertEqual((2 | 8 << 2, None), encode_local_state({"can_vote": "yes", "voted": 7}))
+
+    def test_04_rejected_group_never_flushed(self):
+        """ a group that is rolled back never reaches the file, even when max_pending is reached """
+
+        store = SqliteLedgerStore(self.path, max_pending=1)
+        ledger = LocalLedger(store=store)
+        creator, voter = account.generate_account()[1], account.generate_account()[1]
+        app_id = ledger.next_app_id
+        ledger.apply("create", creator, 0, "noop", [(10000).to_bytes(8, "big"), (2).to_bytes(8, "big"), b"A,B"])
+        ledger.produce_block()
+        # what the file holds after every flush, as a crash right after it would leave it
+        reader = sqlite3.connect(self.path)
+        on_disk = []
+        flush = store.flush
+
+        def recording_flush(*args):
+            flush(*args)
+            on_disk.append(reader.execute("SELECT address FROM local_state").fetchall())
+
+        store.flush = recording_flush
+        with self.assertRaises(AlgodHTTPError):
+            ledger.apply_group([("optin", voter, app_id, "optin"),
+                                ("vote", voter, app_id, "noop", [b"vote", bytes(8)])])
+        self.assertNotIn([(voter,)], on_disk)
+        # a group that is applied is flushed as before
+        ledger.apply_group([("optin", voter, app_id, "optin")])
+        self.assertEqual([(voter,)], on_disk[-1])
+        store.close()
+        reader.close()
+
+
+class FailingAlgod(LocalAlgod):
+    """ LOCAL ALGOD THAT CRASHES AFTER A NUMBER OF SUBMISSIONS """
+
+    def __init__(self, ledger, submissions):
+        super().__init__(ledger)
+        self.submissions = submissions
+
+    def send_transactions(self, txns, **kwargs):
+        if not self.submissions:
+            raise ConnectionError("node crashed")
+        self.submissions -= 1
+        return super().send_transactions(txns, **kwargs)
+
+
+class TestRosterIngest(unittest.TestCase):
+    """ TESTS FOR THE STREAMING ROSTER INGESTION """
+
+    def setUp(self):
+        self.out_dir = tempfile.TemporaryDirectory()
+        self.client = LocalAlgod()
+        self.creator_private_key, _ = account.generate_account()
+        self.app_id = create_vote_app(self.client, self.creator_private_key, 10000, 3, "A,B,C")
+        self.addresses = []
+        for _ in range(20):
+            private_key, address = account.generate_account()
+            opt_in_app(self.client, private_key, self.app_id)
+            self.addresses.append(address)
+
+    def tearDown(self):
+        self.out_dir.cleanup()
+
+    def statuses(self):
+        return read_roll_statuses(IndexerVoterSource(LocalIndexer(self.client.ledger), self.app_id))
+
+    def test_01_validate(self):
+        """ bulk validation agrees with decode_address """
+
+        address = self.addresses[0]
+        addresses = [address, address[:9] + ("A" if address[9] != "A" else "B") + address[10:], address.lower(),
+                     "é" + address[1:], address[:-1], "1" + address[1:], ""]
+        self.assertEqual([decode_address(address)] + [None] * 6, validate_addresses(addresses))
+
+    def test_02_csv(self):
+        """ only the calls that change a status are sent """
+
+        call_app_approve_voter(self.client, self.app_id, self.creator_private_key, self.addresses[0], b"no")
+        outsider = account.generate_account()[1]
+        rows = [["address", "status"], [self.addresses[0], "yes"], [self.addresses[1], "YES"],
+                [self.addresses[2], "no"], [self.addresses[1], "yes"], [self.addresses[2], "yes"],
+                ["NOTANADDRESS", "yes"], [self.addresses[3], "maybe"], [outsider, "yes"], [self.addresses[4], ""]]
+        path = os.path.join(self.out_dir.name, "roster.csv")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows(rows)
+
+        report = ingest_roster(self.client, self.app_id, self.creator_private_key, path, self.statuses(),
+                               group_size=2)
+        self.assertEqual({"rows": 9, "invalid": 2, "duplicates": 2, "unchanged": 0, "skipped": 2,
+                          "approved": 2, "rejected": 1, "failed": 0},
+                         {key: report[key] for key in report if key != "errors"})
+        self.assertEqual([1, 5, 6, 7, 8], [row for row, _, _ in report["errors"]])
+        for address, status in zip(self.addresses[:5], ["no", "yes", "no", "maybe", "yes"]):
+            self.assertEqual(status, read_local_state(self.client, address, self.app_id)["can_vote"])
+
+        report = ingest_roster(self.client, self.app_id, self.creator_private_key, path, self.statuses())
+        self.assertEqual((0, 0, 3), (report["approved"], report["rejected"], report["unchanged"]))
+
+    def test_03_resume(self):
+        """ a crashed ingestion resumes from its checkpoint """
+
+        path = os.path.join(self.out_dir.name, "roster.jsonl")
+        with open(path, "w") as f:
+            for i, address in enumerate(self.addresses):
+                f.write(json.dumps({"address": address, "status": "no" if i % 3 == 0 else "yes"}) + "\n")
+        checkpoint_path = os.path.join(self.out_dir.name, "roster.checkpoint")
+
+        crashing = FailingAlgod(self.client.ledger, 2)
+        with self.assertRaises(ConnectionError):
+            ingest_roster(crashing, self.app_id, self.creator_private_key, path, self.statuses(),
+                          checkpoint_path=checkpoint_path, group_size=4, max_workers=2, batch_size=6)
+        with open(checkpoint_path) as f:
+            self.assertEqual(8, json.load(f)["row"])
+
+        report = ingest_roster(self.client, self.app_id, self.creator_private_key, path, self.statuses(),
+                               checkpoint_path=checkpoint_path, group_size=4)
+        self.assertEqual((20, 13, 7), (report["rows"], report["approved"], report["rejected"]))
+        for i, address in enumerate(self.addresses):
+            self.assertEqual("no" if i % 3 == 0 else "yes",
+                             read_local_state(self.client, address, self.app_id)["can_vote"])
+
+    def test_04_rejected_rows(self):
+        """ the rows of a rejected group are resent one by one, the ones still rejected are reported """
+
+        statuses = self.statuses()
+        # approved by someone else after the statuses were read
+        call_app_approve_voter(self.client, self.app_id, self.creator_private_key, self.addresses[1], b"no")
+        path = os.path.join(self.out_dir.name, "roster.csv")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows([address, "yes"] for address in self.addresses[:6])
+
+        report = ingest_roster(self.client, self.app_id, self.creator_private_key, path, statuses, group_size=4)
+        self.assertEqual((6, 5, 1), (report["rows"], report["approved"], report["failed"]))
+        [(row, address, reason)] = report["errors"]
+        self.assertEqual((2, self.addresses[1]), (row, address))
+        self.assertIn("user status was already updated", reason)
+        self.assertEqual(["yes", "no", "yes", "yes", "yes", "yes"],
+                         [read_local_state(self.client, address, self.app_id)["can_vote"]
+                          for address in self.addresses[:6]])
+
+    def test_05_duplicates_across_batches(self):
+        """ duplicates are caught within a batch, and by the updated statuses across batches """
+
+        path = os.path.join(self.out_dir.name, "roster.csv")
+        with open(path, "w", newline="") as f:
+            csv.writer(f).writerows([[self.addresses[0], "yes"], [self.addresses[0], "no"], [self.addresses[1], "no"],
+                                     [self.addresses[0], "yes"], [self.addresses[1], "yes"]])
+
+        for dry_run in (True, False):
+            statuses = self.statuses()
+            report = ingest_roster(self.client, self.app_id, self.creator_private_key, path, statuses,
+                                   group_size=1, batch_size=3, dry_run=dry_run)
+            self.assertEqual((1, 1, 1, 1), (report["duplicates"], report["approved"], report["rejected"],
+                                            report["unchanged"]))
+            self.assertEqual([(2, "conflicts with an earlier yes"), (5, "status was already set to no")],
+                             [(row, reason) for row, _, reason in report["errors"]])
+            # a dry run leaves the caller's statuses as they were
+            self.assertEqual("maybe" if dry_run else "no", statuses[self.addresses[1]])
+        self.assertEqual(["yes", "no"], [read_local_state(self.client, address, self.app_id)["can_vote"]
+                                         for address in self.addresses[:2]])
+
+
+class RacingAlgod(LocalAlgod):
+    """ LOCAL ALGOD THAT RUNS A CALLBACK WHILE AN ACCOUNT_INFO RESPONSE IS IN FLIGHT """
+
+    def __init__(self, ledger):
+        super().__init__(ledger)
+        self.in_flight = None
+
+    def account_info(self, address, **kwargs):
+        response = super().account_info(address, **kwargs)
+        in_flight, self.in_flight = self.in_flight, None
+        if in_flight is not None:
+            in_flight()
+        return response
+
+
+class TestStateCache(unittest.TestCase):
+    """ TESTS FOR THE CONFIRMATION DELTA STATE CACHE """
+
+    def setUp(self):
+        self.client = LocalAlgod()
+        self.cache = StateCache(self.client, reconcile_rounds=1000)
+        self.creator_private_key, _ = account.generate_account()
+        self.voters = [account.generate_account() for _ in range(4)]
+        self.app_id = create_vote_app(self.cache, self.creator_private_key, 60, 3, "A,B,C")
+
+    def assert_cached(self):
+        self.assertEqual(read_global_state(self.client, self.app_id), self.cache.read_global_state(self.app_id))
+        for _, address in self.voters:
+            self.assertEqual(read_local_state(self.client, address, self.app_id),
+                             self.cache.read_local_state(address, self.app_id))
+
+    def test_01_read_your_writes(self):
+        """ reads after each call are served from the deltas """
+
+        self.assert_cached()
+        for i, (private_key, address) in enumerate(self.voters):
+            opt_in_app(self.cache, private_key, self.app_id)
+            self.assert_cached()
+            call_app_approve_voter(self.cache, self.app_id, self.creator_private_key, address,
+                                   b"no" if i == 3 else b"yes")
+            self.assert_cached()
+            if i != 3:
+                call_app(self.cache, private_key, self.app_id, [b"vote", (i % 2).to_bytes(8, "big")])
+                self.assert_cached()
+        close_out_app(self.cache, self.voters[0][0], self.app_id)
+        self.assert_cached()
+        wait_for_round(self.cache, 60)
+        call_app(self.cache, self.creator_private_key, self.app_id, [b"finalize"])
+        self.assert_cached()
+        self.assertIsInstance(self.cache.read_global_state(self.app_id)["TallyHash"], bytes)
+        # the creation delta seeded the global state, only the first local state reads went to the node
+        self.assertEqual(len(self.voters), self.cache.fetches)
+
+    def test_02_reconcile(self):
+        """ changes made by other clients are picked up by reconciliation """
+
+        private_key, address = self.voters[0]
+        opt_in_app(self.cache, private_key, self.app_id)
+        call_app_approve_voter(self.cache, self.app_id, self.creator_private_key, address, b"yes")
+        self.assertEqual({"can_vote": "yes"}, self.cache.read_local_state(address, self.app_id))
+        self.cache.read_global_state(self.app_id)
+
+        call_app(self.client, private_key, self.app_id, [b"vote", (2).to_bytes(8, "big")])
+        self.assertEqual({"can_vote": "yes"}, self.cache.read_local_state(address, self.app_id))
+        self.assertEqual(2, self.cache.reconcile())
+        self.assert_cached()
+
+        # once reconcile_rounds have confirmed since a state was fetched, it is fetched again
+        self.cache.reconcile_rounds = 1
+        private_key, address = self.voters[1]
+        opt_in_app(self.cache, private_key, self.app_id)
+        call_app_approve_voter(self.cache, self.app_id, self.creator_private_key, address, b"yes")
+        call_app(self.client, private_key, self.app_id, [b"vote", (0).to_bytes(8, "big")])
+        opt_in_app(self.cache, self.voters[2][0], self.app_id)
+        self.assertEqual(1, self.cache.read_global_state(self.app_id)["VotesFor0"])
+
+    def test_03_groups(self):
+        """ confirming one call of a group applies the whole group, node responses are served from the cache """
+
+        app_id = create_vote_app(self.cache, self.creator_private_key, 60, 3, "A,B,C", compact_status=True)
+        for private_key, address in self.voters:
+            self.cache.read_local_state(address, app_id)
+            opt_in_app(self.cache, private_key, app_id)
+        fetches = self.cache.fetches
+        send_approvals(self.cache, app_id, [self.creator_private_key],
+                       [(address, "yes") for _, address in self.voters], group_size=4)
+        for _, address in self.voters:
+            self.assertEqual({"can_vote": "yes"}, self.cache.read_local_state(address, app_id))
+            self.assertEqual(read_local_state(self.client, address, app_id),
+                             read_local_state(self.cache, address, app_id))
+        self.assertEqual(read_global_state(self.client, app_id), read_global_state(self.cache, app_id))
+        self.assertEqual(self.client.application_info(app_id)["params"]["creator"],
+                         self.cache.application_info(app_id)["params"]["creator"])
+        # only application_info needed the node's response for the app created through the cache
+        self.assertEqual(fetches + 1, self.cache.fetches)
+
+    def test_04_read_only(self):
+        """ a cache that only reads follows the node's round """
+
+        polling = StateCache(self.client, reconcile_rounds=2, status_interval=0)
+        idle = StateCache(self.client, reconcile_rounds=2, status_interval=3600)
+        for cache in (polling, idle):
+            self.assertEqual(0, cache.read_global_state(self.app_id)["VotesFor0"])
+        private_key, address = self.voters[0]
+        opt_in_app(self.client, private_key, self.app_id)
+        call_app_approve_voter(self.client, self.app_id, self.creator_private_key, address, b"yes")
+        call_app(self.client, private_key, self.app_id, [b"vote", (0).to_bytes(8, "big")])
+        self.assertEqual(1, polling.read_global_state(self.app_id)["VotesFor0"])
+        self.assertEqual(0, idle.read_global_state(self.app_id)["VotesFor0"])
+
+    def test_05_fetch_overtaken(self):
+        """ a fetch does not overwrite a delta applied while it was in flight """
+
+        client = RacingAlgod(self.client.ledger)
+        cache = StateCache(client, reconcile_rounds=1000)
+        private_key, address = self.voters[0]
+        opt_in_app(cache, private_key, self.app_id)
+        call_app_approve_voter(cache, self.app_id, self.creator_private_key, address, b"yes")
+        self.assertEqual({"can_vote": "yes"}, cache.read_local_state(address, self.app_id))
+
+        client.in_flight = lambda: call_app(cache, private_key, self.app_id, [b"vote", (1).to_bytes(8, "big")])
+        cache.reconcile()
+        self.assertEqual(read_local_state(self.client, address, self.app_id),
+                         cache.read_local_state(address, self.app_id))
+        self.assertEqual(1, cache.read_global_state(self.app_id)["VotesFor1"])
+
+class TestApprovers(unittest.TestCase):
+    """ TESTS FOR THE DELEGATED APPROVER REGISTRY """
+
+    def setUp(self):
+        self.client = LocalAlgod()
+        self.creator_private_key, self.creator = account.generate_account()
+        self.app_id = create_vote_app(self.client, self.creator_private_key, 10000, 3, "A,B,C")
+        self.approvers = [account.generate_account() for _ in range(3)]
+        for _, address in self.approvers:
+            add_approver(self.client, self.creator_private_key, self.app_id, address)
+
+    def opted_in_voters(self, count):
+        voters = [account.generate_account() for _ in range(count)]
+        for private_key, _ in voters:
+            opt_in_app(self.client, private_key, self.app_id)
+        return voters
+
+    def test_01_registry(self):
+        """ only registered approvers may approve, the creator manages up to max_approvers of them """
+
+        self.assertEqual(sorted(address for _, address in self.approvers), read_approvers(self.client, self.app_id))
+        self.assertEqual(3, read_global_state(self.client, self.app_id)["NumApprovers"])
+        (voter_key, voter), (_, other) = self.opted_in_voters(2)
+        send_approvals(self.client, self.app_id, [self.approvers[0][0]], [(voter, "yes")])
+        self.assertEqual("yes", read_local_state(self.client, voter, self.app_id)["can_vote"])
+
+        remove_approver(self.client, self.creator_private_key, self.app_id, self.approvers[0][1])
+        self.assertRaises(Exception, send_approvals, self.client, self.app_id, [self.approvers[0][0]], [(other, "yes")])
+        self.assertRaises(Exception, send_approvals, self.client, self.app_id, [voter_key], [(other, "yes")])
+        self.assertRaises(Exception, add_approver, self.client, self.approvers[1][0], self.app_id, voter)
+        self.assertRaises(Exception, add_approver, self.client, self.creator_private_key, self.app_id,
+                          self.approvers[1][1])
+        for _ in range(max_approvers - 2):
+            add_approver(self.client, self.creator_private_key, self.app_id, account.generate_account()[1])
+        self.assertRaises(Exception, add_approver, self.client, self.creator_private_key, self.app_id, voter)
+
+    def test_02_teal_matches_model(self):
+        """ the approver branches of the approval program agree with the model """
+
+        teal = compileTeal(approval_program(), mode=Mode.Application, version=5)
+        approver, other = self.approvers[0][1], self.approvers[1][1]
+        global_state = create_election(10000, 3, "A,B,C")
+        local_states = {other: {"can_vote": "maybe"}, approver: {"can_vote": "maybe"}}
+        calls = [
+            (self.creator, [b"add_approver", decode_address(approver)]),
+            (self.creator, [b"add_approver", decode_address(approver)]),
+            (approver, [b"add_approver", decode_address(other)]),
+            (approver, [b"update_user_status", decode_address(other), b"yes"]),
+            (other, [b"update_user_status", decode_address(approver), b"yes"]),
+            (self.creator, [b"remove_approver", decode_address(other)]),
+            (self.creator, [b"remove_approver", decode_address(approver)]),
+            (approver, [b"update_user_status", decode_address(approver), b"no"]),
+            (self.creator, [b"add_approver", b"short"]),
+        ]
+        for sender, app_args in calls:
+            raw_global = {encode_key(key): value.encode() if isinstance(value, str) else value
+                          for key, value in global_state.items()}
+            raw_local = {address: {key.encode(): value.encode() for key, value in state.items()}
+                         for address, state in local_states.items()}
+            accounts = [encode_address(app_args[1])] if app_args[0] == b"update_user_status" else []
+            call = AppCall(sender, "noop", app_args, accounts=accounts, creator=self.creator, round=5)
+            approved, _, raw_global, _ = evaluate(teal, call, raw_global, raw_local)
+            try:
+                apply_call(global_state, local_states, self.creator, sender, 5, "noop", app_args)
+                model_approved = True
+            except CallRejected:
+                model_approved = False
+            self.assertEqual(model_approved, bool(approved), app_args)
+            self.assertEqual({encode_key(key): value.encode() if isinstance(value, str) else value
+                              for key, value in global_state.items()}, raw_global, app_args)
+
+    def test_03_concurrent_approvals(self):
+        """ approvals are dealt out to every approver key and sent concurrently """
+
+        voters = self.opted_in_voters(40)
+        approvals = [(address, "no" if i % 5 == 0 else "yes") for i, (_, address) in enumerate(voters)]
+        private_keys = [self.creator_private_key] + [private_key for private_key, _ in self.approvers]
+        send_approvals(self.client, self.app_id, private_keys, approvals, group_size=4)
+        for address, status in approvals:
+            self.assertEqual(status, read_local_state(self.client, address, self.app_id)["can_vote"])
+        senders = [txn["sender"] for txn in self.client.ledger.history.search(self.app_id)
+                   if txn["application-transaction"]["application-args"][:1] == ["dXBkYXRlX3VzZXJfc3RhdHVz"]]
+        self.assertEqual({self.creator, *(address for _, address in self.approvers)}, set(senders))
+        self.assertEqual(40, len(senders))
+
+    def test_04_atomic_groups(self):
+        """ a rejected group changes nothing, isolate_failures resends its calls one by one """
+
+        voters = [address for _, address in self.opted_in_voters(4)]
+        call_app_approve_voter(self.client, self.app_id, self.creator_private_key, voters[2], b"no")
+        num_confirmed = len(list(self.client.ledger.history.search(self.app_id)))
+        approvals = [(address, "yes") for address in voters]
+        self.assertRaises(AlgodHTTPError, send_approvals, self.client, self.app_id, [self.creator_private_key],
+                          approvals)
+        self.assertEqual(["maybe", "maybe", "no", "maybe"],
+                         [read_local_state(self.client, address, self.app_id)["can_vote"] for address in voters])
+        self.assertEqual([], self.client.ledger.pending)
+        self.client.ledger.produce_block()
+        self.assertEqual(num_confirmed, len(list(self.client.ledger.history.search(self.app_id))))
+
+        rejected = send_approvals(self.client, self.app_id, [self.creator_private_key], approvals,
+                                  isolate_failures=True)
+        self.assertEqual([(voters[2], "yes")], [entry[:2] for entry in rejected])
+        self.assertIn("user status was already updated", rejected[0][2])
+        self.assertEqual(["yes", "yes", "no", "yes"],
+                         [read_local_state(self.client, address, self.app_id)["can_vote"] for address in voters])
+
+    def test_05_atomic_groups_with_store(self):
+        """ creations and deletions of a rejected group are undone in a store-backed ledger """
+
+        with tempfile.TemporaryDirectory() as out_dir:
+            store = SqliteLedgerStore(os.path.join(out_dir, "ledger.db"))
+            ledger = LocalLedger(store=store)
+            create_args = [(10000).to_bytes(8, "big"), (2).to_bytes(8, "big"), b"A,B"]
+            app_id = ledger.tx_info[ledger.apply("create", self.creator, 0, "noop", create_args)]["application-index"]
+            ledger.apply("optin", self.approvers[0][1], app_id, "optin")
+            ledger.produce_block()
+            bad_call = ("bad", self.creator, app_id, "noop", [b"vote", (0).to_bytes(8, "big")])
+            with self.assertRaises(AlgodHTTPError):
+                ledger.apply_group([("create-2", self.creator, 0, "noop", create_args), bad_call])
+            with self.assertRaises(AlgodHTTPError):
+                ledger.apply_group([("delete", self.creator, app_id, "delete"), bad_call])
+            self.assertEqual(([app_id], app_id + 1, []), (list(ledger.apps), ledger.next_app_id, ledger.pending))
+            ledger.produce_block()
+            store.close()
+
+            reopened = LocalLedger(store=SqliteLedgerStore(os.path.join(out_dir, "ledger.db")))
+            self.assertEqual([app_id], list(reopened.apps))
+            self.assertEqual({"can_vote": "maybe"}, reopened.apps[app_id]["local"][self.approvers[0][1]])
+            reopened.store.close()
+
+
+class TestTallyAnalytics(unittest.TestCase):
+    """ TESTS FOR THE VECTORIZED TALLY ANALYTICS """
+
+    def test_01_summary(self):
+        """ the vectorized statistics agree with the model's election result """
+
+        client = LocalAlgod()
+        creator_private_key, _ = account.generate_account()
+        elections = [("A,B,C", [3, 5, 5]), ("X,Y", [0, 0]), ("P,Q,R,S,T", [1, 0, 4, 2, 0]), ("Solo", [7])]
+        app_ids = []
+        for vote_options, votes in elections:
+            app_id = create_vote_app(client, creator_private_key, 10000, len(votes), vote_options)
+            client.ledger.apps[app_id]["global"].update({f"VotesFor{i}": count for i, count in enumerate(votes)})
+            app_ids.append(app_id)
+        deleted = create_vote_app(client, creator_private_key, 10000, 2, "D,E")
+        delete_app(client, creator_private_key, deleted)
+
+        tallies = load_tallies(client, app_ids[:2] + [deleted] + app_ids[2:], max_workers=3)
+        self.assertEqual(app_ids, tallies.app_ids.tolist())
+        self.assertEqual([deleted], list(tallies.failed))
+        self.assertEqual((4, 5), tallies.votes.shape)
+        self.assertEqual(["P", "Q", "R", "S", "T"], tallies.option_names(2))
+
+        summary = summarize(tallies)
+        for row, app_id in enumerate(app_ids):
+            result = election_result(read_global_state(client, app_id))
+            self.assertEqual(result["total_votes"], summary["totals"][row])
+            self.assertEqual(result["winner"], summary["winners"][row])
+        self.assertEqual([0, 0, 2, 7], summary["margins"].tolist())
+        self.assertEqual([0.0, 0.0, 2 / 7, 1.0], summary["margin_shares"].tolist())
+        self.assertEqual([3 / 13, 5 / 13, 5 / 13, 0, 0], summary["shares"][0].tolist())
+        self.assertEqual([0.0] * 5, summary["shares"][1].tolist())
+
+        # an unreachable node fails every app instead of aborting the load
+        client.down = True
+        tallies = load_tallies(client, app_ids, max_workers=3)
+        self.assertEqual((0, app_ids), (len(tallies), list(tallies.failed)))
+        self.assertIsInstance(tallies.failed[app_ids[0]], ConnectionError)
+
+    def test_02_errors(self):
+        """ a malformed tally fails its app, a programming error is raised """
+
+        client = LocalAlgod()
+        creator_private_key, _ = account.generate_account()
+        app_ids = [create_vote_app(client, creator_private_key, 10000, 2, "A,B") for _ in range(2)]
+        client.ledger.apps[app_ids[1]]["global"]["VotesFor1"] = b"many"
+        tallies = load_tallies(client, app_ids)
+        self.assertEqual(([app_ids[0]], [app_ids[1]]), (tallies.app_ids.tolist(), list(tallies.failed)))
+        self.assertIsInstance(tallies.failed[app_ids[1]], ValueError)
+
+        client.application_info = lambda app_id: None
+        self.assertRaises(TypeError, load_tallies, client, app_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
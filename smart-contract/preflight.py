@@ -0,0 +1,184 @@
+"""
+Preflight checks that reject doomed application calls before they are submitted
+
+A Preflight keeps a local mirror of one election app's global and local state and evaluates
+proposed calls against it with the rules of approval_program (see election_model), so a second
+vote, an unapproved voter or an out-of-range choice is reported without a network round trip.
+"""
+
+from collections.abc import MutableMapping
+
+from algosdk.encoding import encode_address
+
+from election_model import CallRejected, apply_call, apply_confirmed_call, check_call, is_compact_status_schema
+from helper import read_global_state, read_local_state
+
+_deleted = object()
+
+
+class _LocalOverlay(MutableMapping):
+    """Copy-on-write view over the mirrored local states, used to evaluate a batch without touching the mirror"""
+
+    def __init__(self, base):
+        self.base = base
+        self.changes = {}
+
+    def __getitem__(self, address):
+        value = self.changes.get(address, self.base.get(address, _deleted))
+        if value is _deleted:
+            raise KeyError(address)
+        return value
+
+    def __setitem__(self, address, value):
+        self.changes[address] = value
+
+    def __delitem__(self, address):
+        self[address]
+        self.changes[address] = _deleted
+
+    def __iter__(self):
+        for address in self.base:
+            if self.changes.get(address) is not _deleted:
+                yield address
+        for address, value in self.changes.items():
+            if address not in self.base and value is not _deleted:
+                yield address
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+def _involved_addresses(sender, on_complete, app_args):
+    # the accounts whose local state decides whether a call is approved
+    if on_complete == "noop" and len(app_args) >= 2 and app_args[0] == b"update_user_status" \
+            and len(app_args[1]) == 32:
+        return [sender, encode_address(app_args[1])]
+    return [sender]
+
+
+class Preflight:
+    """
+    Local mirror of one election app's state used to evaluate calls before sending them
+    local_states only needs the accounts involved in the calls being checked. The local state of
+    any other account is read from client on first use when the mirror has one (from_client and
+    refresh set it); without a client, calls involving such accounts are not checked and left to
+    the node. absent lists accounts known not to be opted in. compact_status is set for apps with the
+    compact voter status layout, which refresh detects from the app's local state schema.
+    """
+
+    def __init__(self, app_id, creator, global_state, local_states=None, round=0, client=None, absent=(),
+                 compact_status=False):
+        self.app_id = app_id
+        self.creator = creator
+        self.global_state = global_state
+        self.local_states = local_states if local_states is not None else {}
+        self.absent = set(absent)
+        self.round = round
+        self.client = client
+        self.compact_status = compact_status
+
+    @classmethod
+    def from_client(cls, client, app_id, addresses=()):
+        """Build the mirror from the node, reading the local state of each of the given addresses"""
+        preflight = cls(app_id, None, {})
+        preflight.refresh(client, addresses)
+        return preflight
+
+    def refresh(self, client, addresses=None):
+        """Reload global state and the local state of addresses (default: every mirrored account)"""
+        self.client = client
+        self.round = client.status()["last-round"]
+        params = client.application_info(self.app_id)["params"]
+        self.creator = params["creator"]
+        schema = params.get("local-state-schema", {})
+        self.compact_status = is_compact_status_schema(schema.get("num-uint", 0), schema.get("num-byte-slice", 0))
+        self.global_state = read_global_state(client, self.app_id)
+        self._read_local_states(list(self.local_states) + list(self.absent) if addresses is None else addresses)
+
+    def _read_local_states(self, addresses):
+        for address in addresses:
+            local_state = read_local_state(self.client, address, self.app_id)
+            # an opted-in voter always has can_vote, so an empty local state means not opted in
+            if local_state:
+                self.local_states[address] = local_state
+                self.absent.discard(address)
+            else:
+                self.local_states.pop(address, None)
+                self.absent.add(address)
+
+    def _known(self, addresses):
+        # read the accounts the mirror has not seen yet, return whether all of them are known now
+        unknown = [address for address in addresses if address not in self.local_states and address not in self.absent]
+        if unknown and self.client is not None:
+            self._read_local_states(unknown)
+            unknown = []
+        return not unknown
+
+    def advance(self, round):
+        """Move the mirrored round forward, e.g. to the node's last round"""
+        self.round = max(self.round, round)
+
+    def check(self, sender, app_args=(), on_complete="noop", round=None):
+        """
+        Return None if the call would be approved, otherwise the reason it would be rejected
+        The call is evaluated as if confirmed in round (default: the round after the mirrored one)
+        """
+        if round is None:
+            round = self.round + 1
+        app_args = list(app_args)
+        if not self._known(_involved_addresses(sender, on_complete, app_args)):
+            return None
+        return check_call(self.global_state, self.local_states, self.creator, sender, round, on_complete, app_args,
+                          self.compact_status)
+
+    def require(self, sender, app_args=(), on_complete="noop", round=None):
+        """Raise CallRejected if the call would be rejected"""
+        reason = self.check(sender, app_args, on_complete, round)
+        if reason is not None:
+            raise CallRejected(reason)
+
+    def record(self, sender, app_args=(), on_complete="noop", round=None):
+        """
+        Apply a call confirmed in round (default: the round after the mirrored one) to the mirror
+        The call is not checked again, and the mirror advances to round
+        """
+        if round is None:
+            round = self.round + 1
+        app_args = list(app_args)
+        apply_confirmed_call(self.global_state, self.local_states, self.creator, sender, round, on_complete, app_args)
+        for address in _involved_addresses(sender, on_complete, app_args):
+            if address in self.local_states:
+                self.absent.discard(address)
+            else:
+                self.absent.add(address)
+        self.advance(round)
+
+    def check_batch(self, calls, round=None):
+        """
+        Evaluate (sender, on_complete, app_args) calls in order as if submitted together
+        Each call sees the effect of the approved calls before it, e.g. a second vote from the
+        same sender is rejected. Return one reason (or None when approved) per call; a call
+        involving an account the mirror cannot read is not checked and has no effect on later calls.
+        """
+        if round is None:
+            round = self.round + 1
+        calls = [(sender, on_complete, list(app_args)) for sender, on_complete, app_args in calls]
+        addresses = {address for sender, on_complete, app_args in calls
+                     for address in _involved_addresses(sender, on_complete, app_args)}
+        self._known(addresses)
+        known = {address for address in addresses if address in self.local_states or address in self.absent}
+
+        global_state = dict(self.global_state)
+        local_states = _LocalOverlay(self.local_states)
+        reasons = []
+        for sender, on_complete, app_args in calls:
+            if not known.issuperset(_involved_addresses(sender, on_complete, app_args)):
+                reasons.append(None)
+                continue
+            try:
+                apply_call(global_state, local_states, self.creator, sender, round, on_complete, app_args,
+                           self.compact_status)
+                reasons.append(None)
+            except CallRejected as e:
+                reasons.append(e.reason)
+        return reasons
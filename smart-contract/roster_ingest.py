@@ -0,0 +1,303 @@
+"""
+Streaming ingestion of a voter roster into approval and rejection transactions
+
+A roster is a CSV file of address,status rows (a header row is optional and status defaults to yes)
+or a JSONL file of {"address": ..., "status": ...} objects. It is read in batches, so memory stays
+bounded by a batch on top of the statuses of the opted in voters. Each batch's addresses are checked in bulk:
+base32 decoded together (vectorized with NumPy when it is installed) and their checksums compared,
+optionally with batches spread across worker processes.
+
+Valid rows are deduplicated within their batch and the group still being filled, and diffed against
+the voters' current can_vote status, which is updated as calls confirm; only voters still at "maybe" get
+an update_user_status call. A duplicate of an earlier batch's row is therefore counted as unchanged, or
+skipped when it conflicts. Calls are sent as atomic groups of up to group_size transactions, from
+several approver keys at once when given. When the node rejects a group, e.g. because a voter's status
+changed since it was read, its calls are resent one at a time and the rows still rejected are reported
+as failed with the node's reason. With a checkpoint file the position in the roster is saved after
+every confirmed round of groups, so a crashed run resumes where it stopped.
+Run this file to ingest a roster from the command line.
+"""
+
+import argparse
+import base64
+import binascii
+import csv
+import hashlib
+import itertools
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from algosdk import constants
+
+from approvers import send_approvals
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+roster_statuses = ("yes", "no")
+report_counts = ("rows", "invalid", "duplicates", "unchanged", "skipped", "approved", "rejected", "failed")
+
+_b32_alphabet = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+# an address is 58 base32 characters, padded with zero characters to 64 they decode to 40 bytes
+_address_padding = "A" * 6
+_address_bytes = 40
+_checksum_hash = hashlib.new("sha512_256")
+
+
+def read_roster(path, default_status="yes"):
+    """
+    Yield (row, address, status) for every entry of a CSV or JSONL (.jsonl/.json) roster
+    row counts entries from 1; status is lowercased, and invalid statuses are left for the caller
+    """
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".json")):
+            entries = (json.loads(line) for line in f if line.strip())
+            rows = ((entry.get("address", ""), entry.get("status", default_status)) for entry in entries)
+        else:
+            reader = csv.reader(f)
+            first = next(reader, None)
+            if first is None:
+                return
+            header = [name.strip().lower() for name in first]
+            if header[:1] == ["address"]:
+                status_column = header.index("status") if "status" in header else None
+            else:
+                status_column = 1
+                reader = itertools.chain([first], reader)
+            rows = ((line[0] if line else "",
+                     line[status_column] if status_column is not None and len(line) > status_column
+                     and line[status_column].strip() else default_status)
+                    for line in reader)
+        for row, (address, status) in enumerate(rows, start=1):
+            yield row, address.strip(), str(status).strip().lower()
+
+
+def _decode_base32_numpy(addresses):
+    table = numpy.full(256, 255, dtype=numpy.uint8)
+    table[numpy.frombuffer(_b32_alphabet, dtype=numpy.uint8)] = numpy.arange(32, dtype=numpy.uint8)
+    # a non-ASCII character becomes "?", which is outside the alphabet like any other invalid one
+    chars = numpy.frombuffer("".join(addresses).encode("ascii", errors="replace"), dtype=numpy.uint8)
+    values = numpy.zeros((len(addresses), 64), dtype=numpy.uint64)
+    values[:, :constants.address_len] = table[chars].reshape(len(addresses), constants.address_len)
+    invalid = (values == 255).any(axis=1)
+    # every 8 characters hold 40 bits, which are split back into 5 bytes
+    groups = values.reshape(len(addresses), 8, 8)
+    bits = numpy.zeros((len(addresses), 8), dtype=numpy.uint64)
+    for i in range(8):
+        bits |= groups[:, :, i] << numpy.uint64(35 - 5 * i)
+    decoded = numpy.empty((len(addresses), 8, 5), dtype=numpy.uint8)
+    for i in range(5):
+        decoded[:, :, i] = (bits >> numpy.uint64(32 - 8 * i)) & numpy.uint64(0xff)
+    return decoded.tobytes(), invalid.tolist()
+
+
+def _decode_base32(addresses):
+    try:
+        decoded = base64.b32decode(_address_padding.join(addresses) + _address_padding)
+        return decoded, [False] * len(addresses)
+    except (binascii.Error, ValueError):
+        # an invalid character fails the whole batch, so find it address by address
+        parts, invalid = [], []
+        for address in addresses:
+            try:
+                parts.append(base64.b32decode(address + _address_padding))
+                invalid.append(False)
+            except (binascii.Error, ValueError):
+                parts.append(bytes(_address_bytes))
+                invalid.append(True)
+        return b"".join(parts), invalid
+
+
+def validate_addresses(addresses) -> list:
+    """
+    Return the 32-byte public key of every address, or None where decode_address would fail
+    """
+    public_keys = [None] * len(addresses)
+    indexes = [i for i, address in enumerate(addresses) if len(address) == constants.address_len]
+    if not indexes:
+        return public_keys
+    batch = [addresses[i] for i in indexes]
+    decoded, invalid = (_decode_base32_numpy if numpy is not None else _decode_base32)(batch)
+    for i, bad, offset in zip(indexes, invalid, range(0, len(decoded), _address_bytes)):
+        if bad:
+            continue
+        public_key = decoded[offset:offset + 32]
+        checksum = _checksum_hash.copy()
+        checksum.update(public_key)
+        if checksum.digest()[-constants.check_sum_len_bytes:] == decoded[offset + 32:offset + 36]:
+            public_keys[i] = public_key
+    return public_keys
+
+
+def validate_batches(rows, batch_size=10000, max_workers=None, prefetch=2):
+    """
+    Yield lists of (row, address, status, public key or None) for batches of batch_size roster rows
+    With max_workers, up to prefetch batches are validated ahead in worker processes
+    """
+    rows = iter(rows)
+    batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+    if max_workers is None:
+        for batch in batches:
+            yield [(*row, public_key) for row, public_key in
+                   zip(batch, validate_addresses([address for _, address, _ in batch]))]
+        return
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            while len(in_flight) < prefetch:
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                in_flight.append((batch, executor.submit(validate_addresses, [address for _, address, _ in batch])))
+            if not in_flight:
+                return
+            batch, future = in_flight.popleft()
+            yield [(*row, public_key) for row, public_key in zip(batch, future.result())]
+
+
+def read_roll_statuses(source) -> dict:
+    """
+    Return {address: can_vote} for the voters of an export_roll voter source
+    Voters that opted in but have no status yet map to "maybe"
+    """
+    return {address: state.get("can_vote", "maybe") for page in source.pages() for address, state in page}
+
+
+def _load_checkpoint(checkpoint_path, roster_path):
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["roster"] != os.path.abspath(roster_path):
+        raise ValueError(f"checkpoint {checkpoint_path} belongs to the roster {checkpoint['roster']}")
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_path, roster_path, row, counts):
+    # write to a temporary file first so a crash never leaves a truncated checkpoint behind
+    temporary_path = checkpoint_path + ".tmp"
+    with open(temporary_path, "w") as f:
+        json.dump({"roster": os.path.abspath(roster_path), "row": row, "counts": counts}, f)
+    os.replace(temporary_path, checkpoint_path)
+
+
+def ingest_roster(client, index, private_keys, roster_path, statuses, checkpoint_path=None,
+                  group_size=constants.tx_group_limit, batch_size=10000, max_workers=None, dry_run=False) -> dict:
+    """
+    Approve or reject the voters of a roster file, sending only the calls that change a status
+    index is the app id, or the list of shard app ids of a sharded election, and statuses maps each
+    opted in address to its current can_vote (see read_roll_statuses); it is updated as calls confirm.
+    private_keys is the creator's private key or a list of the creator's and approvers' keys, which
+    then send one group each at a time concurrently (see approvers.send_approvals).
+    With dry_run nothing is sent. Return the report: the report_counts and "errors", a list of
+    (row, address, reason) for rows that were not applied, including the calls the node rejected
+    ("failed"). Errors other than rejections, such as an unreachable node, are raised
+    """
+    if isinstance(private_keys, str):
+        private_keys = [private_keys]
+    checkpoint = _load_checkpoint(checkpoint_path, roster_path)
+    start_row = checkpoint["row"] if checkpoint else 0
+    counts = dict(checkpoint["counts"]) if checkpoint else dict.fromkeys(report_counts, 0)
+    # checkpoints saved before a count was added lack it
+    for key in report_counts:
+        counts.setdefault(key, 0)
+    errors = []
+    group = []
+    if dry_run:
+        # the diff still sees the rows of earlier batches, without touching the caller's statuses
+        statuses = dict(statuses)
+
+    def flush(last_row):
+        failed = {}
+        if group and not dry_run:
+            rejected = send_approvals(client, index, private_keys,
+                                      [(address, status) for _, address, status, _ in group], group_size,
+                                      isolate_failures=True)
+            failed = {address: reason for address, _, reason in rejected}
+        for row, address, status, _ in group:
+            if address in failed:
+                counts["failed"] += 1
+                errors.append((row, address, failed[address]))
+                continue
+            statuses[address] = status
+            counts["approved" if status == "yes" else "rejected"] += 1
+        group.clear()
+        if checkpoint_path is not None and not dry_run:
+            _save_checkpoint(checkpoint_path, roster_path, last_row, counts)
+
+    rows = (entry for entry in read_roster(roster_path) if entry[0] > start_row)
+    for batch in validate_batches(rows, batch_size, max_workers):
+        # public key -> status of this batch's rows and the ones still waiting in a group
+        seen = {public_key: status for _, _, status, public_key in group}
+        for row, address, status, public_key in batch:
+            counts["rows"] += 1
+            if public_key is None or status not in roster_statuses:
+                counts["invalid"] += 1
+                errors.append((row, address, "invalid address" if public_key is None else f"invalid status {status}"))
+                continue
+            if public_key in seen:
+                counts["duplicates"] += 1
+                if seen[public_key] != status:
+                    errors.append((row, address, f"conflicts with an earlier {seen[public_key]}"))
+                continue
+            seen[public_key] = status
+
+            current = statuses.get(address)
+            if current == status:
+                counts["unchanged"] += 1
+            elif current is None:
+                counts["skipped"] += 1
+                errors.append((row, address, "not opted in"))
+            elif current != "maybe":
+                counts["skipped"] += 1
+                errors.append((row, address, f"status was already set to {current}"))
+            else:
+                group.append((row, address, status, public_key))
+                if len(group) == group_size * len(private_keys):
+                    flush(row)
+        if not group and batch:
+            flush(batch[-1][0])
+    if group:
+        flush(group[-1][0])
+
+    counts["errors"] = errors
+    return counts
+
+
+def main():
+    from algosdk import account, mnemonic
+    from algosdk.v2client import algod, indexer
+    from approvers import read_approvers
+    from export_roll import IndexerVoterSource
+    from secrets import account_mnemonics, algod_token, algod_address, algod_headers
+
+    parser = argparse.ArgumentParser(description="Approve and reject the voters of a roster file")
+    parser.add_argument("app_id", type=int)
+    parser.add_argument("roster", help="CSV of address,status rows or JSONL of address/status objects")
+    parser.add_argument("--checkpoint", help="file to resume from and save progress to")
+    parser.add_argument("--indexer-address", default="https://testnet-algorand.api.purestake.io/idx2")
+    parser.add_argument("--workers", type=int, help="processes validating addresses")
+    parser.add_argument("--dry-run", action="store_true", help="report the calls without sending them")
+    args = parser.parse_args()
+
+    algod_client = algod.AlgodClient(algod_token, algod_address, algod_headers)
+    indexer_client = indexer.IndexerClient(algod_token, args.indexer_address, algod_headers)
+    statuses = read_roll_statuses(IndexerVoterSource(indexer_client, args.app_id))
+    # the creator, the first account, approves along with every other account registered as an approver
+    private_keys = [mnemonic.to_private_key(mn) for mn in account_mnemonics]
+    approvers = set(read_approvers(algod_client, args.app_id))
+    private_keys = private_keys[:1] + [private_key for private_key in private_keys[1:]
+                                       if account.address_from_private_key(private_key) in approvers]
+    report = ingest_roster(algod_client, args.app_id, private_keys, args.roster, statuses,
+                           checkpoint_path=args.checkpoint, max_workers=args.workers, dry_run=args.dry_run)
+    for row, address, reason in report.pop("errors"):
+        print(f"row {row} {address}: {reason}")
+    print(", ".join(f"{key} {value}" for key, value in report.items()))
+
+
+if __name__ == "__main__":
+    main()
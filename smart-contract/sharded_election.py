@@ -0,0 +1,62 @@
+"""
+Helpers for sharded elections
+
+A sharded election (deploy.create_sharded_election) spreads its voters over several tally shard
+apps by address hash. The coordinator app stores the shard app ids; these helpers find a voter's
+shard and aggregate the tallies of all shards with concurrent reads.
+
+Sharding splits the voters, not the vote options: a voter votes in their own shard, so every shard
+keeps a VotesFor{i} tally for every option. The number of options is therefore still bounded by
+the global state schema of a single app, however many shards are deployed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from election_model import shard_index
+from helper import read_global_state, read_local_state
+
+
+def read_shard_app_ids(client, coordinator_id):
+    """
+    Return the app ids of the coordinator's tally shards, in shard index order
+    """
+    coordinator_state = read_global_state(client, coordinator_id)
+    return [coordinator_state[f"Shard{i}"] for i in range(coordinator_state["NumShards"])]
+
+
+def shard_app_id(index, address):
+    """
+    Return the app id address must use: index itself for an unsharded election,
+    or the address's shard when index is the list of shard app ids of a sharded election
+    """
+    if isinstance(index, int):
+        return index
+    return index[shard_index(address, len(index))]
+
+
+def read_sharded_local_state(client, addr, shard_app_ids):
+    """
+    Read a voter's local state from the shard they belong to
+    """
+    return read_local_state(client, addr, shard_app_id(shard_app_ids, addr))
+
+
+def read_sharded_global_state(client, coordinator_id, max_workers=8):
+    """
+    Read the global state of a sharded election in one call
+    The shards are read concurrently and their VotesFor{i} tallies summed, the other keys
+    come from the coordinator
+    """
+    coordinator_state = read_global_state(client, coordinator_id)
+    shard_app_ids = [coordinator_state[f"Shard{i}"] for i in range(coordinator_state["NumShards"])]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        shard_states = list(executor.map(lambda app_id: read_global_state(client, app_id), shard_app_ids))
+
+    global_state = {
+        "ElectionEnd": coordinator_state["ElectionEnd"],
+        "NumVoteOptions": coordinator_state["NumVoteOptions"],
+        "VoteOptions": coordinator_state["VoteOptions"],
+    }
+    for i in range(coordinator_state["NumVoteOptions"]):
+        global_state[f"VotesFor{i}"] = sum(state[f"VotesFor{i}"] for state in shard_states)
+    return global_state
@@ -17,7 +17,9 @@ from election_smart_contract import approval_program, clear_state_program
 from secrets import account_mnemonics, algod_headers, algod_address
 
 from deploy import create_app
-from helper import compile_program, wait_for_confirmation, int_to_bytes, read_global_state, read_local_state
+from sharded_election import shard_app_id
+from helper import compile_program, wait_for_confirmation, int_to_bytes, read_global_state, read_local_state, \
+    sign_transaction
 
 account_private_keys = [mnemonic.to_private_key(mn) for mn in account_mnemonics]
 account_addresses = [account.address_from_private_key(sk) for sk in account_private_keys]
@@ -31,11 +33,12 @@ client = algod.AlgodClient(
 
 
 def opt_in_app(client, private_key, index):
-    """ OPT IN TO APPLICATION """
+    """ OPT IN TO APPLICATION, index may be the list of shard app ids of a sharded election """
 
     # declare sender
     sender = account.address_from_private_key(private_key)
     print("OptIn from account: ", sender)
+    index = shard_app_id(index, sender)
 
     # get node suggested parameters
     params = client.suggested_params()
@@ -47,7 +50,7 @@ def opt_in_app(client, private_key, index):
     txn = transaction.ApplicationOptInTxn(sender, params, index)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
@@ -61,15 +64,20 @@ def opt_in_app(client, private_key, index):
     print("OptIn to app-id:", transaction_response["txn"]["txn"]["apid"])
 
 
-def call_app_approve_voter(client, index, creator_private_key, user_address, yes_or_no_bytes):
-    """ CREATOR TO APPROVE VOTER """
+def call_app_approve_voter(client, index, creator_private_key, user_address, yes_or_no_bytes, preflight=None):
+    """ CREATOR TO APPROVE VOTER, index may be the list of shard app ids of a sharded election """
 
+    index = shard_app_id(index, user_address)
     app_args = [b"update_user_status", decode_address(user_address), yes_or_no_bytes]
     # declare sender
     sender = account.address_from_private_key(creator_private_key)
 
     print("Call from account:", sender)
 
+    # reject a doomed call locally instead of after a round trip
+    if preflight is not None:
+        preflight.require(sender, app_args)
+
     # get node suggested parameters
     params = client.suggested_params()
 
@@ -77,24 +85,31 @@ def call_app_approve_voter(client, index, creator_private_key, user_address, yes
     txn = transaction.ApplicationNoOpTxn(sender, params, index, app_args, accounts=[sender, user_address])
 
     # sign transaction
-    signed_txn = txn.sign(creator_private_key)
+    signed_txn = sign_transaction(txn, creator_private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
     client.send_transactions([signed_txn])
 
     # await confirmation
-    wait_for_confirmation(client, tx_id)
+    tx_info = wait_for_confirmation(client, tx_id)
+    if preflight is not None:
+        preflight.record(sender, app_args, round=tx_info["confirmed-round"])
     transaction_response = client.pending_transaction_info(tx_id)
     print("Approved user ", user_address, "for apid ", transaction_response, ": ", yes_or_no_bytes)
 
 
-def call_app(client, private_key, index, app_args):
-    """ CALL APPLICATION """
+def call_app(client, private_key, index, app_args, preflight=None):
+    """ CALL APPLICATION, index may be the list of shard app ids of a sharded election """
 
     # declare sender
     sender = account.address_from_private_key(private_key)
     print("Call from account:", sender)
+    index = shard_app_id(index, sender)
+
+    # reject a doomed call locally instead of after a round trip
+    if preflight is not None:
+        preflight.require(sender, app_args)
 
     # get node suggested parameters
     params = client.suggested_params()
@@ -106,14 +121,16 @@ def call_app(client, private_key, index, app_args):
     txn = transaction.ApplicationNoOpTxn(sender, params, index, app_args)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
     client.send_transactions([signed_txn])
 
     # await confirmation
-    wait_for_confirmation(client, tx_id)
+    tx_info = wait_for_confirmation(client, tx_id)
+    if preflight is not None:
+        preflight.record(sender, app_args, round=tx_info["confirmed-round"])
 
 
 def delete_app(client, private_key, index):
@@ -132,7 +149,7 @@ def delete_app(client, private_key, index):
     txn = transaction.ApplicationDeleteTxn(sender, params, index)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
@@ -147,10 +164,11 @@ def delete_app(client, private_key, index):
 
 
 def close_out_app(client, private_key, index):
-    """ CLOSE OUT FROM APPLICATION """
+    """ CLOSE OUT FROM APPLICATION, index may be the list of shard app ids of a sharded election """
 
     # declare sender
     sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
 
     # get node suggested parameters
     params = client.suggested_params()
@@ -162,7 +180,7 @@ def close_out_app(client, private_key, index):
     txn = transaction.ApplicationCloseOutTxn(sender, params, index)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
@@ -177,10 +195,11 @@ def close_out_app(client, private_key, index):
 
 
 def clear_state_app(client, private_key, index):
-    """ CLEAR STATE OF APPLICATION """
+    """ CLEAR STATE OF APPLICATION, index may be the list of shard app ids of a sharded election """
 
     # declare sender
     sender = account.address_from_private_key(private_key)
+    index = shard_app_id(index, sender)
 
     # get node suggested parameters
     params = client.suggested_params()
@@ -192,7 +211,7 @@ def clear_state_app(client, private_key, index):
     txn = transaction.ApplicationClearStateTxn(sender, params, index)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
@@ -220,7 +239,7 @@ def clear_app(client, private_key, index):
     txn = transaction.ApplicationClearStateTxn(sender, params, index)
 
     # sign transaction
-    signed_txn = txn.sign(private_key)
+    signed_txn = sign_transaction(txn, private_key)
     tx_id = signed_txn.transaction.get_txid()
 
     # send transaction
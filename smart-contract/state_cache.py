@@ -0,0 +1,290 @@
+"""
+Optimistic read-your-writes cache of app state built from confirmation deltas
+
+StateCache can be passed anywhere an algod.AlgodClient is expected (helper.py, simple_tests.py, ...).
+Every confirmed transaction info it sees through pending_transaction_info, which
+helper.wait_for_confirmation polls, carries the global and local state deltas of the call, and
+those are applied to the cached states. account_info and application_info then answer from the
+cache, with the node's last response carrying the cached key-value states, so reading state back
+after a call costs no round trip; read_global_state and read_local_state format the cached states
+directly. States are kept raw, as algod encodes them, so the deltas apply to them as they are and
+a compact voter "status" entry is decoded only when read. Confirming one transaction of a group
+sent through the cache also applies the rest of its group. States are fetched from the node on
+first read and again once they are reconcile_rounds rounds old, which also picks up changes made
+by other clients; the node's round is polled every status_interval seconds, so this holds for a
+cache that only reads. A fetch that a delta overtook while in flight is not cached over it.
+reconcile() refetches every cached state at once.
+"""
+
+import collections
+import threading
+import time
+
+from election_model import ON_COMPLETE_NAMES
+from helper import format_state
+
+# delta actions 1 and 2 set a byte value and a uint, matching key-value types 1 and 2; 3 deletes the key
+_set_actions = (1, 2)
+
+
+def apply_delta(state: dict, delta: list):
+    """
+    Apply an algod state delta to a raw state, a dict of base64 key to algod key-value value, in place
+    """
+    for item in delta:
+        value = item["value"]
+        if value["action"] in _set_actions:
+            state[item["key"]] = {"type": value["action"], "bytes": value.get("bytes", ""),
+                                  "uint": value.get("uint", 0)}
+        else:
+            state.pop(item["key"], None)
+
+
+def _raw_state(key_value: list) -> dict:
+    return {item["key"]: item["value"] for item in key_value}
+
+
+def _key_value(state: dict) -> list:
+    return [{"key": key, "value": dict(value)} for key, value in state.items()]
+
+
+class StateCache:
+    """
+    Drop-in replacement for algod.AlgodClient that caches app global states and account local states
+    A cached app or account is refetched once the latest round seen, in a confirmation or from the node's
+    status polled at most every status_interval seconds, is reconcile_rounds past the round it was
+    fetched at. The ids of the last max_applied applied transactions are kept, so
+    polling a transaction again does not apply its delta twice, and the groups of up to as many sent ones.
+    """
+
+    def __init__(self, client, reconcile_rounds=100, max_applied=10000, status_interval=10.0):
+        self.client = client
+        self.reconcile_rounds = reconcile_rounds
+        self.max_applied = max_applied
+        self.status_interval = status_interval
+        self.lock = threading.Lock()
+        # app_id -> [round fetched, application_info response or None, raw global state, last delta]
+        self.apps = {}
+        # address -> [round fetched, account_info response, {app_id: raw local state}, last delta]
+        self.accounts = {}
+        self.applied = collections.OrderedDict()
+        # tx_id -> (group tx ids, app_id, addresses involved) of the transactions sent in groups
+        self.groups = collections.OrderedDict()
+        self.round = 0
+        self.polled = None
+        # number of deltas applied, an entry's last delta is the count when one was last applied to it
+        self.deltas = 0
+        self.hits = 0
+        self.fetches = 0
+
+    def send_transactions(self, txns, **kwargs):
+        tx_ids = [signed_txn.transaction.get_txid() for signed_txn in txns]
+        if len(txns) > 1:
+            with self.lock:
+                for tx_id, signed_txn in zip(tx_ids, txns):
+                    txn = signed_txn.transaction
+                    self.groups[tx_id] = (tx_ids, getattr(txn, "index", None),
+                                          [txn.sender, *(getattr(txn, "accounts", None) or [])])
+                while len(self.groups) > self.max_applied:
+                    self.groups.popitem(last=False)
+        return self.client.send_transactions(txns, **kwargs)
+
+    def pending_transaction_info(self, transaction_id, **kwargs):
+        info = self.client.pending_transaction_info(transaction_id, **kwargs)
+        if info.get("confirmed-round"):
+            self.apply(transaction_id, info)
+            self._apply_group(transaction_id)
+        return info
+
+    def _apply_group(self, tx_id):
+        # a confirmed transaction confirms its whole group, whose other deltas are fetched and applied
+        with self.lock:
+            entry = self.groups.get(tx_id)
+            if entry is None:
+                return
+            siblings = [(sibling, self.groups[sibling]) for sibling in entry[0]
+                        if sibling != tx_id and sibling not in self.applied and sibling in self.groups]
+            for sibling in entry[0]:
+                self.groups.pop(sibling, None)
+        for sibling, (_, app_id, addresses) in siblings:
+            try:
+                info = self.client.pending_transaction_info(sibling)
+            except Exception:
+                info = {}
+            if info.get("confirmed-round"):
+                self.apply(sibling, info)
+                continue
+            # the delta is unknown, so whatever the transaction touched is fetched again on the next read
+            with self.lock:
+                self.deltas += 1
+                self._invalidate(self.apps, app_id)
+                for address in addresses:
+                    self._invalidate(self.accounts, address)
+
+    def _invalidate(self, entries, key):
+        # mark an entry to be fetched again on the next read, and a fetch in flight not to be cached over it
+        entry = entries.get(key)
+        if entry is not None:
+            entry[0] = None
+            entry[3] = self.deltas
+
+    def apply(self, tx_id, info):
+        """Apply the state changes of a confirmed transaction's info to the cached states"""
+        with self.lock:
+            if tx_id in self.applied:
+                return
+            self.applied[tx_id] = None
+            if len(self.applied) > self.max_applied:
+                self.applied.popitem(last=False)
+            self.round = max(self.round, info["confirmed-round"])
+
+            txn = info["txn"]["txn"]
+            app_id = info.get("application-index") or txn.get("apid")
+            if app_id is None:
+                return
+            self.deltas += 1
+            on_complete = ON_COMPLETE_NAMES[txn.get("apan", 0)]
+            sender = self.accounts.get(txn["snd"])
+            if on_complete == "delete":
+                self._invalidate(self.apps, app_id)
+                for account in self.accounts.values():
+                    if account[2].pop(app_id, None) is not None:
+                        account[3] = self.deltas
+                return
+            if on_complete in ("closeout", "clear") and sender is not None:
+                # algod reports no delta for the removed local state
+                sender[2].pop(app_id, None)
+                sender[3] = self.deltas
+            if on_complete == "optin" and sender is not None:
+                sender[2].setdefault(app_id, {})
+                sender[3] = self.deltas
+
+            if "application-index" in info and app_id not in self.apps:
+                self.apps[app_id] = [self.round, None, {}, self.deltas]
+            if "global-state-delta" in info and app_id in self.apps:
+                apply_delta(self.apps[app_id][2], info["global-state-delta"])
+                self.apps[app_id][3] = self.deltas
+            for entry in info.get("local-state-delta", []):
+                account = self.accounts.get(entry["address"])
+                if account is None:
+                    continue
+                if app_id in account[2]:
+                    apply_delta(account[2][app_id], entry["delta"])
+                    account[3] = self.deltas
+                else:
+                    # an opt-in this cache did not see, the account is fetched again on the next read
+                    self._invalidate(self.accounts, entry["address"])
+
+    def _poll_round(self):
+        # advance the round from the node's status, so states go stale without confirmations too
+        now = time.monotonic()
+        with self.lock:
+            if self.polled is not None and now - self.polled < self.status_interval:
+                return
+            self.polled = now
+        last_round = self.client.status()["last-round"]
+        with self.lock:
+            self.round = max(self.round, last_round)
+
+    def _stale(self, cached):
+        return cached is None or cached[0] is None or self.round - cached[0] >= self.reconcile_rounds
+
+    def _store(self, entries, key, started, cached):
+        # cache a fetched entry unless a delta applied while it was in flight may be missing from it
+        current = entries.get(key)
+        if current is None or current[3] <= started:
+            entries[key] = cached
+            return cached
+        if current[0] is None:
+            # invalidated meanwhile, the response is served but the next read fetches again
+            return cached
+        if current[1] is None:
+            current[1] = cached[1]
+        return current
+
+    def _fetch_app(self, app_id):
+        with self.lock:
+            round, started = self.round, self.deltas
+        response = self.client.application_info(app_id)
+        cached = [round, response, _raw_state(response["params"].get("global-state", [])), started]
+        with self.lock:
+            self.fetches += 1
+            return self._store(self.apps, app_id, started, cached)
+
+    def _fetch_account(self, address):
+        with self.lock:
+            round, started = self.round, self.deltas
+        response = self.client.account_info(address)
+        cached = [round, response, {local_state["id"]: _raw_state(local_state.get("key-value", []))
+                                    for local_state in response.get("apps-local-state", [])}, started]
+        with self.lock:
+            self.fetches += 1
+            return self._store(self.accounts, address, started, cached)
+
+    def _cached_app(self, app_id, need_response=False):
+        # return (response, copy of the raw global state) from the cache, fetching it when stale
+        self._poll_round()
+        with self.lock:
+            cached = self.apps.get(app_id)
+            if not self._stale(cached) and (cached[1] is not None or not need_response):
+                self.hits += 1
+                return cached[1], {key: dict(value) for key, value in cached[2].items()}
+        cached = self._fetch_app(app_id)
+        return cached[1], {key: dict(value) for key, value in cached[2].items()}
+
+    def _cached_account(self, address):
+        # return (response, copies of the raw local states) from the cache, fetching it when stale
+        self._poll_round()
+        with self.lock:
+            cached = self.accounts.get(address)
+            if not self._stale(cached):
+                self.hits += 1
+                return cached[1], {app_id: dict(state) for app_id, state in cached[2].items()}
+        cached = self._fetch_account(address)
+        return cached[1], {app_id: dict(state) for app_id, state in cached[2].items()}
+
+    def application_info(self, application_id, **kwargs):
+        """Return the node's application info with the cached global state"""
+        response, state = self._cached_app(application_id, need_response=True)
+        params = dict(response["params"], **{"global-state": _key_value(state)})
+        return dict(response, params=params)
+
+    def account_info(self, address, **kwargs):
+        """Return the node's account info with the cached local states"""
+        response, local_states = self._cached_account(address)
+        entries = {local_state["id"]: local_state for local_state in response.get("apps-local-state", [])}
+        apps_local_state = []
+        for app_id, state in local_states.items():
+            local_state = {key: value for key, value in entries.get(app_id, {"id": app_id}).items()
+                           if key != "key-value"}
+            if state:
+                local_state["key-value"] = _key_value(state)
+            apps_local_state.append(local_state)
+        return dict(response, **{"apps-local-state": apps_local_state})
+
+    def read_global_state(self, app_id) -> dict:
+        """Return the app's global state, as helper.read_global_state does"""
+        return format_state(_key_value(self._cached_app(app_id)[1]))
+
+    def read_local_state(self, address, app_id) -> dict:
+        """Return the account's local state in the app, as helper.read_local_state does"""
+        return format_state(_key_value(self._cached_account(address)[1].get(app_id, {})))
+
+    def reconcile(self) -> int:
+        """Refetch every cached app and account from the node, return how many had drifted from it"""
+        # invalidated entries, e.g. of a deleted app, are left to the next read
+        with self.lock:
+            apps = {app_id: cached[2] for app_id, cached in self.apps.items() if cached[0] is not None}
+            accounts = {address: cached[2] for address, cached in self.accounts.items() if cached[0] is not None}
+        drifted = 0
+        for app_id, state in apps.items():
+            drifted += self._fetch_app(app_id)[2] != state
+        for address, local_states in accounts.items():
+            drifted += self._fetch_account(address)[2] != local_states
+        return drifted
+
+    def __getattr__(self, method):
+        # every other AlgodClient method goes straight to the node
+        if method.startswith("_"):
+            raise AttributeError(method)
+        return getattr(self.client, method)
@@ -0,0 +1,77 @@
+"""
+Encoding of the compact voter status and approver registry keys in app state
+
+helper.format_state decodes both when formatting a state read from algod, local_algod encodes
+them when serving its states in algod's format. to_json_value and from_json_value convert state
+values to and from the JSON that ledger_replay's checkpoints and ledger_store's rows hold.
+"""
+
+import base64
+
+from algosdk.encoding import decode_address, encode_address
+
+from election_model import approver_key, approver_prefix
+from election_params import status_maybe, status_yes, status_no
+
+# can_vote values of the compact voter status eligibility bits
+status_names = {status_maybe: "maybe", status_yes: "yes", status_no: "no"}
+
+
+def decode_voter_status(status: int) -> dict:
+    """
+    Decode a compact voter status uint into the can_vote/voted entries of the default layout
+    """
+    decoded = {}
+    if status & 3 in status_names:
+        decoded["can_vote"] = status_names[status & 3]
+    if status >> 2:
+        decoded["voted"] = (status >> 2) - 1
+    return decoded
+
+
+def encode_voter_status(local_state: dict) -> int:
+    """
+    Encode the can_vote/voted entries of a local state into a compact voter status uint
+    The inverse of decode_voter_status
+    """
+    status = {name: code for code, name in status_names.items()}.get(local_state.get("can_vote"), 0)
+    if "voted" in local_state:
+        status |= (local_state["voted"] + 1) << 2
+    return status
+
+
+def format_key(key: bytes) -> str:
+    """
+    Format a raw state key, an approver registry key as election_model.approver_key(address)
+    """
+    prefix = approver_prefix.encode("utf-8")
+    if len(key) == len(prefix) + 32 and key.startswith(prefix):
+        return approver_key(encode_address(key[len(prefix):]))
+    return key.decode("utf-8")
+
+
+def encode_key(key: str) -> bytes:
+    """
+    Encode a formatted state key back into the raw key, the inverse of format_key
+    """
+    if key.startswith(approver_prefix) and len(key) == len(approver_prefix) + 58:
+        return approver_prefix.encode("utf-8") + decode_address(key[len(approver_prefix):])
+    return key.encode("utf-8")
+
+
+def to_json_value(value):
+    """
+    Return a state value in a JSON serializable form, a byte value as {"b64": base64 of the bytes}
+    """
+    if isinstance(value, bytes):
+        return {"b64": base64.b64encode(value).decode("ascii")}
+    return value
+
+
+def from_json_value(value):
+    """
+    Return the state value to_json_value encoded
+    """
+    if isinstance(value, dict) and "b64" in value:
+        return base64.b64decode(value["b64"])
+    return value
@@ -0,0 +1,146 @@
+"""
+Vectorized tally analytics across many elections (needs numpy)
+
+load_tallies reads the global state of many election apps concurrently and loads their tallies
+into an ElectionTallies: one row per election and one column per vote option, padded with zeros
+to the largest option count. Only the VotesFor{i} and NumVoteOptions entries are decoded; the
+option names are kept as the raw VoteOptions strings and only split when asked for.
+summarize computes totals, shares, winners and margins for every election at once.
+Run bench_tally_analytics.py to compare with a per-election Python loop.
+"""
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from algosdk.error import AlgodHTTPError, AlgodResponseError
+
+
+def _b64(key: str) -> str:
+    return base64.b64encode(key.encode("utf-8")).decode("ascii")
+
+
+# global state holds at most 64 entries, so no app has more VotesFor{i} keys than that, whatever
+# the contract's own election_params.max_vote_options is
+max_tally_keys = 64
+_tally_keys = {_b64(f"VotesFor{i}"): i for i in range(max_tally_keys)}
+_num_vote_options_key = _b64("NumVoteOptions")
+_vote_options_key = _b64("VoteOptions")
+
+
+def _read_tallies(client, app_id):
+    # (number of options, {option index: votes}, raw VoteOptions) from the app's encoded global state
+    app = client.application_info(app_id)
+    num_vote_options = 0
+    votes = {}
+    vote_options = ""
+    for item in app["params"].get("global-state", []):
+        key, value = item["key"], item["value"]
+        if key in _tally_keys or key == _num_vote_options_key:
+            if value.get("type") != 2:
+                raise ValueError(f"app {app_id}: {base64.b64decode(key)!r} is not a uint")
+            if key == _num_vote_options_key:
+                num_vote_options = value["uint"]
+            else:
+                votes[_tally_keys[key]] = value["uint"]
+        elif key == _vote_options_key:
+            vote_options = value["bytes"]
+    return num_vote_options, votes, vote_options
+
+
+class ElectionTallies:
+    """
+    Tallies of many elections as arrays
+    app_ids and num_options have one entry per election, votes is (elections, max options) with
+    zeros past each election's option count. failed maps the app ids that could not be read to the error
+    """
+
+    def __init__(self, app_ids, num_options, votes, vote_options, failed=None):
+        self.app_ids = numpy.asarray(app_ids, dtype=numpy.int64)
+        self.num_options = numpy.asarray(num_options, dtype=numpy.int64)
+        votes = numpy.asarray(votes, dtype=numpy.int64)
+        # without any option the width cannot be inferred, e.g. when no app could be read
+        self.votes = votes.reshape(len(self.app_ids), -1 if votes.size else 0)
+        # base64 encoded VoteOptions per election
+        self.vote_options = vote_options
+        self.failed = failed or {}
+
+    def __len__(self):
+        return len(self.app_ids)
+
+    @property
+    def mask(self):
+        """Boolean array marking the real (not padding) options of each election"""
+        return numpy.arange(self.votes.shape[1]) < self.num_options[:, None]
+
+    def option_names(self, row) -> list:
+        """Return the vote option names of the election in the given row"""
+        names = base64.b64decode(self.vote_options[row]).decode("utf-8").split(",")
+        return [names[i] if i < len(names) else "" for i in range(self.num_options[row])]
+
+
+def load_tallies(client, app_ids, max_workers=16) -> ElectionTallies:
+    """
+    Read the tallies of many election apps, max_workers at a time
+    An app that cannot be read (e.g. deleted, unreachable or with a malformed state) is left out of the
+    rows and recorded in failed, so one bad app does not lose the others; any other error is raised
+    """
+    def read(app_id):
+        try:
+            return _read_tallies(client, app_id)
+        except (AlgodHTTPError, AlgodResponseError, OSError, ValueError) as e:
+            # OSError covers an unreachable node, ValueError a tally that is not a uint
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(read, app_ids))
+
+    rows = [(app_id, result) for app_id, result in zip(app_ids, results) if not isinstance(result, Exception)]
+    width = max([num_vote_options for _, (num_vote_options, _, _) in rows], default=0)
+    # scatter every (row, option, votes) entry into the padded array at once
+    entries = [(row, i, count) for row, (_, (_, tallies, _)) in enumerate(rows) for i, count in tallies.items()]
+    votes = numpy.zeros((len(rows), width), dtype=numpy.int64)
+    if entries:
+        row_indexes, option_indexes, counts = numpy.array(entries, dtype=numpy.int64).T
+        in_range = option_indexes < width
+        votes[row_indexes[in_range], option_indexes[in_range]] = counts[in_range]
+    return ElectionTallies(
+        [app_id for app_id, _ in rows],
+        [num_vote_options for _, (num_vote_options, _, _) in rows],
+        votes,
+        [vote_options for _, (_, _, vote_options) in rows],
+        failed={app_id: result for app_id, result in zip(app_ids, results) if isinstance(result, Exception)},
+    )
+
+
+def summarize(tallies: ElectionTallies) -> dict:
+    """
+    Compute per-election statistics, each an array with one entry per election:
+    totals, shares (elections x options, 0 for padding and elections without votes), winners (lowest
+    index on a tie, as the finalize call picks), winner_votes, runner_up_votes, margins between the
+    two leading options and margin_shares of the total
+    """
+    votes = tallies.votes
+    totals = votes.sum(axis=1)
+    shares = numpy.divide(votes, totals[:, None], out=numpy.zeros(votes.shape), where=totals[:, None] > 0)
+    # padding is ranked below every real option
+    ranked = numpy.where(tallies.mask, votes, -1)
+    winners = ranked.argmax(axis=1) if votes.shape[1] else numpy.zeros(len(tallies), dtype=numpy.int64)
+    if votes.shape[1] >= 2:
+        top_two = numpy.partition(ranked, -2, axis=1)[:, -2:]
+        winner_votes, runner_up_votes = top_two[:, 1], numpy.maximum(top_two[:, 0], 0)
+    else:
+        winner_votes = ranked.max(axis=1, initial=0)
+        runner_up_votes = numpy.zeros(len(tallies), dtype=numpy.int64)
+    winner_votes = numpy.maximum(winner_votes, 0)
+    margins = winner_votes - runner_up_votes
+    margin_shares = numpy.divide(margins, totals, out=numpy.zeros(len(tallies)), where=totals > 0)
+    return {
+        "totals": totals,
+        "shares": shares,
+        "winners": winners,
+        "winner_votes": winner_votes,
+        "runner_up_votes": runner_up_votes,
+        "margins": margins,
+        "margin_shares": margin_shares,
+    }
@@ -0,0 +1,555 @@
+"""
+Minimal local evaluator for TEAL v5 application programs
+
+Runs the compiled TEAL source of the election programs (and the output of teal_optimizer) against
+in-memory state, so two programs can be compared by differential execution without a node. Covers
+the opcodes pyteal emits for these programs plus the constant block, stack and scratch opcodes the
+optimizer uses. Opcode cost follows the v5 cost table for the opcodes covered, including the
+constant blocks the assembler emits for the int and byte pseudo opcodes.
+
+State uses raw bytes keys: global_state maps key -> int or bytes and local_states maps
+address -> {key: int or bytes}, the shape helper.format_state produces before utf-8 decoding.
+"""
+
+import base64
+import copy
+import hashlib
+
+from algosdk.encoding import decode_address, encode_address
+
+max_uint64 = 2 ** 64 - 1
+max_bytes_length = 4096
+
+# named integer constants accepted by the int pseudo opcode
+named_ints = {
+    "NoOp": 0, "OptIn": 1, "CloseOut": 2, "ClearState": 3, "UpdateApplication": 4, "DeleteApplication": 5,
+    "unknown": 0, "pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6,
+}
+
+branch_opcodes = ("b", "bnz", "bz")
+# opcodes execution does not continue past
+terminal_opcodes = ("return", "err", "retsub", "b")
+
+# opcodes costing more than 1
+opcode_costs = {"sha256": 35, "keccak256": 130, "sha512_256": 45}
+
+on_complete_values = {"noop": 0, "optin": 1, "closeout": 2, "clear": 3, "update": 4, "delete": 5}
+
+
+class TealError(Exception):
+    """Raised when a program fails: err, a failed assert, a bad operand, ..."""
+
+
+def parse_int(text: str) -> int:
+    """Parse an integer immediate: decimal, 0x hex, 0 octal or a named constant"""
+    if text in named_ints:
+        return named_ints[text]
+    if text.startswith(("0x", "0X")):
+        return int(text, 16)
+    if len(text) > 1 and text.startswith("0"):
+        return int(text, 8)
+    return int(text)
+
+
+def parse_bytes(text: str) -> bytes:
+    """Parse a byte string immediate: "quoted", 0x hex, base64(...), b64(...), base32(...) or b32(...)"""
+    if text.startswith('"') and text.endswith('"') and len(text) >= 2:
+        return _unescape(text[1:-1])
+    if text.startswith(("0x", "0X")):
+        return bytes.fromhex(text[2:])
+    for prefix in ("base64(", "b64("):
+        if text.startswith(prefix) and text.endswith(")"):
+            return base64.b64decode(text[len(prefix):-1])
+    for prefix in ("base32(", "b32("):
+        if text.startswith(prefix) and text.endswith(")"):
+            encoded = text[len(prefix):-1]
+            return base64.b32decode(encoded + "=" * (-len(encoded) % 8))
+    raise ValueError(f"cannot parse byte string {text}")
+
+
+def _unescape(text: str) -> bytes:
+    escapes = {"n": b"\n", "r": b"\r", "t": b"\t", "\\": b"\\", '"': b'"', "0": b"\0"}
+    result = bytearray()
+    i = 0
+    while i < len(text):
+        if text[i] == "\\":
+            if text[i + 1] == "x":
+                result.append(int(text[i + 2:i + 4], 16))
+                i += 4
+                continue
+            result += escapes[text[i + 1]]
+            i += 2
+        else:
+            result += text[i].encode("utf-8")
+            i += 1
+    return bytes(result)
+
+
+def split_immediates(line: str) -> list:
+    """Split an instruction into its opcode and immediates, keeping quoted strings whole"""
+    parts = []
+    current = ""
+    quoted = False
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quoted:
+            current += char
+            if char == "\\":
+                current += line[i + 1]
+                i += 1
+            elif char == '"':
+                quoted = False
+        elif char == '"':
+            quoted = True
+            current += char
+        elif char in " \t":
+            if current:
+                parts.append(current)
+                current = ""
+        else:
+            current += char
+        i += 1
+    if current:
+        parts.append(current)
+    return parts
+
+
+def parse_program(teal: str):
+    """
+    Return (version, items): the program's #pragma version and, in order, its labels (str) and
+    instructions (tuples of opcode and immediates), without comments
+    """
+    version = 1
+    items = []
+    for line in teal.splitlines():
+        line = line.strip()
+        if line.startswith("#pragma version"):
+            version = int(line.split()[2])
+            continue
+        if line.startswith("//") or line.startswith("#pragma") or not line:
+            continue
+        parts = split_immediates(line)
+        # drop trailing comments
+        for i, part in enumerate(parts):
+            if part.startswith("//"):
+                parts = parts[:i]
+                break
+        if not parts:
+            continue
+        if len(parts) == 1 and parts[0].endswith(":"):
+            items.append(parts[0][:-1])
+        else:
+            items.append(tuple(parts))
+    return version, items
+
+
+def resolve_labels(items):
+    """
+    Return (instructions, labels) for the items of parse_program: the instructions without the labels,
+    and a dict mapping each label to the index of the instruction that follows it
+    """
+    instructions = []
+    labels = {}
+    for item in items:
+        if isinstance(item, str):
+            labels[item] = len(instructions)
+        else:
+            instructions.append(item)
+    return instructions, labels
+
+
+def assemble(teal: str):
+    """
+    Return (instructions, labels): each instruction as a tuple of opcode and immediates,
+    and a dict mapping each label to the index of the instruction that follows it
+    """
+    return resolve_labels(parse_program(teal)[1])
+
+
+def reachable(instructions, labels, start, follow_calls=False) -> set:
+    """
+    Return the indexes of the instructions reachable from index start, entering subroutines
+    only when follow_calls is set
+    """
+    seen = set()
+    stack = [start]
+    while stack:
+        index = stack.pop()
+        if index in seen or index >= len(instructions):
+            continue
+        seen.add(index)
+        op = instructions[index][0]
+        if op in branch_opcodes or follow_calls and op == "callsub":
+            stack.append(labels[instructions[index][1]])
+        if op not in terminal_opcodes:
+            stack.append(index + 1)
+    return seen
+
+
+class AppCall:
+    """
+    An application call to evaluate
+    accounts are the transaction's foreign accounts, Accounts 0 is always the sender
+    """
+
+    def __init__(self, sender, on_complete="noop", app_args=(), accounts=(), app_id=1, creator=None, round=1,
+                 latest_timestamp=0):
+        self.sender = sender
+        self.on_complete = on_complete
+        self.app_args = list(app_args)
+        self.accounts = list(accounts)
+        self.app_id = app_id
+        self.creator = creator if creator is not None else sender
+        self.round = round
+        self.latest_timestamp = latest_timestamp
+
+    def txn_field(self, field):
+        fields = {
+            "Sender": decode_address(self.sender),
+            "ApplicationID": 0 if self.on_complete == "create" else self.app_id,
+            "OnCompletion": on_complete_values.get(self.on_complete, 0),
+            "NumAppArgs": len(self.app_args),
+            "NumAccounts": len(self.accounts),
+            "TypeEnum": 6,
+            "Fee": 1000,
+            "RekeyTo": bytes(32),
+            "GroupIndex": 0,
+        }
+        if field not in fields:
+            raise TealError(f"unsupported txn field {field}")
+        return fields[field]
+
+    def txna_field(self, field, index):
+        if field == "ApplicationArgs":
+            values = self.app_args
+        elif field == "Accounts":
+            values = [decode_address(self.sender)] + [decode_address(account) for account in self.accounts]
+        else:
+            raise TealError(f"unsupported txna field {field}")
+        if index >= len(values):
+            raise TealError(f"txna {field} {index} out of range")
+        return values[index]
+
+    def global_field(self, field):
+        fields = {
+            "Round": self.round,
+            "LatestTimestamp": self.latest_timestamp,
+            "CurrentApplicationID": self.app_id,
+            "CreatorAddress": decode_address(self.creator),
+            "ZeroAddress": bytes(32),
+            "GroupSize": 1,
+            "MinTxnFee": 1000,
+            "MinBalance": 100000,
+            "MaxTxnLife": 1000,
+        }
+        if field not in fields:
+            raise TealError(f"unsupported global field {field}")
+        return fields[field]
+
+
+class _Machine:
+    def __init__(self, instructions, labels, call, global_state, local_states, max_cost):
+        self.instructions = instructions
+        self.labels = labels
+        self.call = call
+        self.global_state = global_state
+        self.local_states = local_states
+        self.max_cost = max_cost
+        self.stack = []
+        self.scratch = [0] * 256
+        self.frames = []
+        self.intc = []
+        self.bytec = []
+        self.cost = 0
+
+    def pop(self, kind=None):
+        if not self.stack:
+            raise TealError("stack underflow")
+        value = self.stack.pop()
+        if kind is not None and not isinstance(value, kind):
+            raise TealError(f"expected {kind.__name__}, got {type(value).__name__}")
+        return value
+
+    def push(self, value):
+        if isinstance(value, int) and not 0 <= value <= max_uint64:
+            raise TealError("integer overflow")
+        if isinstance(value, bytes) and len(value) > max_bytes_length:
+            raise TealError("byte string too long")
+        if len(self.stack) >= 1000:
+            raise TealError("stack overflow")
+        self.stack.append(value)
+
+    def account(self, reference):
+        # an account is referenced by its Accounts index or, from v4, by its address
+        if isinstance(reference, int):
+            return encode_address(self.call.txna_field("Accounts", reference))
+        address = encode_address(reference) if len(reference) == 32 else None
+        if address is None or (address != self.call.sender and address not in self.call.accounts):
+            raise TealError("invalid account reference")
+        return address
+
+    def run(self):
+        pc = 0
+        while pc < len(self.instructions):
+            op, *immediates = self.instructions[pc]
+            self.cost += opcode_costs.get(op, 1)
+            if self.cost > self.max_cost:
+                raise TealError("dynamic cost budget exceeded")
+            jump = self.step(op, immediates, pc)
+            if jump == "return":
+                break
+            pc = jump if jump is not None else pc + 1
+        else:
+            if len(self.stack) != 1:
+                raise TealError("stack must contain exactly one value at the end of the program")
+        value = self.pop()
+        if not isinstance(value, int):
+            raise TealError("program must end with an integer")
+        return value != 0
+
+    def step(self, op, immediates, pc):
+        binary_ints = {
+            "+": lambda a, b: a + b,
+            "-": lambda a, b: a - b,
+            "*": lambda a, b: a * b,
+            "<": lambda a, b: int(a < b),
+            ">": lambda a, b: int(a > b),
+            "<=": lambda a, b: int(a <= b),
+            ">=": lambda a, b: int(a >= b),
+            "&&": lambda a, b: int(bool(a and b)),
+            "||": lambda a, b: int(bool(a or b)),
+            "&": lambda a, b: a & b,
+            "|": lambda a, b: a | b,
+            "^": lambda a, b: a ^ b,
+            "shl": lambda a, b: (a << b) & max_uint64,
+            "shr": lambda a, b: a >> b,
+        }
+        if op in binary_ints:
+            b = self.pop(int)
+            a = self.pop(int)
+            if op in ("shl", "shr") and b > 63:
+                raise TealError("shift amount out of range")
+            self.push(binary_ints[op](a, b))
+        elif op in ("/", "%"):
+            b = self.pop(int)
+            a = self.pop(int)
+            if b == 0:
+                raise TealError("division by zero")
+            self.push(a // b if op == "/" else a % b)
+        elif op in ("==", "!="):
+            b = self.pop()
+            a = self.pop()
+            if type(a) is not type(b):
+                raise TealError("comparing values of different types")
+            self.push(int((a == b) == (op == "==")))
+        elif op == "!":
+            self.push(int(self.pop(int) == 0))
+        elif op == "~":
+            self.push(max_uint64 ^ self.pop(int))
+        elif op == "int":
+            self.push(parse_int(immediates[0]))
+        elif op == "pushint":
+            self.push(parse_int(immediates[0]))
+        elif op in ("byte", "pushbytes"):
+            self.push(parse_bytes(immediates[0]))
+        elif op == "addr":
+            self.push(decode_address(immediates[0]))
+        elif op == "intcblock":
+            self.intc = [parse_int(value) for value in immediates]
+        elif op == "bytecblock":
+            self.bytec = [parse_bytes(value) for value in immediates]
+        elif op.startswith("intc"):
+            index = int(immediates[0]) if op == "intc" else int(op[5:])
+            if index >= len(self.intc):
+                raise TealError("intc index out of range")
+            self.push(self.intc[index])
+        elif op.startswith("bytec"):
+            index = int(immediates[0]) if op == "bytec" else int(op[6:])
+            if index >= len(self.bytec):
+                raise TealError("bytec index out of range")
+            self.push(self.bytec[index])
+        elif op == "txn":
+            self.push(self.call.txn_field(immediates[0]))
+        elif op == "txna":
+            self.push(self.call.txna_field(immediates[0], int(immediates[1])))
+        elif op == "global":
+            self.push(self.call.global_field(immediates[0]))
+        elif op == "len":
+            self.push(len(self.pop(bytes)))
+        elif op == "itob":
+            self.push(self.pop(int).to_bytes(8, "big"))
+        elif op == "btoi":
+            value = self.pop(bytes)
+            if len(value) > 8:
+                raise TealError("btoi input longer than 8 bytes")
+            self.push(int.from_bytes(value, "big"))
+        elif op == "concat":
+            b = self.pop(bytes)
+            a = self.pop(bytes)
+            self.push(a + b)
+        elif op in ("sha256", "keccak256", "sha512_256"):
+            value = self.pop(bytes)
+            if op == "sha256":
+                self.push(hashlib.sha256(value).digest())
+            elif op == "sha512_256":
+                self.push(hashlib.new("sha512_256", value).digest())
+            else:
+                raise TealError("keccak256 is not supported by the local evaluator")
+        elif op in ("substring", "extract"):
+            value = self.pop(bytes)
+            start = int(immediates[0])
+            end = int(immediates[1]) if op == "substring" else start + (int(immediates[1]) or len(value) - start)
+            self._push_slice(value, start, end)
+        elif op in ("substring3", "extract3"):
+            b = self.pop(int)
+            a = self.pop(int)
+            value = self.pop(bytes)
+            self._push_slice(value, a, b if op == "substring3" else a + b)
+        elif op == "getbyte":
+            index = self.pop(int)
+            value = self.pop(bytes)
+            if index >= len(value):
+                raise TealError("getbyte index out of range")
+            self.push(value[index])
+        elif op == "pop":
+            self.pop()
+        elif op == "dup":
+            value = self.pop()
+            self.push(value)
+            self.push(value)
+        elif op == "dup2":
+            b = self.pop()
+            a = self.pop()
+            for value in (a, b, a, b):
+                self.push(value)
+        elif op == "swap":
+            b = self.pop()
+            a = self.pop()
+            self.push(b)
+            self.push(a)
+        elif op == "select":
+            condition = self.pop(int)
+            b = self.pop()
+            a = self.pop()
+            self.push(b if condition else a)
+        elif op == "dig":
+            depth = int(immediates[0])
+            if depth >= len(self.stack):
+                raise TealError("dig below the stack")
+            self.push(self.stack[-1 - depth])
+        elif op == "load":
+            self.push(self.scratch[int(immediates[0])])
+        elif op == "store":
+            self.scratch[int(immediates[0])] = self.pop()
+        elif op == "err":
+            raise TealError("err opcode executed")
+        elif op == "assert":
+            if self.pop(int) == 0:
+                raise TealError(f"assert failed at instruction {pc}")
+        elif op == "return":
+            value = self.pop()
+            self.stack = [value]
+            return "return"
+        elif op == "b":
+            return self.labels[immediates[0]]
+        elif op in ("bnz", "bz"):
+            if (self.pop(int) != 0) == (op == "bnz"):
+                return self.labels[immediates[0]]
+        elif op == "callsub":
+            if len(self.frames) >= 1024:
+                raise TealError("callsub depth exceeded")
+            self.frames.append(pc + 1)
+            return self.labels[immediates[0]]
+        elif op == "retsub":
+            if not self.frames:
+                raise TealError("retsub without callsub")
+            return self.frames.pop()
+        else:
+            self.state_step(op)
+        return None
+
+    def _push_slice(self, value, start, end):
+        if start > end or end > len(value):
+            raise TealError("byte slice out of range")
+        self.push(value[start:end])
+
+    def state_step(self, op):
+        if op in ("app_global_get", "app_global_get_ex"):
+            key = self.pop(bytes)
+            if op == "app_global_get_ex":
+                self._check_app(self.pop(int))
+            value = self.global_state.get(key)
+            self.push(0 if value is None else value)
+            if op == "app_global_get_ex":
+                self.push(int(value is not None))
+        elif op == "app_global_put":
+            value = self.pop()
+            self.global_state[self.pop(bytes)] = value
+        elif op == "app_global_del":
+            self.global_state.pop(self.pop(bytes), None)
+        elif op in ("app_local_get", "app_local_get_ex"):
+            key = self.pop(bytes)
+            if op == "app_local_get_ex":
+                self._check_app(self.pop(int))
+            address = self.account(self.pop())
+            value = self.local_states.get(address, {}).get(key)
+            self.push(0 if value is None else value)
+            if op == "app_local_get_ex":
+                self.push(int(value is not None))
+        elif op == "app_local_put":
+            value = self.pop()
+            key = self.pop(bytes)
+            address = self.account(self.pop())
+            if address not in self.local_states:
+                raise TealError("account is not opted in")
+            self.local_states[address] = dict(self.local_states[address])
+            self.local_states[address][key] = value
+        elif op == "app_local_del":
+            key = self.pop(bytes)
+            address = self.account(self.pop())
+            if address not in self.local_states:
+                raise TealError("account is not opted in")
+            self.local_states[address] = {k: v for k, v in self.local_states[address].items() if k != key}
+        elif op == "app_opted_in":
+            self._check_app(self.pop(int))
+            self.push(int(self.account(self.pop()) in self.local_states))
+        else:
+            raise TealError(f"unsupported opcode {op}")
+
+    def _check_app(self, app):
+        # only the current app's state is modelled
+        if app not in (0, self.call.app_id):
+            raise TealError("foreign app state is not supported by the local evaluator")
+
+
+def evaluate(program, call: AppCall, global_state: dict, local_states: dict, max_cost=700):
+    """
+    Run program (TEAL source, or the result of assemble) for call against global_state and local_states
+    Return (approved, cost, global_state, local_states): the states after the call, which are copies,
+    unchanged when the call is rejected. An opt-in's local state exists while the program runs, a
+    closeout's and clear state's is removed after it; clear state removes it even when rejected.
+    """
+    instructions, labels = assemble(program) if isinstance(program, str) else program
+    new_global = copy.deepcopy(global_state)
+    new_local = copy.deepcopy(local_states)
+    if call.on_complete == "optin":
+        if call.sender in new_local:
+            raise TealError("account is already opted in")
+        new_local[call.sender] = {}
+    elif call.on_complete in ("closeout", "clear") and call.sender not in new_local:
+        raise TealError("account is not opted in")
+
+    machine = _Machine(instructions, labels, call, new_global, new_local, max_cost)
+    # the assembler turns the int and byte pseudo opcodes into constant blocks, each costing an opcode
+    ops = {parts[0] for parts in instructions}
+    machine.cost = int("int" in ops) + int(bool(ops & {"byte", "addr"}))
+    try:
+        approved = machine.run()
+    except TealError:
+        approved = False
+    if not approved:
+        new_global, new_local = copy.deepcopy(global_state), copy.deepcopy(local_states)
+    if call.on_complete in ("closeout", "clear") and (approved or call.on_complete == "clear"):
+        new_local.pop(call.sender, None)
+    return approved, machine.cost, new_global, new_local
@@ -0,0 +1,756 @@
+"""
+Peephole optimizer for the TEAL the election programs compile to
+
+optimize() rewrites compiled TEAL with three passes:
+  - dead-branch removal: branches on constant conditions are folded, jumps to the next instruction
+    dropped, identical terminal blocks merged and unreachable instructions removed
+  - common-subexpression caching: a side-effect free expression computed more than once in a block,
+    such as the Concat("VotesFor", Itob(...)) tally key, is computed once and reused with dup or
+    from a scratch slot
+  - constant-block consolidation: constants used more than once go into explicit intcblock/bytecblock
+    blocks, most used first so they get the one byte intc_0..3/bytec_0..3 opcodes, constants used
+    once are pushed inline with pushint/pushbytes
+
+compare_programs() checks an optimized approval/clear state program pair against the original by
+differential execution on teal_eval over a random walk of election calls, and measures opcode cost
+per call. optimize_programs() optimizes a pair, refuses it when compare_programs finds a mismatch
+and keeps the original code of any branch the passes would make larger or more expensive.
+deploy.create_vote_app(optimize=True) then assembles both pairs with the node's compile endpoint and
+disassembles the optimized bytecode, and select_assembled checks that disassembly against the
+originals again and deploys whichever bytecode the real assembler made smaller. Behaviour is always
+compared on teal_eval, never on the node's AVM: algosdk has no offline evaluator and dryrun is gone
+from algod's v2 client. Run this file to print the estimated byte size and opcode cost reductions per
+branch; the sizes are computed here from the TEAL (see program_size), not taken from an assembler.
+"""
+
+import random
+
+from algosdk import account
+from algosdk.encoding import decode_address
+from pyteal import compileTeal, Mode
+
+from election_smart_contract import approval_program, clear_state_program
+from teal_eval import AppCall, TealError, assemble, branch_opcodes, evaluate, parse_bytes, parse_int, \
+    parse_program, reachable, resolve_labels, terminal_opcodes
+from teal_stats import branch_labels
+
+# opcodes with one byte immediates, the rest of the sized opcodes are listed in instruction_size
+_one_immediate = ("txn", "global", "load", "store", "arg", "dig", "cover", "uncover", "intc", "bytec",
+                  "asset_holding_get", "asset_params_get", "app_params_get", "gload", "gaid")
+
+# (pops, pushes) of the side-effect free opcodes an expression may contain
+_pure_effects = {
+    "int": (0, 1), "pushint": (0, 1), "byte": (0, 1), "pushbytes": (0, 1), "addr": (0, 1),
+    "intc": (0, 1), "intc_0": (0, 1), "intc_1": (0, 1), "intc_2": (0, 1), "intc_3": (0, 1),
+    "bytec": (0, 1), "bytec_0": (0, 1), "bytec_1": (0, 1), "bytec_2": (0, 1), "bytec_3": (0, 1),
+    "txn": (0, 1), "txna": (0, 1), "load": (0, 1),
+    "+": (2, 1), "-": (2, 1), "*": (2, 1), "/": (2, 1), "%": (2, 1),
+    "<": (2, 1), ">": (2, 1), "<=": (2, 1), ">=": (2, 1), "==": (2, 1), "!=": (2, 1),
+    "&&": (2, 1), "||": (2, 1), "&": (2, 1), "|": (2, 1), "^": (2, 1), "shl": (2, 1), "shr": (2, 1),
+    "concat": (2, 1), "getbyte": (2, 1),
+    "!": (1, 1), "~": (1, 1), "len": (1, 1), "itob": (1, 1), "btoi": (1, 1), "sha256": (1, 1),
+    "extract": (1, 1), "substring": (1, 1),
+    "extract3": (3, 1), "substring3": (3, 1), "select": (3, 1),
+    "dup": (1, 2), "dup2": (2, 4), "swap": (2, 2), "pop": (1, 0),
+}
+
+# global fields that change while a program runs
+_volatile_globals = ("OpcodeBudget",)
+
+
+def varuint_size(value: int) -> int:
+    size = 1
+    while value >= 0x80:
+        value >>= 7
+        size += 1
+    return size
+
+
+def instruction_size(parts) -> int:
+    """Assembled size in bytes of an instruction, the int and byte pseudo opcodes as constant references"""
+    op = parts[0]
+    if op in branch_opcodes or op == "callsub":
+        return 3
+    if op == "pushint":
+        return 1 + varuint_size(parse_int(parts[1]))
+    if op == "pushbytes":
+        value = parse_bytes(parts[1])
+        return 1 + varuint_size(len(value)) + len(value)
+    if op == "intcblock":
+        return 1 + varuint_size(len(parts) - 1) + sum(varuint_size(parse_int(value)) for value in parts[1:])
+    if op == "bytecblock":
+        values = [parse_bytes(value) for value in parts[1:]]
+        return 1 + varuint_size(len(values)) + sum(varuint_size(len(value)) + len(value) for value in values)
+    if op in ("txna", "gtxn", "extract", "substring", "gtxns", "gtxnsa"):
+        return 3
+    if op == "gtxna":
+        return 4
+    if op in _one_immediate or op == "global":
+        return 2
+    return 1
+
+
+def _format_program(version, items) -> str:
+    lines = [f"#pragma version {version}"]
+    for item in items:
+        lines.append(f"{item}:" if isinstance(item, str) else " ".join(item))
+    return "\n".join(lines) + "\n"
+
+
+def _constant_value(item):
+    # the integer an instruction pushes when it is an integer constant, else None
+    if isinstance(item, tuple) and item[0] in ("int", "pushint"):
+        return parse_int(item[1])
+    return None
+
+
+def _fold_constant_branches(items) -> bool:
+    # int 1 / bnz L becomes b L, int 0 / bnz L disappears, likewise for bz
+    for i in range(len(items) - 1):
+        value = _constant_value(items[i])
+        following = items[i + 1]
+        if value is not None and isinstance(following, tuple) and following[0] in ("bnz", "bz"):
+            taken = (value != 0) == (following[0] == "bnz")
+            items[i:i + 2] = [("b", following[1])] if taken else []
+            return True
+    return False
+
+
+def _drop_jumps_to_next(items) -> bool:
+    # b L straight before L:
+    for i, item in enumerate(items):
+        if isinstance(item, tuple) and item[0] == "b":
+            j = i + 1
+            while j < len(items) and isinstance(items[j], str):
+                if items[j] == item[1]:
+                    del items[i]
+                    return True
+                j += 1
+    return False
+
+
+def _merge_duplicate_blocks(items) -> bool:
+    # a terminal block identical to an earlier one and only reached by jumps is replaced by the earlier one
+    blocks = {}
+    i = 0
+    while i < len(items):
+        if isinstance(items[i], str) and (i == 0 or isinstance(items[i - 1], tuple) and
+                                          items[i - 1][0] in terminal_opcodes):
+            start = i
+            while i < len(items) and isinstance(items[i], str):
+                i += 1
+            end = i
+            while end < len(items) and isinstance(items[end], tuple) and items[end][0] not in terminal_opcodes:
+                end += 1
+            if end < len(items) and isinstance(items[end], tuple):
+                body = tuple(items[i:end + 1])
+                if body in blocks:
+                    # the duplicate's labels move next to the original's
+                    moved = items[start:i]
+                    del items[start:end + 1]
+                    items[blocks[body]:blocks[body]] = moved
+                    return True
+                blocks[body] = start
+                i = end + 1
+            continue
+        i += 1
+    return False
+
+
+def _drop_dead_code(items) -> bool:
+    # unreachable instructions, and labels nothing jumps to
+    instructions, labels = resolve_labels(items)
+    live = reachable(instructions, labels, 0, follow_calls=True)
+    kept = []
+    index = 0
+    for item in items:
+        if isinstance(item, str) or index in live:
+            kept.append(item)
+        if not isinstance(item, str):
+            index += 1
+    targets = {item[1] for item in kept if isinstance(item, tuple) and (item[0] in branch_opcodes or
+                                                                        item[0] == "callsub")}
+    kept = [item for item in kept if not isinstance(item, str) or item in targets]
+    if kept == items:
+        return False
+    items[:] = kept
+    return True
+
+
+def remove_dead_branches(teal: str) -> str:
+    """Fold constant conditions, drop jumps to the next instruction, merge identical blocks, drop dead code"""
+    version, items = parse_program(teal)
+    while _fold_constant_branches(items) or _drop_jumps_to_next(items) or _merge_duplicate_blocks(items) \
+            or _drop_dead_code(items):
+        pass
+    return _format_program(version, items)
+
+
+class _Subroutines:
+    """Stack effect, purity and scratch slots written of each subroutine of a program"""
+
+    def __init__(self, items):
+        self.instructions, self.labels = resolve_labels(items)
+        entries = {item[1] for item in self.instructions if item[0] == "callsub"}
+        self.bodies = {entry: self._body(entry) for entry in entries}
+        self.effects = {entry: self._effect(entry) for entry in entries}
+        self.pure = {}
+        self.writes = {}
+        for entry in entries:
+            self._analyse(entry, set())
+        # slots used outside the subroutines may not be shared with them
+        in_subroutines = set().union(*self.bodies.values()) if self.bodies else set()
+        outside_slots = {int(self.instructions[i][1]) for i in range(len(self.instructions))
+                         if i not in in_subroutines and self.instructions[i][0] in ("load", "store")}
+        for entry in entries:
+            if self.writes[entry] & outside_slots:
+                self.pure[entry] = False
+
+    def _body(self, entry):
+        return reachable(self.instructions, self.labels, self.labels[entry])
+
+    def _effect(self, entry):
+        # the smallest (args, returns) consistent with every path through the body
+        for args in range(5):
+            for returns in range(5):
+                if self._consistent(entry, args, returns):
+                    return args, returns
+        return None
+
+    def _consistent(self, entry, args, returns):
+        depths = {}
+        stack = [(self.labels[entry], args)]
+        while stack:
+            index, depth = stack.pop()
+            if index in depths:
+                if depths[index] != depth:
+                    return False
+                continue
+            if index >= len(self.instructions):
+                return False
+            depths[index] = depth
+            parts = self.instructions[index]
+            op = parts[0]
+            if op == "retsub":
+                if depth != returns:
+                    return False
+                continue
+            if op == "callsub":
+                if parts[1] == entry:
+                    pops, pushes = args, returns
+                else:
+                    effect = self._effect(parts[1]) if parts[1] in self.bodies else None
+                    if effect is None:
+                        return False
+                    pops, pushes = effect
+            elif op in ("bnz", "bz", "assert", "store"):
+                pops, pushes = 1, 0
+            elif op in ("b",):
+                pops, pushes = 0, 0
+            elif op in _pure_effects:
+                pops, pushes = _pure_effects[op]
+            elif op == "global":
+                pops, pushes = 0, 1
+            else:
+                return False
+            if depth < pops:
+                return False
+            depth += pushes - pops
+            if op in branch_opcodes:
+                stack.append((self.labels[parts[1]], depth))
+            if op not in terminal_opcodes:
+                stack.append((index + 1, depth))
+        return True
+
+    def _analyse(self, entry, visiting):
+        if entry in self.pure:
+            return
+        visiting.add(entry)
+        pure = self.effects[entry] is not None
+        writes = set()
+        for index in self.bodies[entry]:
+            parts = self.instructions[index]
+            op = parts[0]
+            if op == "store":
+                writes.add(int(parts[1]))
+            elif op == "callsub":
+                if parts[1] in visiting:
+                    continue
+                self._analyse(parts[1], visiting)
+                pure = pure and self.pure[parts[1]]
+                writes |= self.writes[parts[1]]
+            elif op == "global":
+                pure = pure and parts[1] not in _volatile_globals
+            elif op not in _pure_effects and op not in ("retsub", "assert") + branch_opcodes:
+                pure = False
+        visiting.discard(entry)
+        self.pure[entry] = pure
+        self.writes[entry] = writes
+
+
+def _effect(parts, subroutines):
+    # (pops, pushes) if the instruction may be part of a cached expression, else None
+    op = parts[0]
+    if op == "callsub":
+        return subroutines.effects[parts[1]] if subroutines.pure.get(parts[1]) else None
+    if op == "global":
+        return None if parts[1] in _volatile_globals else (0, 1)
+    return _pure_effects.get(op)
+
+
+def _writes(parts, subroutines):
+    # scratch slots an instruction may write
+    if parts[0] == "store":
+        return {int(parts[1])}
+    if parts[0] == "callsub" and parts[1] in subroutines.writes:
+        return subroutines.writes[parts[1]]
+    return set()
+
+
+def _cost(instructions, subroutines):
+    # static estimate: a call to a subroutine counts the instructions of its body
+    return sum(len(subroutines.bodies[parts[1]]) + 1 if parts[0] == "callsub" else 1 for parts in instructions)
+
+
+def _blocks(items):
+    # (start, end) item ranges of the straight-line runs an expression can be cached within
+    blocks = []
+    start = 0
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            blocks.append((start, i))
+            start = i + 1
+        elif item[0] in branch_opcodes or item[0] in terminal_opcodes:
+            blocks.append((start, i + 1))
+            start = i + 1
+    blocks.append((start, len(items)))
+    return [(start, end) for start, end in blocks if end > start]
+
+
+def _kept_positions(items, keep):
+    # positions in items of the instructions reachable from the labels in keep, without entering subroutines
+    instructions, labels = resolve_labels(items)
+    kept = set()
+    for label in keep:
+        if label in labels:
+            kept |= reachable(instructions, labels, labels[label])
+    positions = set()
+    index = 0
+    for position, item in enumerate(items):
+        if not isinstance(item, str):
+            if index in kept:
+                positions.add(position)
+            index += 1
+    return positions
+
+
+def _best_cache(items, subroutines, keep=()):
+    # the caching with the highest opcode cost saving, as (start, occurrences, expression length)
+    best = None
+    kept = _kept_positions(items, keep)
+    for block_start, block_end in _blocks(items):
+        if any(position in kept for position in range(block_start, block_end)):
+            continue
+        block = items[block_start:block_end]
+        occurrences = {}
+        for i in range(len(block)):
+            depth = 0
+            for j in range(i, len(block)):
+                effect = _effect(block[j], subroutines)
+                if effect is None or depth < effect[0]:
+                    break
+                depth += effect[1] - effect[0]
+                if depth == 1 and j > i and block[j][0] not in ("dup", "dup2", "swap", "pop"):
+                    occurrences.setdefault(tuple(block[i:j + 1]), []).append(i)
+
+        for expression, starts in occurrences.items():
+            reads = {int(parts[1]) for parts in expression if parts[0] == "load"}
+            chain = []
+            for start in starts:
+                if chain and start < chain[-1] + len(expression):
+                    continue
+                if chain:
+                    between = block[chain[-1] + len(expression):start]
+                    if any(_writes(parts, subroutines) & reads for parts in between):
+                        chain = []
+                chain.append(start)
+            if len(chain) < 2:
+                continue
+            adjacent = [start == previous + len(expression) for previous, start in zip(chain, chain[1:])]
+            stored = not all(adjacent)
+            cost_saved = (len(chain) - 1) * (_cost(expression, subroutines) - 1) - (2 if stored else 0)
+            size = sum(instruction_size(parts) for parts in expression)
+            bytes_saved = sum(size - (1 if is_adjacent else 2) for is_adjacent in adjacent) - (3 if stored else 0)
+            if cost_saved > 0 and bytes_saved >= 0 and (best is None or cost_saved > best[0]):
+                best = (cost_saved, block_start, chain, expression, adjacent)
+    return best
+
+
+def cache_common_subexpressions(teal: str, keep=()) -> str:
+    """
+    Compute repeated side-effect free expressions of a block once, reusing them with dup or a scratch slot
+    Blocks reachable from the labels in keep are left as they are
+    """
+    version, items = parse_program(teal)
+    while True:
+        subroutines = _Subroutines(items)
+        best = _best_cache(items, subroutines, keep)
+        if best is None:
+            break
+        _, block_start, chain, expression, adjacent = best
+        used = {int(item[1]) for item in items if isinstance(item, tuple) and item[0] in ("load", "store")}
+        used |= set().union(*subroutines.writes.values()) if subroutines.writes else set()
+        slot = max(used, default=-1) + 1
+        stored = not all(adjacent)
+        if stored and slot > 255:
+            break
+        # rewrite from the last occurrence so earlier positions stay valid
+        for start, is_adjacent in reversed(list(zip(chain[1:], adjacent))):
+            position = block_start + start
+            items[position:position + len(expression)] = [("dup",) if is_adjacent else ("load", str(slot))]
+        if stored:
+            position = block_start + chain[0] + len(expression)
+            items[position:position] = [("dup",), ("store", str(slot))]
+    return _format_program(version, items)
+
+
+def _format_bytes(value: bytes) -> str:
+    text = value.decode("ascii", errors="replace")
+    if value.isascii() and text.isprintable() and '"' not in text and "\\" not in text:
+        return f'"{text}"'
+    return "0x" + value.hex()
+
+
+def consolidate_constants(teal: str, pinned=()) -> str:
+    """
+    Replace the int and byte pseudo opcodes with explicit constant blocks ordered by use,
+    pushing constants used once inline; the int and bytes values in pinned always go in the blocks
+    """
+    version, items = parse_program(teal)
+    instructions = [item for item in items if isinstance(item, tuple)]
+    if any(parts[0] in ("intcblock", "bytecblock", "intc", "bytec") or parts[0].startswith(("intc_", "bytec_"))
+           for parts in instructions):
+        # the program manages its own constant blocks
+        return teal
+
+    def plan(values, reference_size, push_size, entry_size):
+        # most used constants first; each goes where it costs fewer bytes
+        counts = {}
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+        block = []
+        for value, count in sorted(counts.items(), key=lambda item: -item[1]):
+            in_block = entry_size(value) + count * reference_size(len(block))
+            if version < 3 or value in pinned or in_block < count * push_size(value):
+                block.append(value)
+        return block
+
+    int_values = [parse_int(parts[1]) for parts in instructions if parts[0] == "int"]
+    byte_values = [parse_bytes(parts[1]) for parts in instructions if parts[0] == "byte"]
+    int_block = plan(int_values, lambda index: 1 if index < 4 else 2,
+                     lambda value: 1 + varuint_size(value), varuint_size)
+    byte_block = plan(byte_values, lambda index: 1 if index < 4 else 2,
+                      lambda value: 1 + varuint_size(len(value)) + len(value),
+                      lambda value: varuint_size(len(value)) + len(value))
+    int_index = {value: i for i, value in enumerate(int_block)}
+    byte_index = {value: i for i, value in enumerate(byte_block)}
+
+    def reference(kind, index):
+        return (f"{kind}_{index}",) if index < 4 else (kind, str(index))
+
+    rewritten = []
+    if int_block:
+        rewritten.append(("intcblock",) + tuple(str(value) for value in int_block))
+    if byte_block:
+        rewritten.append(("bytecblock",) + tuple(_format_bytes(value) for value in byte_block))
+    for item in items:
+        if isinstance(item, tuple) and item[0] == "int":
+            value = parse_int(item[1])
+            item = reference("intc", int_index[value]) if value in int_index else ("pushint", str(value))
+        elif isinstance(item, tuple) and item[0] == "byte":
+            value = parse_bytes(item[1])
+            item = reference("bytec", byte_index[value]) if value in byte_index else ("pushbytes", _format_bytes(value))
+        rewritten.append(item)
+    return _format_program(version, rewritten)
+
+
+def optimize(teal: str, keep=()) -> str:
+    """
+    Run all optimization passes over compiled TEAL
+    The code reachable from the labels in keep is not rewritten and keeps its constants in the constant
+    blocks, as the assembler's implicit blocks held them
+    """
+    pinned = set()
+    instructions, labels = assemble(teal)
+    for label in keep:
+        for index in reachable(instructions, labels, labels[label]):
+            parts = instructions[index]
+            if parts[0] == "int":
+                pinned.add(parse_int(parts[1]))
+            elif parts[0] == "byte":
+                pinned.add(parse_bytes(parts[1]))
+    teal = remove_dead_branches(teal)
+    teal = cache_common_subexpressions(teal, keep)
+    # caching can leave jumps and blocks to clean up
+    teal = remove_dead_branches(teal)
+    return consolidate_constants(teal, pinned)
+
+
+def _sizes(teal: str):
+    # (bytes of the constant blocks, bytes of each instruction); int and byte pseudo opcodes are
+    # referenced from implicit constant blocks in order of first use, without the assembler's
+    # optional constant reordering
+    instructions, _ = assemble(teal)
+    ints = []
+    byte_values = []
+    for parts in instructions:
+        if parts[0] == "int" and parse_int(parts[1]) not in ints:
+            ints.append(parse_int(parts[1]))
+        elif parts[0] == "byte" and parse_bytes(parts[1]) not in byte_values:
+            byte_values.append(parse_bytes(parts[1]))
+    block_size = 0
+    if ints:
+        block_size += instruction_size(("intcblock",) + tuple(str(value) for value in ints))
+    if byte_values:
+        block_size += instruction_size(("bytecblock",) + tuple("0x" + value.hex() for value in byte_values))
+    sizes = []
+    for parts in instructions:
+        if parts[0] == "int":
+            sizes.append(1 if ints.index(parse_int(parts[1])) < 4 else 2)
+        elif parts[0] == "byte":
+            sizes.append(1 if byte_values.index(parse_bytes(parts[1])) < 4 else 2)
+        elif parts[0] in ("intcblock", "bytecblock"):
+            block_size += instruction_size(parts)
+            sizes.append(0)
+        else:
+            sizes.append(instruction_size(parts))
+    return block_size, sizes
+
+
+def program_size(teal: str) -> int:
+    """Estimated assembled size of a program in bytes, without the assembler's constant reordering"""
+    block_size, sizes = _sizes(teal)
+    return 1 + block_size + sum(sizes)
+
+
+def constant_block_size(teal: str) -> int:
+    """Bytes of a program's constant blocks, explicit or emitted by the assembler for pseudo opcodes"""
+    return _sizes(teal)[0]
+
+
+def branch_sizes(teal: str, labels: dict) -> dict:
+    """Bytes of the instructions reachable from each branch label without entering subroutines"""
+    instructions, label_indexes = assemble(teal)
+    _, instruction_sizes = _sizes(teal)
+    return {branch: sum(instruction_sizes[i] for i in reachable(instructions, label_indexes, label_indexes[label]))
+            for branch, label in labels.items()}
+
+
+def _uint(value: int) -> bytes:
+    return value.to_bytes(8, "big")
+
+
+def _random_call(rng, state, creator, voters):
+    # an election call with a mix of valid and invalid arguments, senders and rounds
+    global_state, local_states, election_end = state
+    opted_in = [voter for voter in voters if voter in local_states]
+    sender = rng.choice(opted_in) if opted_in and rng.random() < 0.7 else rng.choice(voters + [creator])
+    round = election_end - 1 - rng.randrange(5) if rng.random() < 0.85 else election_end + rng.randrange(3)
+    num_vote_options = global_state.get(b"NumVoteOptions", 3)
+    # deletes end the walk's election, so they are kept rare
+    kind = rng.choices(["optin", "update_user_status", "vote", "closeout", "clear", "finalize", "add_approver",
+                        "remove_approver", "delete", "update", "unknown"], [3, 3, 4, 1, 1, 0.5, 0.5, 0.3, 0.2, 0.3, 0.3])[0]
+    if kind in ("optin", "closeout", "clear"):
+        return AppCall(sender, kind, creator=creator, round=round)
+    if kind in ("delete", "update"):
+        return AppCall(creator if rng.random() < 0.5 else sender, kind, creator=creator, round=round)
+    if kind == "update_user_status":
+        user = sender
+        status = rng.choice([b"yes", b"yes", b"no", b"maybe"])
+        args = [b"update_user_status", decode_address(user), status]
+        if rng.random() < 0.1:
+            args = args[:rng.randrange(3)]
+        approver = rng.choice(voters)
+        sender = creator if rng.random() < 0.6 else rng.choice([sender, approver])
+        return AppCall(sender, "noop", args, accounts=[user], creator=creator, round=round)
+    if kind == "vote":
+        choice = rng.randrange(num_vote_options + 1)
+        args = [b"vote", _uint(choice) if rng.random() < 0.9 else bytes(9)]
+        if rng.random() < 0.05:
+            args = args[:1]
+        return AppCall(sender, "noop", args, creator=creator, round=round)
+    if kind == "finalize":
+        return AppCall(sender, "noop", [b"finalize"], creator=creator, round=round)
+    if kind in ("add_approver", "remove_approver"):
+        args = [kind.encode(), decode_address(rng.choice(voters))]
+        if rng.random() < 0.05:
+            args = args[:1] if rng.random() < 0.5 else [args[0], args[1][:31]]
+        return AppCall(creator if rng.random() < 0.85 else sender, "noop", args, creator=creator, round=round)
+    return AppCall(sender, "noop", [rng.choice([b"tally", b""])], creator=creator, round=round)
+
+
+def _random_create(rng, creator):
+    election_end = 100 + rng.randrange(50)
+    num_vote_options = rng.randrange(1, 6)
+    args = [_uint(election_end), _uint(num_vote_options), ",".join("ABCDEF"[:num_vote_options]).encode()]
+    if rng.random() < 0.3:
+        num_shards = rng.randrange(1, 4)
+        args += [_uint(rng.randrange(num_shards)), _uint(num_shards)]
+    return AppCall(creator, "create", args, round=election_end - 50), election_end
+
+
+def compare_programs(original, optimized, original_clear, optimized_clear, steps=2000, seed=0):
+    """
+    Run the same random walk of election calls through both approval/clear state program pairs
+    Return (mismatches, costs): descriptions of the calls the programs disagree on, in approval
+    or resulting state, and the opcode costs of the approved calls per call kind as
+    {kind: ([original costs], [optimized costs])}
+    """
+    rng = random.Random(seed)
+    programs = [(assemble(original), assemble(original_clear)), (assemble(optimized), assemble(optimized_clear))]
+    creator = account.generate_account()[1]
+    voters = [account.generate_account()[1] for _ in range(8)]
+    mismatches = []
+    costs = {}
+    state = None
+    for step in range(steps):
+        if state is None or rng.random() < 0.02:
+            call, election_end = _random_create(rng, creator)
+            state = ({}, {}, election_end)
+        else:
+            call = _random_call(rng, state, creator, voters)
+        global_state, local_states, election_end = state
+        kind = call.app_args[0].decode() if call.on_complete == "noop" and call.app_args else call.on_complete
+        results = []
+        for approval, clear in programs:
+            try:
+                results.append(evaluate(clear if call.on_complete == "clear" else approval,
+                                        call, global_state, local_states))
+            except TealError as e:
+                # the call cannot be made at all, e.g. opting in twice
+                results.append((None, 0, global_state, local_states, str(e)))
+        (approved, cost, new_global, new_local, *_), optimized_result = results
+        if (approved, new_global, new_local) != (optimized_result[0], optimized_result[2], optimized_result[3]):
+            mismatches.append(f"step {step}: {kind} from {call.sender} in round {call.round}")
+        if approved:
+            costs.setdefault(kind, ([], []))
+            costs[kind][0].append(cost)
+            costs[kind][1].append(optimized_result[1])
+        if call.on_complete == "delete" and approved:
+            state = None
+        elif approved is not None:
+            state = (new_global, new_local, election_end)
+    return mismatches, costs
+
+
+def check_optimized(original, optimized, original_clear, optimized_clear, steps=2000, seed=0):
+    """
+    Raise ValueError if compare_programs finds a call the optimized program pair handles differently
+    """
+    mismatches, _ = compare_programs(original, optimized, original_clear, optimized_clear, steps, seed)
+    if mismatches:
+        raise ValueError(f"optimized programs differ from the originals in {len(mismatches)} calls, "
+                         f"first {mismatches[0]}")
+
+
+# the call kind compare_programs reports the costs of each branch under
+_branch_kinds = {"create": "create", "DeleteApplication": "delete", "UpdateApplication": "update",
+                 "CloseOut": "closeout", "OptIn": "optin", "clear state": "clear"}
+
+
+def branch_changes(original, optimized, original_clear, optimized_clear, costs) -> dict:
+    """
+    Return {branch: (bytes before, bytes after, mean cost before, mean cost after)} for each branch of
+    the approval program and for "clear state", with costs as returned by compare_programs
+    A cost is None when the walk approved no call of the branch
+    """
+    labels = branch_labels(original)
+    original_sizes = branch_sizes(original, labels)
+    optimized_sizes = branch_sizes(optimized, labels)
+    sizes = {branch: (original_sizes[branch], optimized_sizes[branch]) for branch in labels}
+    sizes["clear state"] = (program_size(original_clear), program_size(optimized_clear))
+    changes = {}
+    for branch, (before, after) in sizes.items():
+        kind = _branch_kinds.get(branch, branch)
+        before_cost = after_cost = None
+        if kind in costs:
+            original_costs, optimized_costs = costs[kind]
+            before_cost = sum(original_costs) / len(original_costs)
+            after_cost = sum(optimized_costs) / len(optimized_costs)
+        changes[branch] = (before, after, before_cost, after_cost)
+    return changes
+
+
+def regressions(changes: dict) -> list:
+    """Return the branches of branch_changes that got larger or more expensive"""
+    return [branch for branch, (before, after, before_cost, after_cost) in changes.items()
+            if after > before or before_cost is not None and after_cost > before_cost]
+
+
+def optimize_programs(approval, clear, steps=2000, seed=0):
+    """
+    Optimize an approval/clear state program pair and return the optimized TEAL once check_optimized passes
+    Each branch of the approval program is compared before and after: a branch the optimization makes
+    larger or more expensive keeps its original code and constants, and the clear state program is kept
+    as it is unless it gets smaller and no more expensive
+    """
+    keep = set()
+    labels = branch_labels(approval)
+    while True:
+        optimized_approval = optimize(approval, keep)
+        optimized_clear = optimize(clear)
+        mismatches, costs = compare_programs(approval, optimized_approval, clear, optimized_clear, steps, seed)
+        if mismatches:
+            raise ValueError(f"optimized programs differ from the originals in {len(mismatches)} calls, "
+                             f"first {mismatches[0]}")
+        worse = regressions(branch_changes(approval, optimized_approval, clear, optimized_clear, costs))
+        if "clear state" in worse:
+            optimized_clear = clear
+            worse.remove("clear state")
+        added = {labels[branch] for branch in worse} - keep
+        if not worse:
+            return optimized_approval, optimized_clear
+        if not added:
+            # keeping the regressed branches did not help, e.g. their constants got worse block indexes
+            return approval, optimized_clear
+        keep |= added
+
+
+def select_assembled(approval, clear, assembled, steps=2000, seed=0):
+    """
+    Return the (approval, clear state) bytecode to deploy from what the node's assembler built
+    assembled holds (original bytecode, optimized bytecode, disassembly of the optimized bytecode) for the
+    approval and the clear state program. The disassembled programs, the code that would actually be
+    deployed, must pass check_optimized against the original TEAL; an optimized program the assembler
+    did not make smaller is replaced by the original's bytecode
+    """
+    (approval_bytes, optimized_approval_bytes, approval_disassembly), \
+        (clear_bytes, optimized_clear_bytes, clear_disassembly) = assembled
+    check_optimized(approval, approval_disassembly, clear, clear_disassembly, steps, seed)
+    return (optimized_approval_bytes if len(optimized_approval_bytes) < len(approval_bytes) else approval_bytes,
+            optimized_clear_bytes if len(optimized_clear_bytes) < len(clear_bytes) else clear_bytes)
+
+
+def main():
+    print(f"{'program':<10} {'branch':<20} {'est. bytes':>14} {'saved':>6} {'mean cost':>14} {'saved':>6}")
+    for name, compact_status in (("default", False), ("compact", True)):
+        approval = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+        clear = compileTeal(clear_state_program(compact_status), mode=Mode.Application, version=5)
+        optimized_approval, optimized_clear = optimize_programs(approval, clear)
+
+        _, costs = compare_programs(approval, optimized_approval, clear, optimized_clear)
+        rows = branch_changes(approval, optimized_approval, clear, optimized_clear, costs)
+        rows["constant blocks"] = (constant_block_size(approval), constant_block_size(optimized_approval), None, None)
+        rows["whole approval"] = (program_size(approval), program_size(optimized_approval), None, None)
+        for branch, (before, after, before_cost, after_cost) in rows.items():
+            cost = "-"
+            cost_saved = "-"
+            if before_cost is not None:
+                cost = f"{before_cost:.1f} -> {after_cost:.1f}"
+                cost_saved = f"{before_cost - after_cost:.1f}"
+            print(f"{name:<10} {branch:<20} {f'{before} -> {after}':>14} {before - after:>6} {cost:>14} "
+                  f"{cost_saved:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Size and storage statistics of the compiled election programs
+
+Run this file to compare the default can_vote/voted voter layout with the compact single-uint
+status layout: opcodes per approval program branch and the minimum balance each voter must hold.
+
+The compact layout is not smaller everywhere. Decoding the packed status costs more opcodes than
+reading can_vote and voted, so closeout and clear state are a few opcodes larger, and
+update_user_status grows further because it must reject decisions other than "yes" and "no",
+which the default layout stores as they are. The report lists these branches as regressions;
+what the compact layout saves is the per-voter minimum balance.
+"""
+
+from pyteal import compileTeal, Mode
+
+from election_params import local_ints, local_bytes, compact_local_ints, compact_local_bytes
+from election_smart_contract import approval_program, clear_state_program
+from teal_eval import assemble, reachable
+
+# minimum balance requirements in microAlgos, see the Algorand smart contract docs
+opt_in_min_balance = 100000
+local_entry_min_balance = 25000
+local_uint_min_balance = 3500
+local_bytes_min_balance = 25000
+
+def _branch_name(instructions, bnz_index):
+    # the dispatch compares against a constant right before each bnz
+    constant = instructions[bnz_index - 2][1]
+    if constant == "0" and instructions[bnz_index - 3] == ("txn", "ApplicationID"):
+        return "create"
+    return constant.strip('"')
+
+
+def branch_labels(teal: str) -> dict:
+    """Return the label each branch of the approval program's main conditional jumps to"""
+    instructions, _ = assemble(teal)
+    branches = {}
+    for index, parts in enumerate(instructions):
+        if parts[0] == "err":
+            # the main conditional ends with err when no branch matches
+            break
+        if parts[0] == "bnz":
+            branches[_branch_name(instructions, index)] = parts[1]
+    return branches
+
+
+def branch_entries(teal: str) -> dict:
+    """Return the instruction index each branch of the approval program's main conditional starts at"""
+    _, labels = assemble(teal)
+    return {branch: labels[label] for branch, label in branch_labels(teal).items()}
+
+
+def branch_opcode_counts(teal: str) -> dict:
+    """
+    Return (opcodes, callsubs) reachable from each branch of the approval program's main conditional,
+    e.g. {"create": (31, 1), "vote": (59, 2), ...}; a callsub counts as one opcode
+    """
+    instructions, labels = assemble(teal)
+    counts = {}
+    for branch, entry in branch_entries(teal).items():
+        indexes = reachable(instructions, labels, entry)
+        callsubs = sum(1 for index in indexes if instructions[index][0] == "callsub")
+        counts[branch] = (len(indexes), callsubs)
+    return counts
+
+
+def voter_min_balance(ints: int, byte_slices: int) -> int:
+    """Return the minimum balance in microAlgos a voter needs to opt in with the given local schema"""
+    return (
+        opt_in_min_balance
+        + ints * (local_entry_min_balance + local_uint_min_balance)
+        + byte_slices * (local_entry_min_balance + local_bytes_min_balance)
+    )
+
+
+def main():
+    layouts = {}
+    for name, compact_status in (("default", False), ("compact", True)):
+        approval = compileTeal(approval_program(compact_status), mode=Mode.Application, version=5)
+        clear = compileTeal(clear_state_program(compact_status), mode=Mode.Application, version=5)
+        counts = branch_opcode_counts(approval)
+        instructions, labels = assemble(clear)
+        indexes = reachable(instructions, labels, 0)
+        counts["clear state"] = (len(indexes), sum(1 for i in indexes if instructions[i][0] == "callsub"))
+        layouts[name] = counts
+
+    # each itoa callsub runs a further ~20 opcodes per digit, so callsubs are listed separately
+    print(f"{'branch':<20} {'default':>8} {'compact':>8} {'saved':>8} {'callsubs':>10}")
+    for branch, (default_count, default_callsubs) in layouts["default"].items():
+        compact_count, compact_callsubs = layouts["compact"][branch]
+        print(f"{branch:<20} {default_count:>8} {compact_count:>8} {default_count - compact_count:>8} "
+              f"{default_callsubs:>4} -> {compact_callsubs}")
+    regressions = [branch for branch, (count, _) in layouts["compact"].items() if count > layouts["default"][branch][0]]
+    if regressions:
+        print(f"regressions: the compact layout is larger in {', '.join(regressions)}")
+
+    default_balance = voter_min_balance(local_ints, local_bytes)
+    compact_balance = voter_min_balance(compact_local_ints, compact_local_bytes)
+    print()
+    print(f"voter minimum balance: default {default_balance} microAlgos, compact {compact_balance} microAlgos, "
+          f"saved {default_balance - compact_balance} microAlgos per voter")
+
+
+if __name__ == "__main__":
+    main()